@@ -0,0 +1,349 @@
+"""
+Activos estáticos propios: CSS, JavaScript, fuentes e imágenes servidos sin CDN.
+
+`descargar_dependencias()` trae una sola vez (con red) las versiones fijadas de
+Bootstrap, Font Awesome, Inter y Chart.js a static/vendor/, junto con las
+fuentes que referencian sus hojas de estilo; esa carpeta se versiona para que
+la construcción funcione sin conexión. `construir()` arma los paquetes de
+BUNDLES, publica cada archivo en static/dist/ con el hash de su contenido en
+el nombre, genera las variantes .gz y .br, las variantes WebP de las imágenes
+y el manifiesto que usa `asset()` en las plantillas. Lo publicado en dist/ no
+cambia nunca de contenido y se sirve con caché inmutable de un año.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.parse
+import urllib.request
+
+from flask import abort, request, send_file, url_for
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Sin brotli se publican solo las variantes .gz
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Sin Pillow las imágenes se publican sin variantes WebP
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# No todos los sistemas los registran
+mimetypes.add_type('font/woff2', '.woff2')
+mimetypes.add_type('image/webp', '.webp')
+
+# Destino en static/vendor/ -> URL de la versión fijada
+DEPENDENCIAS = {
+    'bootstrap/bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'bootstrap/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'fontawesome/css/all.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+    'inter/inter.css': 'https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap',
+    'chartjs/chart.umd.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js',
+}
+
+# Paquete publicado -> archivos de static/ que lo componen, en orden
+BUNDLES = {
+    'css/app.css': [
+        'vendor/bootstrap/bootstrap.min.css',
+        'vendor/fontawesome/css/all.min.css',
+        'vendor/inter/inter.css',
+        'src/css/base.css',
+    ],
+    'js/app.js': [
+        'vendor/bootstrap/bootstrap.bundle.min.js',
+        'src/js/base.js',
+    ],
+    'js/graficos.js': [
+        'vendor/chartjs/chart.umd.js',
+    ],
+}
+
+# Imagen de static/ -> lados mayores (px) de sus variantes WebP
+IMAGENES = {
+    'images/university_logo.jpg': (64, 128, 256, 512),
+}
+
+CALIDAD_WEBP = 80
+COMPRIMIBLES = {'.css', '.js', '.svg', '.ttf', '.eot', '.json'}
+UN_ANIO = 365 * 24 * 3600
+
+# Google Fonts entrega woff2 solo a navegadores que lo anuncian
+_AGENTE = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+_URL_CSS = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_MAPA_FUENTE = re.compile(r'^\s*(/\*# sourceMappingURL=.*?\*/|//# sourceMappingURL=.*)$', re.MULTILINE)
+
+
+def _descargar(url):
+    solicitud = urllib.request.Request(url, headers={'User-Agent': _AGENTE})
+    with urllib.request.urlopen(solicitud, timeout=30) as respuesta:
+        return respuesta.read()
+
+
+def _referencias_css(css):
+    """URLs de recursos (fuentes, imágenes) que referencia una hoja de estilo"""
+    return [ref for _, ref in _URL_CSS.findall(css) if not ref.startswith(('data:', '#'))]
+
+
+def descargar_dependencias(carpeta_static):
+    """Descarga DEPENDENCIAS a static/vendor/ con los recursos que referencian sus CSS; retorna los archivos escritos"""
+    vendor = os.path.join(carpeta_static, 'vendor')
+    escritos = []
+
+    def guardar(relativa, datos):
+        destino = os.path.join(vendor, *relativa.split('/'))
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with open(destino, 'wb') as archivo:
+            archivo.write(datos)
+        escritos.append(relativa)
+
+    for relativa, url in DEPENDENCIAS.items():
+        datos = _descargar(url)
+        if relativa.endswith('.css'):
+            css = datos.decode('utf-8')
+            directorio = posixpath.dirname(relativa)
+            reemplazos = {}
+            for ref in dict.fromkeys(_referencias_css(css)):
+                ruta = urllib.parse.urlsplit(ref).path
+                if urllib.parse.urlsplit(ref).netloc:
+                    # Recurso de otro servidor (fonts.gstatic.com): se guarda junto al CSS
+                    local = f'fuentes/{posixpath.basename(ruta)}'
+                    reemplazos[ref] = local
+                else:
+                    local = ruta
+                guardar(posixpath.normpath(posixpath.join(directorio, local)),
+                        _descargar(urllib.parse.urljoin(url, ref)))
+            css = _URL_CSS.sub(lambda m: f'url({reemplazos.get(m.group(2), m.group(2))})', css)
+            datos = css.encode('utf-8')
+        guardar(relativa, datos)
+    return escritos
+
+
+class Constructor:
+    """Publica archivos de static/ en static/dist/ con el hash del contenido en el nombre"""
+
+    def __init__(self, carpeta_static):
+        self.static = carpeta_static
+        self.dist = os.path.join(carpeta_static, 'dist')
+        self.archivos = {}
+        self.variantes = {}
+        self.bytes = {'original': 0, 'gzip': 0, 'brotli': 0}
+
+    def _leer(self, relativa):
+        with open(os.path.join(self.static, *relativa.split('/')), 'rb') as archivo:
+            return archivo.read()
+
+    def publicar(self, nombre, datos):
+        """Escribe `datos` como dist/<nombre con hash> (y sus comprimidos); retorna la ruta dentro de dist/"""
+        if nombre in self.archivos:
+            return self.archivos[nombre]
+        base, extension = posixpath.splitext(nombre)
+        publicado = f'{base}.{hashlib.sha256(datos).hexdigest()[:10]}{extension}'
+        destino = os.path.join(self.dist, *publicado.split('/'))
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with open(destino, 'wb') as archivo:
+            archivo.write(datos)
+
+        if extension in COMPRIMIBLES:
+            self.bytes['original'] += len(datos)
+            # mtime=0: el mismo contenido produce siempre el mismo .gz
+            comprimidos = [('.gz', 'gzip', gzip.compress(datos, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                comprimidos.append(('.br', 'brotli', brotli.compress(datos, quality=11)))
+            for sufijo, algoritmo, comprimido in comprimidos:
+                if len(comprimido) < len(datos):
+                    with open(destino + sufijo, 'wb') as archivo:
+                        archivo.write(comprimido)
+                    self.bytes[algoritmo] += len(comprimido)
+        self.archivos[nombre] = publicado
+        return publicado
+
+    def _css(self, relativa, destino):
+        """CSS con sus url() apuntando a los recursos ya publicados, relativas al paquete `destino`"""
+        css = _MAPA_FUENTE.sub('', self._leer(relativa).decode('utf-8'))
+        directorio = posixpath.dirname(relativa)
+
+        def reemplazar(coincidencia):
+            ref = coincidencia.group(2)
+            if ref.startswith(('data:', '#')) or urllib.parse.urlsplit(ref).netloc:
+                return coincidencia.group(0)
+            partes = urllib.parse.urlsplit(ref)
+            recurso = posixpath.normpath(posixpath.join(directorio, partes.path))
+            publicado = self.publicar(recurso, self._leer(recurso))
+            nueva = posixpath.relpath(publicado, posixpath.dirname(destino))
+            if partes.query:
+                nueva += '?' + partes.query
+            if partes.fragment:
+                nueva += '#' + partes.fragment
+            return f'url({nueva})'
+
+        return _URL_CSS.sub(reemplazar, css)
+
+    def paquete(self, destino, fuentes):
+        if destino.endswith('.css'):
+            partes = [self._css(fuente, destino) for fuente in fuentes]
+            separador = '\n'
+        else:
+            partes = [_MAPA_FUENTE.sub('', self._leer(fuente).decode('utf-8')) for fuente in fuentes]
+            # Un archivo sin ; final no debe fundirse con el siguiente
+            separador = '\n;\n'
+        return self.publicar(destino, separador.join(partes).encode('utf-8'))
+
+    def imagen(self, relativa, lados):
+        datos = self._leer(relativa)
+        self.publicar(relativa, datos)
+        if Image is None:
+            logger.warning("Pillow no está instalado: %s se publica sin variantes WebP", relativa)
+            return
+        base = posixpath.splitext(relativa)[0]
+        variantes = {}
+        with Image.open(io.BytesIO(datos)) as original:
+            for lado in lados:
+                copia = original.copy()
+                copia.thumbnail((lado, lado), Image.LANCZOS)
+                salida = io.BytesIO()
+                copia.save(salida, 'WEBP', quality=CALIDAD_WEBP, method=6)
+                nombre = f'{base}-{lado}.webp'
+                self.publicar(nombre, salida.getvalue())
+                variantes[lado] = nombre
+        self.variantes[relativa] = variantes
+
+    def manifiesto(self):
+        datos = {'archivos': self.archivos, 'variantes': self.variantes}
+        with open(os.path.join(self.dist, 'manifest.json'), 'w', encoding='utf-8') as archivo:
+            json.dump(datos, archivo, indent=2, sort_keys=True)
+        return datos
+
+
+def construir(carpeta_static):
+    """Publica BUNDLES e IMAGENES en static/dist/ y escribe el manifiesto; retorna un resumen"""
+    faltantes = [fuente for fuentes in BUNDLES.values() for fuente in fuentes
+                 if not os.path.isfile(os.path.join(carpeta_static, *fuente.split('/')))]
+    if faltantes:
+        raise FileNotFoundError("Faltan archivos de static/: {} (ejecutar con --descargar)".format(', '.join(faltantes)))
+
+    constructor = Constructor(carpeta_static)
+    for destino, fuentes in BUNDLES.items():
+        constructor.paquete(destino, fuentes)
+    for relativa, lados in IMAGENES.items():
+        constructor.imagen(relativa, lados)
+    constructor.manifiesto()
+    return {'archivos': len(constructor.archivos), **constructor.bytes}
+
+
+class Activos:
+    """Resuelve nombres lógicos (`css/app.css`) a los archivos publicados y los sirve.
+
+    Los archivos de dist/ se entregan ya comprimidos según Accept-Encoding
+    (brotli antes que gzip) y con Cache-Control inmutable: su nombre cambia
+    con el contenido, así que el navegador nunca necesita revalidarlos.
+    """
+
+    def __init__(self):
+        self.carpeta_static = None
+        self.carpeta_dist = None
+        self.archivos = {}
+        self.variantes = {}
+        self._avisados = set()
+
+    def init_app(self, app):
+        self.carpeta_static = app.static_folder
+        self.carpeta_dist = os.path.join(app.static_folder, 'dist')
+        self.cargar_manifiesto()
+        app.add_url_rule(f'{app.static_url_path}/dist/<path:nombre>', endpoint='activo', view_func=self.servir)
+        app.add_template_global(self.asset, 'asset')
+        app.add_template_global(self.etiquetas, 'etiquetas_activo')
+        app.add_template_global(self.srcset_webp, 'srcset_webp')
+
+    def cargar_manifiesto(self):
+        try:
+            with open(os.path.join(self.carpeta_dist, 'manifest.json'), encoding='utf-8') as archivo:
+                datos = json.load(archivo)
+        except FileNotFoundError:
+            datos = {}
+        self.archivos = datos.get('archivos', {})
+        self.variantes = {nombre: {int(lado): variante for lado, variante in lados.items()}
+                          for nombre, lados in datos.get('variantes', {}).items()}
+
+    def asset(self, nombre):
+        """URL del archivo publicado para el nombre lógico"""
+        publicado = self.archivos.get(nombre)
+        if publicado is None:
+            if nombre not in self._avisados:
+                self._avisados.add(nombre)
+                logger.warning("%s no está en static/dist/manifest.json; ejecutar `flask iunp activos`", nombre)
+            return url_for('static', filename=nombre)
+        return url_for('activo', nombre=publicado)
+
+    def _respaldo(self, nombre):
+        """URLs de los archivos que componen un paquete sin publicar: el local si existe, si no la CDN fijada"""
+        if nombre not in self._avisados:
+            self._avisados.add(nombre)
+            logger.warning("%s no está en static/dist/manifest.json; se enlazan sus archivos fuente "
+                           "(ejecutar `flask iunp activos`)", nombre)
+        urls = []
+        for fuente in BUNDLES[nombre]:
+            local = os.path.join(self.carpeta_static, *fuente.split('/'))
+            vendor = fuente.removeprefix('vendor/')
+            if not os.path.isfile(local) and vendor in DEPENDENCIAS:
+                urls.append(DEPENDENCIAS[vendor])
+            else:
+                urls.append(url_for('static', filename=fuente))
+        return urls
+
+    def etiquetas(self, nombre):
+        """<link>/<script> del paquete; sin manifiesto, uno por archivo fuente para que la página funcione igual"""
+        if nombre in self.archivos or nombre not in BUNDLES:
+            urls = [self.asset(nombre)]
+        else:
+            urls = self._respaldo(nombre)
+        if nombre.endswith('.css'):
+            plantilla = '<link href="{}" rel="stylesheet">'
+        else:
+            plantilla = '<script src="{}"></script>'
+        return Markup('\n'.join(plantilla.format(escape(url)) for url in urls))
+
+    def srcset_webp(self, nombre, lado):
+        """srcset 1x/2x con las variantes WebP más chicas que cubren `lado` px; vacío si no hay variantes"""
+        lados = sorted(self.variantes.get(nombre, {}))
+        if not lados:
+            return ''
+        candidatos = []
+        for densidad in (1, 2):
+            elegido = next((disponible for disponible in lados if disponible >= lado * densidad), lados[-1])
+            url = self.asset(self.variantes[nombre][elegido])
+            if not candidatos or candidatos[-1][0] != url:
+                candidatos.append((url, densidad))
+        return ', '.join(f'{url} {densidad}x' for url, densidad in candidatos)
+
+    def servir(self, nombre):
+        ruta = safe_join(self.carpeta_dist, nombre)
+        if ruta is None or not os.path.isfile(ruta):
+            abort(404)
+        archivo, codificacion = ruta, None
+        for algoritmo, sufijo in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[algoritmo] and os.path.isfile(ruta + sufijo):
+                archivo, codificacion = ruta + sufijo, algoritmo
+                break
+
+        tipo = mimetypes.guess_type(nombre)[0] or 'application/octet-stream'
+        respuesta = send_file(archivo, mimetype=tipo, max_age=UN_ANIO, conditional=True)
+        if codificacion:
+            respuesta.headers['Content-Encoding'] = codificacion
+        respuesta.vary.add('Accept-Encoding')
+        respuesta.cache_control.public = True
+        respuesta.cache_control.immutable = True
+        return respuesta
+
+
+activos = Activos()
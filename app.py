@@ -1,46 +1,114 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
+from flask import Flask, Response, current_app, g, make_response, stream_with_context, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_wtf import CSRFProtect
 from flask_wtf.csrf import generate_csrf
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
-import os
+import json
+import time
 
 # Importar modelos y formularios
-from models import db, Usuario, Equipo, Prestamo, HistorialAcciones, TipoUsuario, EstadoPrestamo, CategoriaEquipo, init_db, create_admin_user, crear_equipos_ejemplo, generar_token_acceso, validar_token_acceso, TokenAcceso, Notificacion
+from models import db, Usuario, Equipo, Prestamo, HistorialAcciones, TipoUsuario, EstadoPrestamo, CategoriaEquipo, generar_token_acceso, consumir_token_acceso, ERROR_TOKEN_NO_ADMIN, TokenAcceso, Notificacion
+from models import notificar_nueva_solicitud_prestamo, notificar_aprobacion_prestamo, notificar_rechazo_prestamo
 from forms import (LoginForm, RegistrationForm, EquipoForm, PrestamoForm, AprobarPrestamoForm, 
                    DevolverEquipoForm, BuscarEquipoForm, FiltrarPrestamosForm, EditarUsuarioForm, 
                    CambiarPasswordForm, ReporteForm, ContactoForm)
+from vencimientos import barredor_vencimientos
+from estadisticas import obtener_estadisticas, COLUMNAS_ESTADO_PRESTAMO
+from invalidacion import generaciones
+from notificaciones import (conteo_pendientes, invalidar_conteo_pendientes, bus_notificaciones,
+                            publicar_conteo, serializar_notificacion, ESPACIO_PENDIENTES)
+from outbox import despachador_notificaciones, purgador_outbox
+from tokens_acceso import purgador_tokens
+from hashing import servicio_hash, HashNoDisponible
+from cache_usuarios import cache_usuarios
+from cache_respuestas import cache_respuestas, MARCA_NOMBRE_USUARIO
+from activos import activos
+from compresion import compresion
+from auditoria import escritor_auditoria
+from exportacion import reporte, FORMATOS, TITULOS
+from consultas import con_perfil
+from busqueda import buscar_equipos, ids_equipos_coincidentes, ids_usuarios_coincidentes, indice_typeahead
+from paginacion import paginar_por_cursor, url_cursor
+from intervalos import indice_reservas, bloquear_equipo, ventana_ocupada, actualizar_estado_equipo, SIN_FIN
+from resumenes import datos_resumen
+from comandos import cli, inicializar_base_datos
+from config import Config
+from base_datos import configurar_motor, opciones_motor
 
-# Configuración de la aplicación
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'tu-clave-secreta-super-segura-aqui'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///sistema_prestamos.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Inicializar extensiones
-db.init_app(app)
-csrf = CSRFProtect(app)  # Configurar CSRF
+# Extensiones: se asocian a cada aplicación en crear_app()
+csrf = CSRFProtect()
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor inicia sesión para acceder a esta página.'
 login_manager.login_message_category = 'info'
 
+# Vistas declaradas con @ruta; crear_app() las registra en cada aplicación con el mismo endpoint
+_rutas = []
+
+def ruta(regla, **opciones):
+    """Equivalente a app.route para las vistas de este módulo"""
+    def decorador(vista):
+        _rutas.append((regla, opciones, vista))
+        return vista
+    return decorador
+
+def crear_app(config=Config):
+    """Crea y configura la aplicación.
+
+    No consulta ni modifica la base de datos: el esquema, los índices y los
+    datos iniciales se crean con `flask iunp init`, y los índices en memoria
+    (reservas, typeahead) se cargan con la primera consulta que los usa.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    
+    # Inicializar extensiones
+    # SQLite en memoria no usa QueuePool y rechaza pool_size, max_overflow y pool_timeout
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones_motor(app.config)
+    db.init_app(app)
+    configurar_motor(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    generaciones.init_app(app)
+    barredor_vencimientos.init_app(app)
+    despachador_notificaciones.init_app(app)
+    purgador_outbox.init_app(app)
+    purgador_tokens.init_app(app)
+    servicio_hash.init_app(app)
+    cache_usuarios.init_app(app)
+    activos.init_app(app)
+    cache_respuestas.init_app(app)
+    escritor_auditoria.init_app(app)
+    compresion.init_app(app)
+    bus_notificaciones.init_app(app)
+    app.cli.add_command(cli)
+    app.add_template_global(url_cursor)
+    
+    for regla, opciones, vista in _rutas:
+        app.add_url_rule(regla, view_func=vista, **opciones)
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, internal_error)
+    app.context_processor(inject_global_vars)
+    return app
+
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
-
-# Crear contexto de aplicación y base de datos
-with app.app_context():
-    init_db()
-    create_admin_user()
-    crear_equipos_ejemplo()
+    # Una cuenta desactivada pierde la sesión en la siguiente petición
+    usuario = cache_usuarios.obtener(int(user_id))
+    return usuario if usuario is not None and usuario.activo else None
 
 # Funciones auxiliares
-def registrar_accion(accion, descripcion="", prestamo_id=None):
-    """Registra una acción en el historial"""
+def registrar_accion(accion, descripcion="", prestamo_id=None, sincrono=False):
+    """Registra una acción en el historial.
+
+    Por defecto el evento se encola y lo escribe en lote el escritor de
+    auditoría. Con `sincrono=True` se agrega a la transacción actual, para las
+    acciones que deben quedar registradas junto con el cambio que describen.
+    """
     if current_user.is_authenticated:
+        if not sincrono:
+            escritor_auditoria.registrar(current_user.id, accion, descripcion, prestamo_id)
+            return
         historial = HistorialAcciones(
             usuario_id=current_user.id,
             prestamo_id=prestamo_id,
@@ -49,29 +117,15 @@ def registrar_accion(accion, descripcion="", prestamo_id=None):
         )
         db.session.add(historial)
 
-def actualizar_estados_prestamos():
-    """Actualiza automáticamente el estado de préstamos vencidos"""
-    prestamos_vencidos = Prestamo.query.filter(
-        Prestamo.estado == EstadoPrestamo.APROBADO,
-        Prestamo.fecha_fin_programada < datetime.utcnow()
-    ).all()
-    
-    for prestamo in prestamos_vencidos:
-        prestamo.estado = EstadoPrestamo.VENCIDO
-        prestamo.equipo.estado = 'prestado'  # Mantener como prestado hasta devolución
-    
-    if prestamos_vencidos:
-        db.session.commit()
-
 # Rutas de autenticación
-@app.route('/')
-@app.route('/index')
+@ruta('/')
+@ruta('/index')
 def index():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
     return render_template('index.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@ruta('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
@@ -79,14 +133,19 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         usuario = Usuario.query.filter_by(cedula=form.cedula.data).first()
-        if usuario and check_password_hash(usuario.password_hash, form.password.data):
+        try:
+            credenciales_validas = usuario is not None and \
+                servicio_hash.verificar(usuario.password_hash, form.password.data)
+        except HashNoDisponible:
+            flash('El sistema está recibiendo muchos inicios de sesión. Intenta de nuevo en unos segundos.', 'warning')
+            return render_template('login.html', form=form), 503
+        if credenciales_validas:
             if usuario.activo:
                 login_user(usuario, remember=form.remember_me.data)
                 next_page = request.args.get('next')
                 if not next_page or not next_page.startswith('/'):
                     next_page = url_for('dashboard')
                 registrar_accion('login', f'Inicio de sesión exitoso')
-                db.session.commit()
                 flash('¡Bienvenido al sistema!', 'success')
                 return redirect(next_page)
             else:
@@ -96,16 +155,21 @@ def login():
     
     return render_template('login.html', form=form)
 
-@app.route('/register', methods=['GET', 'POST'])
+@ruta('/register', methods=['GET', 'POST'])
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
+        try:
+            password_hash = servicio_hash.generar(form.password.data)
+        except HashNoDisponible:
+            flash('El sistema está ocupado. Intenta registrarte de nuevo en unos segundos.', 'warning')
+            return render_template('register.html', form=form), 503
         usuario = Usuario(
             cedula=form.cedula.data,
             nombre=form.nombre.data,
             apellido=form.apellido.data,
             telefono=form.telefono.data,
-            password_hash=generate_password_hash(form.password.data),
+            password_hash=password_hash,
             tipo_usuario=TipoUsuario(form.tipo_usuario.data)
         )
         db.session.add(usuario)
@@ -116,17 +180,16 @@ def register():
     
     return render_template('register.html', form=form)
 
-@app.route('/logout')
+@ruta('/logout')
 @login_required
 def logout():
     registrar_accion('logout', 'Cierre de sesión')
-    db.session.commit()
     logout_user()
     flash('Has cerrado sesión exitosamente.', 'info')
     return redirect(url_for('index'))
 
 # Rutas de acceso único de administrador
-@app.route('/admin/token/generar')
+@ruta('/admin/token/generar')
 @login_required
 def generar_token_admin():
     """Ruta para generar tokens de acceso único (solo administradores)"""
@@ -152,22 +215,14 @@ def generar_token_admin():
     except Exception as e:
         return jsonify({"error": f"Error al generar token: {str(e)}"}), 500
 
-@app.route('/admin/acceso-unico/<token>')
+@ruta('/admin/acceso-unico/<token>')
 def acceso_unico(token):
     """Ruta para usar tokens de acceso único"""
     try:
-        usuario, error = validar_token_acceso(token)
+        # Un solo UPDATE condicional valida y marca el token; se confirma junto con el historial
+        usuario, error = consumir_token_acceso(token)
         
         if usuario:
-            # Validar que sea admin
-            if not usuario.es_admin():
-                return f"<h1>Error</h1><p>El token no corresponde a un usuario administrador.</p>", 403
-            
-            # Buscar y marcar el token como usado
-            token_obj = TokenAcceso.query.filter_by(token=token).first()
-            if token_obj:
-                token_obj.marcar_usado()
-            
             # Registrar la acción
             ip_origen = request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
             historial = HistorialAcciones(
@@ -183,13 +238,16 @@ def acceso_unico(token):
             
             # Redirigir al dashboard
             return redirect(url_for('dashboard'))
+        elif error == ERROR_TOKEN_NO_ADMIN:
+            return f"<h1>Error</h1><p>{error}</p>", 403
         else:
             return f"<h1>Token Inválido</h1><p>{error}</p>", 400
             
     except Exception as e:
+        db.session.rollback()
         return f"<h1>Error</h1><p>Error interno: {str(e)}</p>", 500
 
-@app.route('/admin/tokens')
+@ruta('/admin/tokens')
 @login_required
 def listar_tokens():
     """Ruta para listar tokens de acceso únicos generados"""
@@ -218,7 +276,7 @@ def listar_tokens():
     except Exception as e:
         return jsonify({"error": f"Error al obtener tokens: {str(e)}"}), 500
 
-@app.route('/admin/token/<int:token_id>/invalidar', methods=['POST'])
+@ruta('/admin/token/<int:token_id>/invalidar', methods=['POST'])
 @login_required
 def invalidar_token(token_id):
     """Ruta para invalidar tokens de acceso únicos"""
@@ -241,37 +299,33 @@ def invalidar_token(token_id):
         return jsonify({"error": f"Error al invalidar token: {str(e)}"}), 500
 
 # Dashboard y rutas principales
-@app.route('/dashboard')
+@ruta('/dashboard')
 @login_required
 def dashboard():
-    actualizar_estados_prestamos()
-    
-    # Estadísticas para el dashboard
-    mis_prestamos = Prestamo.query.filter_by(usuario_id=current_user.id).count()
-    prestamos_activos = Prestamo.query.filter_by(
-        usuario_id=current_user.id, 
-        estado=EstadoPrestamo.APROBADO
-    ).count()
-    prestamos_pendientes = Prestamo.query.filter_by(
-        usuario_id=current_user.id, 
-        estado=EstadoPrestamo.SOLICITADO
-    ).count()
+    # Los vencimientos los marca el barredor en segundo plano; el dashboard solo lee
+    # Estadísticas del usuario en una sola consulta agrupada por estado
+    mis_estados = dict(
+        db.session.query(Prestamo.estado, db.func.count(Prestamo.id))
+        .filter(Prestamo.usuario_id == current_user.id)
+        .group_by(Prestamo.estado)
+        .all()
+    )
+    mis_prestamos = sum(mis_estados.values())
+    prestamos_activos = mis_estados.get(EstadoPrestamo.APROBADO, 0)
+    prestamos_pendientes = mis_estados.get(EstadoPrestamo.SOLICITADO, 0)
     
     # Estadísticas para administradores
     if current_user.puede_aprobar_prestamos():
-        total_equipos = Equipo.query.count()
-        equipos_disponibles = Equipo.query.filter_by(disponible=True, estado='disponible').count()
-        prestamos_por_aprobar = Prestamo.query.filter_by(estado=EstadoPrestamo.SOLICITADO).count()
-        prestamos_vencidos = Prestamo.query.filter_by(estado=EstadoPrestamo.VENCIDO).count()
+        estadisticas = obtener_estadisticas()
         
         return render_template('dashboard.html', 
                              mis_prestamos=mis_prestamos,
                              prestamos_activos=prestamos_activos,
                              prestamos_pendientes=prestamos_pendientes,
-                             total_equipos=total_equipos,
-                             equipos_disponibles=equipos_disponibles,
-                             prestamos_por_aprobar=prestamos_por_aprobar,
-                             prestamos_vencidos=prestamos_vencidos)
+                             total_equipos=estadisticas.total_equipos,
+                             equipos_disponibles=estadisticas.equipos_disponibles,
+                             prestamos_por_aprobar=estadisticas.prestamos_solicitados,
+                             prestamos_vencidos=estadisticas.prestamos_vencidos)
     
     return render_template('dashboard.html', 
                          mis_prestamos=mis_prestamos,
@@ -279,8 +333,9 @@ def dashboard():
                          prestamos_pendientes=prestamos_pendientes)
 
 # Rutas de equipos
-@app.route('/equipos')
+@ruta('/equipos')
 @login_required
+@cache_respuestas.cachear
 def listar_equipos():
     """Lista todos los equipos con filtros"""
     # Obtener parámetros de filtro
@@ -295,13 +350,7 @@ def listar_equipos():
     
     # Aplicar filtros de búsqueda
     if busqueda or request.args.get('termino'):  # Compatibilidad con ambos nombres
-        termino = busqueda or request.args.get('termino')
-        termino = f"%{termino}%"
-        query = query.filter(
-            (Equipo.nombre.ilike(termino)) |
-            (Equipo.codigo.like(termino)) |
-            (Equipo.descripcion.like(termino))
-        )
+        query = buscar_equipos(query, busqueda or request.args.get('termino'))
     
     if categoria_filtro:
         try:
@@ -330,12 +379,13 @@ def listar_equipos():
     tipos_disponibles = [cat.value for cat in CategoriaEquipo]
     
     # Calcular estadísticas
+    contadores = obtener_estadisticas()
     estadisticas = {
-        'total_equipos': Equipo.query.count(),
-        'equipos_disponibles': Equipo.query.filter_by(disponible=True, estado='disponible').count(),
-        'equipos_prestados': Equipo.query.filter_by(estado='prestado').count(),
-        'equipos_mantenimiento': Equipo.query.filter_by(estado='mantenimiento').count(),
-        'equipos_dañados': Equipo.query.filter_by(estado='dañado').count()
+        'total_equipos': contadores.total_equipos,
+        'equipos_disponibles': contadores.equipos_disponibles,
+        'equipos_prestados': contadores.equipos_prestados,
+        'equipos_mantenimiento': contadores.equipos_mantenimiento,
+        'equipos_dañados': contadores.equipos_danados
     }
     
     return render_template('equipos/listar.html', 
@@ -347,7 +397,7 @@ def listar_equipos():
                          estado_filtro=estado_filtro,
                          estadisticas=estadisticas)
 
-@app.route('/equipos/nuevo', methods=['GET', 'POST'])
+@ruta('/equipos/nuevo', methods=['GET', 'POST'])
 @login_required
 def crear_equipo():
     if not current_user.es_admin():
@@ -370,7 +420,7 @@ def crear_equipo():
             observaciones=form.observaciones.data
         )
         db.session.add(equipo)
-        registrar_accion('crear_equipo', f'Creado equipo {equipo.codigo} - {equipo.nombre}')
+        registrar_accion('crear_equipo', f'Creado equipo {equipo.codigo} - {equipo.nombre}', sincrono=True)
         db.session.commit()
         
         flash('Equipo creado exitosamente.', 'success')
@@ -378,14 +428,16 @@ def crear_equipo():
     
     return render_template('equipos/crear.html', form=form)
 
-@app.route('/equipos/<int:equipo_id>')
+@ruta('/equipos/<int:equipo_id>')
 @login_required
+@cache_respuestas.cachear
 def ver_equipo(equipo_id):
     equipo = Equipo.query.get_or_404(equipo_id)
-    prestamos = Prestamo.query.filter_by(equipo_id=equipo_id).order_by(Prestamo.fecha_solicitud.desc()).limit(5).all()
+    prestamos = con_perfil(Prestamo.query, 'historial_equipo').filter_by(equipo_id=equipo_id) \
+        .order_by(Prestamo.fecha_solicitud.desc()).limit(5).all()
     return render_template('equipos/ver.html', equipo=equipo, prestamos=prestamos)
 
-@app.route('/equipos/<int:equipo_id>/editar', methods=['GET', 'POST'])
+@ruta('/equipos/<int:equipo_id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_equipo(equipo_id):
     if not current_user.es_admin():
@@ -398,7 +450,7 @@ def editar_equipo(equipo_id):
     if form.validate_on_submit():
         form.populate_obj(equipo)
         equipo.categoria = CategoriaEquipo(form.categoria.data)
-        registrar_accion('editar_equipo', f'Editado equipo {equipo.codigo} - {equipo.nombre}')
+        registrar_accion('editar_equipo', f'Editado equipo {equipo.codigo} - {equipo.nombre}', sincrono=True)
         db.session.commit()
         
         flash('Equipo actualizado exitosamente.', 'success')
@@ -407,8 +459,9 @@ def editar_equipo(equipo_id):
     return render_template('equipos/editar.html', form=form, equipo=equipo)
 
 # Rutas de préstamos
-@app.route('/prestamos')
+@ruta('/prestamos')
 @login_required
+@cache_respuestas.cachear
 def listar_prestamos():
     """Página principal de préstamos que muestra equipos disponibles"""
     # Obtener parámetros de filtro
@@ -417,15 +470,11 @@ def listar_prestamos():
     estado_filtro = request.args.get('estado', '')
     
     # Query base para equipos
-    query = Equipo.query
+    query = con_perfil(Equipo.query, 'catalogo_equipos')
     
     # Aplicar filtros de búsqueda
     if busqueda:
-        query = query.filter(
-            (Equipo.nombre.ilike(f'%{busqueda}%')) |
-            (Equipo.descripcion.ilike(f'%{busqueda}%')) |
-            (Equipo.codigo.ilike(f'%{busqueda}%'))
-        )
+        query = buscar_equipos(query, busqueda)
     
     if categoria_filtro:
         try:
@@ -441,42 +490,54 @@ def listar_prestamos():
     equipos = query.order_by(Equipo.nombre.asc()).all()
     
     # Calcular estadísticas
-    equipos_totales = Equipo.query.count()
-    equipos_disponibles = Equipo.query.filter_by(estado='disponible').count()
-    equipos_prestados = Equipo.query.filter_by(estado='prestado').count()
-    equipos_mantenimiento = Equipo.query.filter_by(estado='mantenimiento').count()
-    
-    # Obtener préstamos activos del usuario actual
-    prestamos_usuario = Prestamo.query.filter_by(usuario_id=current_user.id).filter(
-        Prestamo.estado.in_([EstadoPrestamo.SOLICITADO, EstadoPrestamo.APROBADO])
-    ).order_by(Prestamo.fecha_solicitud.desc()).all()
+    estadisticas = obtener_estadisticas()
     
     # Obtener categorías disponibles para el filtro
     categorias_disponibles = list(CategoriaEquipo)
     
     return render_template('prestamos/listar.html', 
                          equipos=equipos,
-                         equipos_totales=equipos_totales,
-                         equipos_disponibles=equipos_disponibles,
-                         equipos_prestados=equipos_prestados,
-                         equipos_mantenimiento=equipos_mantenimiento,
-                         prestamos_usuario=prestamos_usuario,
+                         equipos_totales=estadisticas.total_equipos,
+                         equipos_disponibles=estadisticas.equipos_disponibles,
+                         equipos_prestados=estadisticas.equipos_prestados,
+                         equipos_mantenimiento=estadisticas.equipos_mantenimiento,
                          categorias_disponibles=categorias_disponibles,
                          busqueda=busqueda,
                          categoria_filtro=categoria_filtro,
                          estado_filtro=estado_filtro)
 
-@app.route('/prestamos/solicitar', methods=['GET', 'POST'])
+@ruta('/prestamos/mis-activos')
+@login_required
+def mis_prestamos_activos():
+    """Fragmento con los préstamos activos del usuario; la página del catálogo que lo carga se comparte"""
+    prestamos_usuario = con_perfil(Prestamo.query, 'prestamos_usuario').filter_by(usuario_id=current_user.id).filter(
+        Prestamo.estado.in_([EstadoPrestamo.SOLICITADO, EstadoPrestamo.APROBADO])
+    ).order_by(Prestamo.fecha_solicitud.desc()).all()
+    respuesta = make_response(render_template('prestamos/mis_prestamos.html', prestamos_usuario=prestamos_usuario))
+    respuesta.headers['Cache-Control'] = 'private, no-store'
+    return respuesta
+
+def avisar_ventana_ocupada(equipo_id, inicio, fin):
+    siguiente = indice_reservas.siguiente_ventana_libre(equipo_id, inicio, fin - inicio)
+    if siguiente:
+        flash(f'El equipo ya está reservado en esas fechas. Está libre a partir del '
+              f'{siguiente.strftime("%d/%m/%Y %H:%M")}.', 'error')
+    else:
+        flash('El equipo ya está reservado en esas fechas y tiene un préstamo vencido sin devolver.', 'error')
+
+@ruta('/prestamos/solicitar', methods=['GET', 'POST'])
 @login_required
 def solicitar_prestamo():
     form = PrestamoForm()
     if form.validate_on_submit():
-        # Verificar que el equipo esté disponible
-        equipo = Equipo.query.get(form.equipo_id.data)
-        if not equipo or not equipo.esta_disponible():
-            flash('El equipo seleccionado no está disponible.', 'error')
-            return redirect(url_for('solicitar_prestamo'))
+        # El formulario ya validó que el equipo admita reservas; falta que la ventana esté libre
+        equipo = form.equipo
+        inicio, fin = form.fecha_inicio.data, form.fecha_fin_programada.data
+        if not indice_reservas.esta_libre(equipo.id, inicio, fin):
+            avisar_ventana_ocupada(equipo.id, inicio, fin)
+            return render_template('solicitar.html', form=form)
         
+        bloquear_equipo(equipo.id)
         prestamo = Prestamo(
             usuario_id=current_user.id,
             equipo_id=form.equipo_id.data,
@@ -487,37 +548,35 @@ def solicitar_prestamo():
         )
         
         db.session.add(prestamo)
+        db.session.flush()  # Obtener el id del préstamo
+        # Otra solicitud pudo confirmarse entre la consulta al índice y esta escritura
+        if ventana_ocupada(equipo.id, inicio, fin, excluir=prestamo.id):
+            db.session.rollback()
+            avisar_ventana_ocupada(equipo.id, inicio, fin)
+            return render_template('solicitar.html', form=form)
         registrar_accion('solicitar_prestamo', 
                         f'Solicitado préstamo del equipo {equipo.codigo} - {equipo.nombre}',
-                        prestamo.id)
-        db.session.commit()
+                        prestamo.id, sincrono=True)
         
-        # Enviar notificación a los administradores usando la función correcta
-        try:
-            from models import notificar_nueva_solicitud_prestamo
-            notificar_nueva_solicitud_prestamo(prestamo)
-        except ImportError:
-            # Si no existe la función, crear notificación manualmente
-            administradores = Usuario.query.filter_by(tipo_usuario=TipoUsuario.ADMIN).all()
-            for admin in administradores:
-                notificacion = Notificacion(
-                    usuario_id=admin.id,
-                    prestamo_id=prestamo.id,
-                    tipo=TipoNotificacion.SOLICITUD_PRESTAMO,
-                    titulo="Nueva Solicitud de Préstamo",
-                    mensaje=f"{current_user.nombre_completo} solicita el equipo '{equipo.nombre}' del {prestamo.fecha_inicio.strftime('%d/%m/%Y %H:%M')} al {prestamo.fecha_fin_programada.strftime('%d/%m/%Y %H:%M')}",
-                    urgencia='alta',
-                    icono='bell'
-                )
-                db.session.add(notificacion)
-            db.session.commit()
+        # La notificación a los administradores se encola en la misma transacción
+        notificar_nueva_solicitud_prestamo(prestamo)
+        db.session.commit()
+        despachador_notificaciones.despertar()
         
         flash('Solicitud de préstamo enviada exitosamente.', 'success')
         return redirect(url_for('listar_prestamos'))
     
+    # Desde el detalle o el listado de equipos se llega con el equipo ya elegido
+    equipo_id = request.args.get('equipo_id', type=int)
+    if request.method == 'GET' and equipo_id:
+        equipo = Equipo.query.get(equipo_id)
+        if equipo and equipo.admite_reservas():
+            form.equipo_id.data = equipo.id
+            form.equipo = equipo
+    
     return render_template('solicitar.html', form=form)
 
-@app.route('/prestamos/<int:prestamo_id>')
+@ruta('/prestamos/<int:prestamo_id>')
 @login_required
 def ver_prestamo(prestamo_id):
     prestamo = Prestamo.query.get_or_404(prestamo_id)
@@ -529,7 +588,7 @@ def ver_prestamo(prestamo_id):
     
     return render_template('prestamos/ver.html', prestamo=prestamo)
 
-@app.route('/prestamos/<int:prestamo_id>/aprobar', methods=['GET', 'POST'])
+@ruta('/prestamos/<int:prestamo_id>/aprobar', methods=['GET', 'POST'])
 @login_required
 def aprobar_prestamo(prestamo_id):
     if not current_user.puede_aprobar_prestamos():
@@ -545,13 +604,31 @@ def aprobar_prestamo(prestamo_id):
     form = AprobarPrestamoForm()
     if form.validate_on_submit():
         if form.accion.data == 'aprobar':
-            if not prestamo.equipo.esta_disponible():
+            if not prestamo.equipo.admite_reservas():
                 flash('El equipo ya no está disponible.', 'error')
                 return redirect(url_for('ver_prestamo', prestamo_id=prestamo_id))
             
+            # Otras solicitudes pendientes no bloquean; sí los préstamos aprobados o vencidos
+            choques = [reserva for reserva in indice_reservas.conflictos(
+                           prestamo.equipo_id, prestamo.fecha_inicio, prestamo.fecha_fin_programada,
+                           excluir=prestamo.id)
+                       if reserva.estado != EstadoPrestamo.SOLICITADO]
+            if choques:
+                ids = ', '.join(f'#{reserva.prestamo_id}' for reserva in choques)
+                flash(f'El equipo ya está reservado en esas fechas (préstamos {ids}).', 'error')
+                return redirect(url_for('ver_prestamo', prestamo_id=prestamo_id))
+            
+            bloquear_equipo(prestamo.equipo_id)
             prestamo.estado = EstadoPrestamo.APROBADO
-            prestamo.equipo.estado = 'prestado'
-            prestamo.equipo.disponible = False
+            db.session.flush()
+            # Otro administrador pudo aprobar un préstamo superpuesto después de la consulta al índice
+            if ventana_ocupada(prestamo.equipo_id, prestamo.fecha_inicio, prestamo.fecha_fin_programada,
+                               excluir=prestamo.id, estados=(EstadoPrestamo.APROBADO, EstadoPrestamo.VENCIDO)):
+                db.session.rollback()
+                flash('El equipo ya está reservado en esas fechas por otro préstamo aprobado.', 'error')
+                return redirect(url_for('ver_prestamo', prestamo_id=prestamo_id))
+            # Un préstamo que empieza más adelante no presta el equipo todavía; lo hará el barredor
+            actualizar_estado_equipo(prestamo.equipo)
             accion_desc = 'Préstamo aprobado'
         else:
             prestamo.estado = EstadoPrestamo.RECHAZADO
@@ -562,43 +639,22 @@ def aprobar_prestamo(prestamo_id):
         prestamo.observaciones_admin = form.observaciones_admin.data
         prestamo.estado_equipo_entrega = form.estado_equipo_entrega.data
         
-        registrar_accion('aprobar_prestamo', accion_desc, prestamo_id)
-        db.session.commit()
+        registrar_accion('aprobar_prestamo', accion_desc, prestamo_id, sincrono=True)
         
-        # Enviar notificación al usuario
-        try:
-            if form.accion.data == 'aprobar':
-                from models import notificar_aprobacion_prestamo
-                notificar_aprobacion_prestamo(prestamo)
-            else:
-                from models import notificar_rechazo_prestamo
-                notificar_rechazo_prestamo(prestamo, form.observaciones_admin.data)
-        except ImportError:
-            # Si no existen las funciones, crear notificación manualmente
-            tipo_notificacion = TipoNotificacion.APROBACION_PRESTAMO if form.accion.data == 'aprobar' else TipoNotificacion.RECHAZO_PRESTAMO
-            titulo = "Préstamo Aprobado" if form.accion.data == 'aprobar' else "Préstamo Rechazado"
-            mensaje = f"Tu solicitud de préstamo del equipo '{prestamo.equipo.nombre}' ha sido {form.accion.data}."
-            if form.observaciones_admin.data:
-                mensaje += f"\n\nObservaciones: {form.observaciones_admin.data}"
-            
-            notificacion = Notificacion(
-                usuario_id=prestamo.usuario_id,
-                prestamo_id=prestamo.id,
-                tipo=tipo_notificacion,
-                titulo=titulo,
-                mensaje=mensaje,
-                urgencia='alta',
-                icono='check-circle' if form.accion.data == 'aprobar' else 'times-circle'
-            )
-            db.session.add(notificacion)
-            db.session.commit()
+        # La notificación al usuario se encola en la misma transacción
+        if form.accion.data == 'aprobar':
+            notificar_aprobacion_prestamo(prestamo)
+        else:
+            notificar_rechazo_prestamo(prestamo, form.observaciones_admin.data)
+        db.session.commit()
+        despachador_notificaciones.despertar()
         
         flash(f'Préstamo {form.accion.data} exitosamente.', 'success')
         return redirect(url_for('ver_prestamo', prestamo_id=prestamo_id))
     
     return render_template('prestamos/aprobar.html', form=form, prestamo=prestamo)
 
-@app.route('/prestamos/<int:prestamo_id>/devolver', methods=['GET', 'POST'])
+@ruta('/prestamos/<int:prestamo_id>/devolver', methods=['GET', 'POST'])
 @login_required
 def devolver_equipo(prestamo_id):
     prestamo = Prestamo.query.get_or_404(prestamo_id)
@@ -619,13 +675,12 @@ def devolver_equipo(prestamo_id):
         prestamo.estado_equipo_devolucion = form.estado_equipo_devolucion.data
         prestamo.observaciones_admin = form.observaciones_devolucion.data
         
-        # Restaurar disponibilidad del equipo
-        prestamo.equipo.estado = 'disponible'
-        prestamo.equipo.disponible = True
+        # Restaurar disponibilidad del equipo, salvo que otro préstamo ya esté en curso
+        actualizar_estado_equipo(prestamo.equipo)
         
         registrar_accion('devolver_equipo', 
                         f'Devuelto equipo {prestamo.equipo.codigo} - {prestamo.equipo.nombre}',
-                        prestamo_id)
+                        prestamo_id, sincrono=True)
         db.session.commit()
         
         flash('Equipo devuelto exitosamente.', 'success')
@@ -634,7 +689,7 @@ def devolver_equipo(prestamo_id):
     return render_template('prestamos/devolver.html', form=form, prestamo=prestamo)
 
 # Rutas de administración
-@app.route('/admin')
+@ruta('/admin')
 @login_required
 def admin_panel():
     if not current_user.es_admin():
@@ -642,43 +697,34 @@ def admin_panel():
         return redirect(url_for('dashboard'))
     
     # Estadísticas generales
-    total_usuarios = Usuario.query.count()
-    total_equipos = Equipo.query.count()
-    total_prestamos = Prestamo.query.count()
-    prestamos_activos = Prestamo.query.filter_by(estado=EstadoPrestamo.APROBADO).count()
-    prestamos_vencidos = Prestamo.query.filter_by(estado=EstadoPrestamo.VENCIDO).count()
-    equipos_disponibles = Equipo.query.filter_by(disponible=True, estado='disponible').count()
-    prestamos_por_aprobar = Prestamo.query.filter_by(estado=EstadoPrestamo.SOLICITADO).count()
+    estadisticas = obtener_estadisticas()
     
     return render_template('admin/admin_panel.html',
-                         total_usuarios=total_usuarios,
-                         total_equipos=total_equipos,
-                         total_prestamos=total_prestamos,
-                         prestamos_activos=prestamos_activos,
-                         prestamos_vencidos=prestamos_vencidos,
-                         equipos_disponibles=equipos_disponibles,
-                         prestamos_por_aprobar=prestamos_por_aprobar,
+                         total_usuarios=estadisticas.total_usuarios,
+                         total_equipos=estadisticas.total_equipos,
+                         total_prestamos=estadisticas.total_prestamos,
+                         prestamos_activos=estadisticas.prestamos_aprobados,
+                         prestamos_vencidos=estadisticas.prestamos_vencidos,
+                         equipos_disponibles=estadisticas.equipos_disponibles,
+                         prestamos_por_aprobar=estadisticas.prestamos_solicitados,
                          csrf_token=generate_csrf())
 
-@app.route('/admin/usuarios')
+@ruta('/admin/usuarios')
 @login_required
 def admin_usuarios():
     if not current_user.es_admin():
         flash('No tienes permisos para acceder a esta función.', 'error')
         return redirect(url_for('dashboard'))
     
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     
     # Aplicar filtros
     query = Usuario.query
     
     if request.args.get('buscar'):
-        termino = f"%{request.args.get('buscar')}%"
-        query = query.filter(
-            (Usuario.nombre.like(termino)) |
-            (Usuario.apellido.like(termino)) |
-            (Usuario.cedula.like(termino))
-        )
+        coincidentes = ids_usuarios_coincidentes(request.args.get('buscar'))
+        if coincidentes is not None:
+            query = query.filter(Usuario.id.in_(coincidentes))
     
     if request.args.get('tipo'):
         query = query.filter_by(tipo_usuario=TipoUsuario(request.args.get('tipo')))
@@ -688,33 +734,34 @@ def admin_usuarios():
     elif request.args.get('estado') == 'inactivo':
         query = query.filter_by(activo=False)
     
-    usuarios = query.order_by(Usuario.fecha_registro.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+    # Total: el contador materializado si no hay filtros, COUNT(*) solo si se pide
+    total, total_aproximado = None, False
+    if not any(request.args.get(filtro) for filtro in ('buscar', 'tipo', 'estado')):
+        total, total_aproximado = obtener_estadisticas().total_usuarios, True
+    elif request.args.get('total') == 'exacto':
+        total = query.count()
+    
+    usuarios = paginar_por_cursor(query, Usuario.fecha_registro, Usuario.id, cursor,
+                                  por_pagina=10, total=total, total_aproximado=total_aproximado)
     
     return render_template('admin/admin_usuarios.html', 
                          usuarios=usuarios,
                          csrf_token=generate_csrf())
 
-@app.route('/admin/equipos')
+@ruta('/admin/equipos')
 @login_required
 def admin_equipos():
     if not current_user.es_admin():
         flash('No tienes permisos para acceder a esta función.', 'error')
         return redirect(url_for('dashboard'))
     
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     
     # Aplicar filtros
     query = Equipo.query
     
     if request.args.get('buscar'):
-        termino = f"%{request.args.get('buscar')}%"
-        query = query.filter(
-            (Equipo.nombre.like(termino)) |
-            (Equipo.codigo.like(termino)) |
-            (Equipo.descripcion.like(termino))
-        )
+        query = buscar_equipos(query, request.args.get('buscar'), ordenar_por_relevancia=False)
     
     if request.args.get('categoria'):
         query = query.filter_by(categoria=CategoriaEquipo(request.args.get('categoria')))
@@ -727,34 +774,38 @@ def admin_equipos():
     elif request.args.get('disponible') == 'false':
         query = query.filter_by(disponible=False)
     
-    equipos = query.order_by(Equipo.fecha_registro.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+    # Total: el contador materializado si no hay filtros, COUNT(*) solo si se pide
+    total, total_aproximado = None, False
+    if not any(request.args.get(filtro) for filtro in ('buscar', 'categoria', 'estado', 'disponible')):
+        total, total_aproximado = obtener_estadisticas().total_equipos, True
+    elif request.args.get('total') == 'exacto':
+        total = query.count()
+    
+    equipos = paginar_por_cursor(query, Equipo.fecha_registro, Equipo.id, cursor,
+                                 por_pagina=10, total=total, total_aproximado=total_aproximado)
     
     return render_template('admin/admin_equipos.html', 
                          equipos=equipos,
                          csrf_token=generate_csrf())
 
-@app.route('/admin/prestamos')
+@ruta('/admin/prestamos')
 @login_required
 def admin_prestamos():
     if not current_user.es_admin():
         flash('No tienes permisos para acceder a esta función.', 'error')
         return redirect(url_for('dashboard'))
     
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     
     # Aplicar filtros
-    query = Prestamo.query
+    query = con_perfil(Prestamo.query, 'admin_prestamos')
     
+    # Los textos se resuelven en los índices de búsqueda y filtran por usuario_id / equipo_id indexados
     if request.args.get('buscar'):
-        termino = f"%{request.args.get('buscar')}%"
-        query = query.join(Usuario).join(Equipo).filter(
-            (Usuario.nombre.like(termino)) |
-            (Usuario.apellido.like(termino)) |
-            (Equipo.nombre.like(termino)) |
-            (Equipo.codigo.like(termino))
-        )
+        usuarios = ids_usuarios_coincidentes(request.args.get('buscar'))
+        equipos = ids_equipos_coincidentes(request.args.get('buscar'))
+        if usuarios is not None and equipos is not None:
+            query = query.filter(Prestamo.usuario_id.in_(usuarios) | Prestamo.equipo_id.in_(equipos))
     
     if request.args.get('estado'):
         query = query.filter_by(estado=EstadoPrestamo(request.args.get('estado')))
@@ -768,27 +819,34 @@ def admin_prestamos():
         query = query.filter(Prestamo.fecha_solicitud <= fecha_hasta)
     
     if request.args.get('usuario'):
-        termino = f"%{request.args.get('usuario')}%"
-        query = query.join(Usuario).filter(
-            (Usuario.nombre.like(termino)) |
-            (Usuario.apellido.like(termino)) |
-            (Usuario.cedula.like(termino))
-        )
-    
-    prestamos = query.order_by(Prestamo.fecha_solicitud.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+        usuarios = ids_usuarios_coincidentes(request.args.get('usuario'))
+        if usuarios is not None:
+            query = query.filter(Prestamo.usuario_id.in_(usuarios))
+    
+    estadisticas = obtener_estadisticas()
+    
+    # Total: el contador materializado si solo se filtra por estado, COUNT(*) solo si se pide
+    total, total_aproximado = None, False
+    if not any(request.args.get(filtro) for filtro in ('buscar', 'fecha_desde', 'fecha_hasta', 'usuario')):
+        if request.args.get('estado'):
+            columna = COLUMNAS_ESTADO_PRESTAMO[EstadoPrestamo(request.args.get('estado'))]
+            total = getattr(estadisticas, columna)
+        else:
+            total = estadisticas.total_prestamos
+        total_aproximado = True
+    elif request.args.get('total') == 'exacto':
+        total = query.order_by(None).count()
     
-    prestamos_por_aprobar = Prestamo.query.filter_by(estado=EstadoPrestamo.SOLICITADO).count()
-    prestamos_vencidos = Prestamo.query.filter_by(estado=EstadoPrestamo.VENCIDO).count()
+    prestamos = paginar_por_cursor(query, Prestamo.fecha_solicitud, Prestamo.id, cursor,
+                                   por_pagina=10, total=total, total_aproximado=total_aproximado)
     
     return render_template('admin/admin_prestamos.html', 
                          prestamos=prestamos,
-                         prestamos_por_aprobar=prestamos_por_aprobar,
-                         prestamos_vencidos=prestamos_vencidos,
+                         prestamos_por_aprobar=estadisticas.prestamos_solicitados,
+                         prestamos_vencidos=estadisticas.prestamos_vencidos,
                          csrf_token=generate_csrf())
 
-@app.route('/admin/reportes')
+@ruta('/admin/reportes')
 @login_required
 def admin_reportes():
     if not current_user.es_admin():
@@ -796,9 +854,60 @@ def admin_reportes():
         return redirect(url_for('dashboard'))
     
     return render_template('admin/admin_reportes.html',
+                         form=ReporteForm(),
                          csrf_token=generate_csrf())
 
-@app.route('/admin/configuracion')
+@ruta('/admin/reportes/datos')
+@login_required
+def datos_reportes():
+    """Datos de los gráficos de reportes, leídos del resumen diario de préstamos"""
+    if not current_user.es_admin():
+        return jsonify({"error": "No tienes permisos para acceder a esta función"}), 403
+    
+    try:
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date() if request.args.get('hasta') else datetime.utcnow().date()
+        desde = datetime.strptime(request.args['desde'], '%Y-%m-%d').date() if request.args.get('desde') else None
+    except ValueError:
+        return jsonify({"error": "Las fechas deben tener formato AAAA-MM-DD"}), 400
+    if desde is None:
+        # Por defecto, los últimos 6 meses completos incluyendo el actual
+        mes = hasta.month - 5
+        desde = hasta.replace(year=hasta.year + (mes - 1) // 12, month=(mes - 1) % 12 + 1, day=1)
+    if desde > hasta:
+        return jsonify({"error": "La fecha desde no puede ser posterior a la fecha hasta"}), 400
+    
+    return jsonify(datos_resumen(desde, hasta))
+
+@ruta('/admin/reportes/exportar')
+@login_required
+def exportar_reporte():
+    """Descarga un reporte en CSV o XLSX, escrito fila a fila mientras se lee de la base de datos"""
+    if not current_user.es_admin():
+        flash('No tienes permisos para acceder a esta función.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    # Es una descarga por GET: los parámetros vienen en la URL y no llevan token CSRF
+    form = ReporteForm(request.args, meta={'csrf': False})
+    if not form.validate():
+        for errores in form.errors.values():
+            for error in errores:
+                flash(error, 'error')
+        return redirect(url_for('admin_reportes'))
+    
+    tipo = form.tipo_reporte.data
+    tipo_contenido, extension, generar = FORMATOS[form.formato.data]
+    nombre = f"reporte_{tipo}_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
+    
+    def contenido():
+        encabezados, filas = reporte(tipo, form.fecha_desde.data, form.fecha_hasta.data)
+        yield from generar(encabezados, filas)
+    
+    registrar_accion('exportar_reporte', f'Exportado reporte de {TITULOS[tipo]} en {extension.upper()}')
+    # stream_with_context mantiene la sesión de base de datos abierta mientras se envía la respuesta
+    return Response(stream_with_context(contenido()), mimetype=tipo_contenido,
+                    headers={'Content-Disposition': f'attachment; filename="{nombre}"'})
+
+@ruta('/admin/configuracion')
 @login_required
 def admin_configuracion():
     if not current_user.es_admin():
@@ -808,8 +917,48 @@ def admin_configuracion():
     return render_template('admin/admin_configuracion.html',
                          csrf_token=generate_csrf())
 
+@ruta('/admin/outbox', methods=['GET', 'POST'])
+@login_required
+def admin_outbox():
+    """Profundidad de la bandeja de salida de notificaciones; con POST la despacha de inmediato"""
+    if not current_user.es_admin():
+        return jsonify({"error": "No tienes permisos para acceder a esta función"}), 403
+    
+    try:
+        if request.method == 'POST':
+            despachador_notificaciones.despertar()
+        
+        return jsonify({"success": True, "profundidad": despachador_notificaciones.profundidad()})
+    except Exception as e:
+        return jsonify({"error": f"Error al consultar la bandeja de salida: {str(e)}"}), 500
+
+@ruta('/admin/vencimientos', methods=['GET', 'POST'])
+@login_required
+def admin_vencimientos():
+    """Métricas del barredor de vencimientos; con POST ejecuta una pasada inmediata"""
+    if not current_user.es_admin():
+        return jsonify({"error": "No tienes permisos para acceder a esta función"}), 403
+    
+    try:
+        if request.method == 'POST':
+            ejecucion = barredor_vencimientos.barrer(origen='admin')
+            return jsonify({"success": True, "ejecucion": ejecucion})
+        
+        return jsonify({"success": True, "metricas": barredor_vencimientos.metricas()})
+    except Exception as e:
+        return jsonify({"error": f"Error en el barredor de vencimientos: {str(e)}"}), 500
+
+@ruta('/admin/compresion')
+@login_required
+def admin_compresion():
+    """Bytes ahorrados por la compresión de respuestas en este worker, por ruta"""
+    if not current_user.es_admin():
+        return jsonify({"error": "No tienes permisos para acceder a esta función"}), 403
+    
+    return jsonify({"success": True, "rutas": compresion.metricas()})
+
 # Rutas para gestión de templates de tokens
-@app.route('/admin/token-generar')
+@ruta('/admin/token-generar')
 @login_required
 def admin_token_generar():
     if not current_user.es_admin():
@@ -819,7 +968,7 @@ def admin_token_generar():
     return render_template('admin/admin_token_generar.html',
                          csrf_token=generate_csrf())
 
-@app.route('/admin/tokens')
+@ruta('/admin/tokens')
 @login_required
 def admin_tokens():
     if not current_user.es_admin():
@@ -830,7 +979,7 @@ def admin_tokens():
                          csrf_token=generate_csrf())
 
 # Rutas adicionales para funcionalidades administrativas
-@app.route('/admin/usuario/<int:usuario_id>/toggle', methods=['POST'])
+@ruta('/admin/usuario/<int:usuario_id>/toggle', methods=['POST'])
 @login_required
 def toggle_usuario(usuario_id):
     if not current_user.es_admin():
@@ -848,7 +997,7 @@ def toggle_usuario(usuario_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/admin/usuario/<int:usuario_id>/reset-password', methods=['POST'])
+@ruta('/admin/usuario/<int:usuario_id>/reset-password', methods=['POST'])
 @login_required
 def reset_password(usuario_id):
     if not current_user.es_admin():
@@ -856,16 +1005,17 @@ def reset_password(usuario_id):
     
     try:
         usuario = Usuario.query.get_or_404(usuario_id)
-        from werkzeug.security import generate_password_hash
         nueva_password = 'password123'  # Password temporal
-        usuario.password_hash = generate_password_hash(nueva_password)
+        usuario.password_hash = servicio_hash.generar(nueva_password)
         db.session.commit()
         
         return jsonify({"success": "Contraseña reseteada a 'password123'"})
+    except HashNoDisponible as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/admin/usuario/<int:usuario_id>/ver')
+@ruta('/admin/usuario/<int:usuario_id>/ver')
 @login_required
 def ver_usuario(usuario_id):
     if not current_user.es_admin():
@@ -883,7 +1033,7 @@ def ver_usuario(usuario_id):
                          prestamos_totales=prestamos_totales,
                          csrf_token=generate_csrf())
 
-@app.route('/admin/usuario/<int:usuario_id>/editar', methods=['GET', 'POST'])
+@ruta('/admin/usuario/<int:usuario_id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_usuario(usuario_id):
     if not current_user.es_admin():
@@ -908,11 +1058,15 @@ def editar_usuario(usuario_id):
         
         # Si se proporciona una nueva contraseña, actualizarla
         if form.nueva_password.data:
-            from werkzeug.security import generate_password_hash
-            usuario.password_hash = generate_password_hash(form.nueva_password.data)
+            try:
+                usuario.password_hash = servicio_hash.generar(form.nueva_password.data)
+            except HashNoDisponible:
+                db.session.rollback()
+                flash('El sistema está ocupado y no se pudo cambiar la contraseña. Intenta de nuevo.', 'warning')
+                return redirect(url_for('editar_usuario', usuario_id=usuario_id))
         
         # Registrar la acción
-        registrar_accion('editar_usuario', f'Editado usuario {usuario.cedula} - {usuario.nombre_completo}')
+        registrar_accion('editar_usuario', f'Editado usuario {usuario.cedula} - {usuario.nombre_completo}', sincrono=True)
         db.session.commit()
         
         flash('Usuario actualizado exitosamente.', 'success')
@@ -923,7 +1077,7 @@ def editar_usuario(usuario_id):
                          usuario=usuario,
                          csrf_token=generate_csrf())
 
-@app.route('/admin/equipo/<int:equipo_id>/eliminar', methods=['POST'])
+@ruta('/admin/equipo/<int:equipo_id>/eliminar', methods=['POST'])
 @login_required
 def eliminar_equipo(equipo_id):
     if not current_user.es_admin():
@@ -948,7 +1102,7 @@ def eliminar_equipo(equipo_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/admin/equipo/<int:equipo_id>/estado', methods=['POST'])
+@ruta('/admin/equipo/<int:equipo_id>/estado', methods=['POST'])
 @login_required
 def cambiar_estado_equipo(equipo_id):
     if not current_user.es_admin():
@@ -975,7 +1129,7 @@ def cambiar_estado_equipo(equipo_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/admin/prestamo/<int:prestamo_id>/cancelar', methods=['POST'])
+@ruta('/admin/prestamo/<int:prestamo_id>/cancelar', methods=['POST'])
 @login_required
 def cancelar_prestamo(prestamo_id):
     if not current_user.es_admin():
@@ -987,24 +1141,59 @@ def cancelar_prestamo(prestamo_id):
         if prestamo.estado == EstadoPrestamo.DEVUELTO:
             return jsonify({"error": "No se puede cancelar un préstamo ya devuelto"}), 400
         
-        # Si estaba aprobado, liberar el equipo
-        if prestamo.estado == EstadoPrestamo.APROBADO:
-            prestamo.equipo.estado = 'disponible'
-            prestamo.equipo.disponible = True
-        
         prestamo.estado = EstadoPrestamo.RECHAZADO
         prestamo.observaciones_admin = 'Préstamo cancelado por el administrador'
+        
+        # Si estaba en curso, liberar el equipo salvo que otro préstamo lo ocupe
+        actualizar_estado_equipo(prestamo.equipo)
         db.session.commit()
         
         return jsonify({"success": "Préstamo cancelado exitosamente"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@ruta('/api/equipos/buscar')
+@login_required
+def buscar_equipos_selector():
+    """Sugerencias para el selector de equipos: coincidencias por código o nombre"""
+    termino = request.args.get('q', '').strip()
+    limite = min(max(request.args.get('limite', 10, type=int), 1), 50)
+    return jsonify({'equipos': indice_typeahead.buscar(termino, limite)})
+
+@ruta('/api/equipos/<int:equipo_id>/disponibilidad')
+@login_required
+def disponibilidad_equipo(equipo_id):
+    """Indica si el equipo está libre en [inicio, fin) y desde cuándo lo estaría"""
+    equipo = Equipo.query.get_or_404(equipo_id)
+    try:
+        inicio = datetime.fromisoformat(request.args['inicio'])
+        fin = datetime.fromisoformat(request.args['fin'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Parámetros inicio y fin requeridos en formato ISO"}), 400
+    if fin <= inicio:
+        return jsonify({"error": "La fecha de fin debe ser posterior a la de inicio"}), 400
+    
+    conflictos = indice_reservas.conflictos(equipo.id, inicio, fin)
+    siguiente = indice_reservas.siguiente_ventana_libre(equipo.id, inicio, fin - inicio) if conflictos else inicio
+    return jsonify({
+        'equipo_id': equipo.id,
+        'admite_reservas': equipo.admite_reservas(),
+        'libre': not conflictos,
+        'conflictos': [
+            {
+                'inicio': reserva.inicio.isoformat(),
+                'fin': None if reserva.fin == SIN_FIN else reserva.fin.isoformat(),
+                'estado': reserva.estado.value
+            } for reserva in conflictos
+        ],
+        'siguiente_ventana_libre': siguiente.isoformat() if siguiente else None
+    })
+
 # ========================================
 # RUTAS PARA EL SISTEMA DE NOTIFICACIONES
 # ========================================
 
-@app.route('/api/notificaciones')
+@ruta('/api/notificaciones')
 @login_required
 def obtener_notificaciones():
     """Obtiene las notificaciones del usuario actual"""
@@ -1034,7 +1223,119 @@ def obtener_notificaciones():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/notificaciones/<int:notificacion_id>/marcar-leida', methods=['POST'])
+def _evento_sse(tipo, datos, evento_id=None):
+    """Formatea un evento Server-Sent Events"""
+    lineas = [] if evento_id is None else [f'id: {evento_id}']
+    lineas.append(f'event: {tipo}')
+    lineas.append(f'data: {json.dumps(datos, ensure_ascii=False)}')
+    return '\n'.join(lineas) + '\n\n'
+
+def _notificaciones_desde(usuario_id, ultimo_id):
+    """Notificaciones no leídas del usuario posteriores a ultimo_id, ya serializadas"""
+    return [serializar_notificacion(n) for n in Notificacion.query.filter(
+        Notificacion.usuario_id == usuario_id,
+        Notificacion.leida.is_(False),
+        Notificacion.id > ultimo_id
+    ).order_by(Notificacion.id)]
+
+def _flujo_notificaciones(app, suscripcion, ultimo_id, generacion, iniciales, conteo):
+    """Genera el flujo SSE; solo consulta la base de datos si otro worker cambió algo"""
+    usuario_id = suscripcion.usuario_id
+    latido = app.config['NOTIFICACIONES_STREAM_LATIDO']
+    revision = app.config['NOTIFICACIONES_STREAM_REVISION']
+    fin = time.monotonic() + app.config['NOTIFICACIONES_STREAM_DURACION']
+    
+    try:
+        # retry: milisegundos que espera el navegador antes de reconectar
+        salida = [f'retry: {int(revision * 1000)}\n\n']
+        for datos in iniciales:
+            ultimo_id = datos['id']
+            salida.append(_evento_sse('notificacion', datos, ultimo_id))
+        salida.append(_evento_sse('conteo', {'conteo': conteo}, ultimo_id))
+        yield ''.join(salida)
+        ultimo_envio = time.monotonic()
+        
+        while time.monotonic() < fin:
+            salida = []
+            evento = suscripcion.esperar(revision)
+            if evento is not None:
+                tipo, datos = evento
+                if tipo == 'notificacion':
+                    if datos['id'] > ultimo_id:
+                        ultimo_id = datos['id']
+                        salida.append(_evento_sse('notificacion', datos, ultimo_id))
+                else:
+                    # Si nadie más cambió la generación desde la publicación, el flujo está al día
+                    if datos['generacion'] == generaciones.leer(ESPACIO_PENDIENTES, usuario_id):
+                        generacion = datos['generacion']
+                    salida.append(_evento_sse('conteo', {'conteo': datos['conteo']}))
+            elif suscripcion.desbordada or generaciones.leer(ESPACIO_PENDIENTES, usuario_id) != generacion:
+                # Cambios hechos por otro worker (o eventos descartados): releer desde el último id enviado
+                suscripcion.desbordada = False
+                generacion = generaciones.leer(ESPACIO_PENDIENTES, usuario_id)
+                with app.app_context():
+                    nuevas = _notificaciones_desde(usuario_id, ultimo_id)
+                    conteo = conteo_pendientes.obtener(usuario_id)
+                for datos in nuevas:
+                    ultimo_id = datos['id']
+                    salida.append(_evento_sse('notificacion', datos, ultimo_id))
+                salida.append(_evento_sse('conteo', {'conteo': conteo}))
+            elif time.monotonic() - ultimo_envio >= latido:
+                salida.append(': latido\n\n')
+            
+            if salida:
+                ultimo_envio = time.monotonic()
+                yield ''.join(salida)
+    finally:
+        bus_notificaciones.cancelar(suscripcion)
+
+@ruta('/api/notificaciones/stream')
+@login_required
+def stream_notificaciones():
+    """Flujo SSE con las notificaciones nuevas y los cambios de conteo del usuario actual"""
+    usuario_id = current_user.id
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    
+    # Suscribirse antes de leer el estado inicial para no perder eventos intermedios
+    suscripcion = bus_notificaciones.suscribir(usuario_id)
+    if suscripcion is None:
+        # Todos los hilos de flujos del worker están ocupados: el navegador consulta el conteo y reintenta
+        sondeo = current_app.config['NOTIFICACIONES_SONDEO']
+        return jsonify({"error": "Demasiados flujos de notificaciones abiertos", "reintentar": sondeo}), 503, \
+            {'Retry-After': str(sondeo)}
+    try:
+        generacion = generaciones.leer(ESPACIO_PENDIENTES, usuario_id)
+        if ultimo_id is None:
+            # Primera conexión: la página ya muestra el estado actual, solo se envía lo nuevo
+            iniciales = []
+            ultimo_id = db.session.query(db.func.max(Notificacion.id)) \
+                .filter(Notificacion.usuario_id == usuario_id).scalar() or 0
+        else:
+            iniciales = _notificaciones_desde(usuario_id, ultimo_id)
+        conteo = conteo_pendientes.obtener(usuario_id)
+    except Exception:
+        bus_notificaciones.cancelar(suscripcion)
+        raise
+    
+    respuesta = Response(
+        # El generador corre fuera del contexto de la petición: recibe la aplicación
+        _flujo_notificaciones(current_app._get_current_object(), suscripcion, ultimo_id, generacion, iniciales, conteo),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Si el cliente se va antes del primer fragmento el generador nunca arranca y su finally no corre
+    respuesta.call_on_close(lambda: bus_notificaciones.cancelar(suscripcion))
+    return respuesta
+
+@ruta('/api/notificaciones/conteo')
+@login_required
+def conteo_notificaciones():
+    """Conteo de no leídas; lo consulta el navegador cuando no consigue un flujo SSE"""
+    respuesta = jsonify({'conteo': conteo_pendientes.obtener(current_user.id)})
+    respuesta.headers['Cache-Control'] = 'private, no-store'
+    return respuesta
+
+@ruta('/api/notificaciones/<int:notificacion_id>/marcar-leida', methods=['POST'])
 @login_required
 def marcar_notificacion_leida(notificacion_id):
     """Marca una notificación como leída"""
@@ -1052,12 +1353,13 @@ def marcar_notificacion_leida(notificacion_id):
         notificacion.leida = True
         notificacion.fecha_lectura = datetime.utcnow()
         db.session.commit()
+        publicar_conteo(current_user.id)
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/notificaciones/marcar-todas-leidas', methods=['POST'])
+@ruta('/api/notificaciones/marcar-todas-leidas', methods=['POST'])
 @login_required
 def marcar_todas_notificaciones_leidas():
     """Marca todas las notificaciones como leídas"""
@@ -1069,34 +1371,32 @@ def marcar_todas_notificaciones_leidas():
             leida=False
         ).update({'leida': True, 'fecha_lectura': datetime.utcnow()})
         
+        # La actualización masiva no pasa por el flush de la sesión
+        invalidar_conteo_pendientes(current_user.id)
         db.session.commit()
+        publicar_conteo(current_user.id)
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Manejo de errores
-@app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('errors/500.html'), 500
 
 # Contexto global para templates
-@app.context_processor
 def inject_global_vars():
     """Injecta variables globales en todas las templates"""
     try:
         notificaciones_conteo = 0
-        if current_user.is_authenticated:
-            # Contar notificaciones de forma segura
-            notificaciones_conteo = Notificacion.query.filter_by(
-                usuario_id=current_user.id,
-                leida=False
-            ).count()
+        # Una página compartida no lleva el conteo del usuario: lo envía el flujo SSE al conectarse
+        if current_user.is_authenticated and not g.get('respuesta_compartida'):
+            # Conteo cacheado por worker; solo consulta si el usuario tuvo cambios
+            notificaciones_conteo = conteo_pendientes.obtener(current_user.id)
     except Exception:
         # En caso de error, mostrar 0 notificaciones
         notificaciones_conteo = 0
@@ -1106,8 +1406,15 @@ def inject_global_vars():
         'TipoUsuario': TipoUsuario,
         'EstadoPrestamo': EstadoPrestamo,
         'CategoriaEquipo': CategoriaEquipo,
-        'notificaciones_conteo': notificaciones_conteo
+        'notificaciones_conteo': notificaciones_conteo,
+        'nombre_usuario': MARCA_NOMBRE_USUARIO if g.get('respuesta_compartida') else
+                          (current_user.nombre_completo if current_user.is_authenticated else '')
     }
 
+app = crear_app()
+
 if __name__ == '__main__':
+    # Servidor de desarrollo: prepara la base de datos como `flask iunp init`
+    with app.app_context():
+        inicializar_base_datos()
     app.run(debug=True, host='0.0.0.0', port=5002)
\ No newline at end of file
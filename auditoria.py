@@ -0,0 +1,122 @@
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import db, HistorialAcciones
+from tareas import TareaPeriodica
+
+logger = logging.getLogger(__name__)
+
+
+class EscritorAuditoria(TareaPeriodica):
+    """Escribe en lotes los eventos del historial de acciones.
+
+    Las acciones sin cambios de datos asociados (inicio y cierre de sesión) no
+    necesitan viajar en la transacción de la petición: se encolan en memoria
+    y un hilo las inserta con un solo INSERT por lote cada `intervalo` segundos,
+    o antes si se juntan `tamano_lote` eventos. La cola está acotada: si se
+    llena, quien registra intenta escribirla él mismo, y si la base de datos
+    tampoco la acepta se descartan los eventos más antiguos, con una
+    advertencia, en lugar de fallar la petición o crecer sin límite. Al
+    terminar el proceso se escriben los pendientes.
+    """
+
+    def __init__(self, intervalo=0.5, tamano_lote=200, max_eventos=10000):
+        super().__init__('escritor-auditoria', intervalo)
+        self.tamano_lote = tamano_lote
+        self.max_eventos = max_eventos
+        self._pendientes = deque()
+        self._lock_pendientes = threading.Lock()
+        self._lock_escritura = threading.Lock()
+        self.total_escritos = 0
+        self.total_descartados = 0
+
+    def init_app(self, app, habilitada=True):
+        self.intervalo = app.config.get('AUDITORIA_INTERVALO_MS', self.intervalo * 1000) / 1000
+        self.tamano_lote = app.config.get('AUDITORIA_TAMANO_LOTE', self.tamano_lote)
+        self.max_eventos = app.config.get('AUDITORIA_MAX_EVENTOS', self.max_eventos)
+        super().init_app(app, habilitada)
+        atexit.register(self.cerrar)
+
+    def ejecutar(self):
+        self.vaciar()
+
+    def registrar(self, usuario_id, accion, descripcion='', prestamo_id=None):
+        """Encola un evento; la fecha es la del momento de la acción, no la de la escritura"""
+        evento = {
+            'usuario_id': usuario_id,
+            'prestamo_id': prestamo_id,
+            'accion': accion,
+            'descripcion': descripcion,
+            'fecha': datetime.utcnow()
+        }
+        with self._lock_pendientes:
+            self._pendientes.append(evento)
+            pendientes = len(self._pendientes)
+
+        if pendientes >= self.max_eventos:
+            logger.warning("Cola de auditoría llena (%s eventos); escribiendo en la petición", pendientes)
+            # Un fallo de la auditoría no debe convertir la petición en un error
+            try:
+                self.vaciar()
+            except Exception:
+                logger.exception("No se pudo escribir la cola de auditoría desde la petición")
+                with self._lock_pendientes:
+                    self._recortar()
+        elif pendientes >= self.tamano_lote:
+            self.despertar()
+
+    def _recortar(self):
+        # Se llama con _lock_pendientes tomado
+        sobrantes = len(self._pendientes) - self.max_eventos
+        if sobrantes > 0:
+            for _ in range(sobrantes):
+                self._pendientes.popleft()
+            self.total_descartados += sobrantes
+            logger.warning("Cola de auditoría llena: se descartaron los %s evento(s) más antiguos", sobrantes)
+
+    def _tomar_lote(self):
+        with self._lock_pendientes:
+            return [self._pendientes.popleft() for _ in range(min(self.tamano_lote, len(self._pendientes)))]
+
+    def vaciar(self):
+        """Escribe todos los eventos pendientes y retorna cuántos escribió"""
+        escritos = 0
+        with self._lock_escritura:
+            while True:
+                lote = self._tomar_lote()
+                if not lote:
+                    break
+                # Sesión propia: no arrastra ni confirma la transacción de la petición que vacía
+                with db.engine.begin() as conexion:
+                    try:
+                        conexion.execute(insert(HistorialAcciones), lote)
+                    except Exception:
+                        with self._lock_pendientes:
+                            self._pendientes.extendleft(reversed(lote))
+                            self._recortar()
+                        raise
+                escritos += len(lote)
+        self.total_escritos += escritos
+        return escritos
+
+    def pendientes(self):
+        """Retorna la cantidad de eventos en espera"""
+        return len(self._pendientes)
+
+    def cerrar(self):
+        """Detiene el hilo y escribe los eventos pendientes (se llama al terminar el proceso)"""
+        self.detener()
+        if self.app is not None and self._pendientes:
+            try:
+                with self.app.app_context():
+                    self.vaciar()
+            except Exception:
+                logger.exception("No se pudieron escribir %s eventos de auditoría al cerrar", len(self._pendientes))
+
+
+escritor_auditoria = EscritorAuditoria()
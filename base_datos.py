@@ -0,0 +1,144 @@
+from sqlalchemy import Integer, event, make_url, text
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+# Perfil de producción para SQLite; SQLITE_PRAGMAS en la configuración reemplaza valores sueltos
+PRAGMAS_SQLITE = {
+    # Los lectores no bloquean al escritor ni el escritor a los lectores
+    'journal_mode': 'WAL',
+    # En WAL solo se sincroniza en los checkpoints; una caída no corrompe la base
+    'synchronous': 'NORMAL',
+    # Milisegundos que una conexión espera un lock antes de fallar con "database is locked"
+    'busy_timeout': 5000,
+    'mmap_size': 268435456,
+    # Negativo: tamaño en KiB (64 MiB de caché de páginas por conexión)
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+}
+
+# Parámetros de sesión de PostgreSQL; POSTGRESQL_PARAMETROS en la configuración reemplaza valores sueltos
+PARAMETROS_POSTGRESQL = {
+    # Milisegundos: una consulta o una espera de lock no retiene una conexión del pool indefinidamente
+    'statement_timeout': 30000,
+    'lock_timeout': 10000,
+    'idle_in_transaction_session_timeout': 60000,
+}
+
+
+def pragmas_sqlite(config):
+    """PRAGMAs que se aplican a cada conexión SQLite según la configuración"""
+    return {**PRAGMAS_SQLITE, **config.get('SQLITE_PRAGMAS', {})}
+
+
+def aplicar_pragmas(motor, pragmas):
+    """Ejecuta los PRAGMAs en cada conexión nueva del motor"""
+    # journal_mode va primero: cambiarlo toma un lock exclusivo breve la primera vez
+    ordenados = sorted(pragmas.items(), key=lambda item: item[0] != 'journal_mode')
+
+    @event.listens_for(motor, 'connect')
+    def _al_conectar(conexion_dbapi, registro):
+        cursor = conexion_dbapi.cursor()
+        try:
+            for nombre, valor in ordenados:
+                cursor.execute(f'PRAGMA {nombre} = {valor}')
+        finally:
+            cursor.close()
+
+    return _al_conectar
+
+
+def parametros_postgresql(config):
+    """Parámetros que se fijan en cada sesión PostgreSQL según la configuración"""
+    return {**PARAMETROS_POSTGRESQL, **config.get('POSTGRESQL_PARAMETROS', {})}
+
+
+def aplicar_parametros_postgresql(motor, parametros):
+    """Fija los parámetros de sesión en cada conexión nueva del motor"""
+
+    @event.listens_for(motor, 'connect')
+    def _al_conectar(conexion_dbapi, registro):
+        # SET fuera de una transacción, para que no lo deshaga el rollback con que el pool recibe la conexión
+        autocommit = conexion_dbapi.autocommit
+        conexion_dbapi.autocommit = True
+        cursor = conexion_dbapi.cursor()
+        try:
+            for nombre, valor in parametros.items():
+                cursor.execute(f'SET SESSION {nombre} = {int(valor)}')
+        finally:
+            cursor.close()
+            conexion_dbapi.autocommit = autocommit
+
+    return _al_conectar
+
+
+def sin_limite_de_tiempo(conexion):
+    """Quita statement_timeout en la transacción actual, para cargas masivas y reconstrucciones"""
+    if conexion.dialect.name == 'postgresql':
+        conexion.exec_driver_sql('SET LOCAL statement_timeout = 0')
+
+
+def sincronizar_secuencias(conexion, tablas):
+    """Adelanta las secuencias de las claves primarias tras insertar filas con id explícito (PostgreSQL)"""
+    if conexion.dialect.name != 'postgresql':
+        return
+    for tabla in tablas:
+        clave = tabla.primary_key.columns.values()
+        if len(clave) != 1 or clave[0].autoincrement is False or not isinstance(clave[0].type, Integer):
+            continue
+        conexion.execute(text(
+            f"SELECT setval(pg_get_serial_sequence(:tabla, :columna), COALESCE(MAX({clave[0].name}), 1), "
+            f"MAX({clave[0].name}) IS NOT NULL) FROM {tabla.name}"
+        ), {'tabla': tabla.name, 'columna': clave[0].name})
+
+
+# Opciones de SQLALCHEMY_ENGINE_OPTIONS que solo admite QueuePool
+OPCIONES_QUEUEPOOL = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+def _usa_queuepool(uri, opciones):
+    """Indica si el motor de la URL usará QueuePool: SQLite en archivo y los servidores como PostgreSQL"""
+    if opciones.get('poolclass') is not None:
+        return issubclass(opciones['poolclass'], QueuePool)
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite':
+        return True
+    # SQLite en memoria usa StaticPool (Flask-SQLAlchemy) o SingletonThreadPool
+    return url.database not in (None, '', ':memory:') and url.query.get('mode') != 'memory'
+
+
+def opciones_motor(config):
+    """SQLALCHEMY_ENGINE_OPTIONS sin las opciones de QueuePool si el backend usa otro pool"""
+    opciones = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if not _usa_queuepool(config['SQLALCHEMY_DATABASE_URI'], opciones):
+        for nombre in OPCIONES_QUEUEPOOL:
+            opciones.pop(nombre, None)
+    return opciones
+
+
+def configurar_motor(app):
+    """Aplica el perfil de conexión de la configuración al motor de la aplicación.
+
+    Las opciones del pool (SQLALCHEMY_ENGINE_OPTIONS, filtradas antes con
+    `opciones_motor()`) las pasa Flask-SQLAlchemy al crear el motor; aquí se
+    agregan los PRAGMAs de SQLite, que deben ejecutarse en cada conexión porque
+    la mayoría no se guarda en el archivo, o los tiempos máximos de las
+    sesiones de PostgreSQL.
+    """
+    with app.app_context():
+        motor = db.engine
+    if motor.dialect.name == 'sqlite':
+        aplicar_pragmas(motor, pragmas_sqlite(app.config))
+    elif motor.dialect.name == 'postgresql':
+        aplicar_parametros_postgresql(motor, parametros_postgresql(app.config))
+    return motor
+
+
+def descartar_conexiones_heredadas(app):
+    """Olvida las conexiones del pool heredadas del proceso padre tras un fork.
+
+    close=False: los sockets o archivos siguen siendo del padre, que puede
+    seguir usándolos; el worker abre conexiones propias con la primera consulta.
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
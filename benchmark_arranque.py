@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tiempo de arranque en frío de un worker.
+
+Cada ronda lanza un intérprete nuevo que importa app.py (lo que hace un worker
+de gunicorn al arrancar) y atiende su primera petición. Mide ambos tiempos y
+cuenta las sentencias SQL ejecutadas durante la importación, que deben ser
+cero: el esquema y los datos iniciales se crean con `flask iunp init`.
+
+Uso:
+    python benchmark_arranque.py --rondas 10 --presupuesto-ms 1500
+
+Termina con código 1 si la mediana de arranque supera el presupuesto o si la
+importación ejecutó alguna sentencia SQL.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SONDA = r'''
+import json, time
+inicio = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+sentencias = []
+event.listen(Engine, 'before_cursor_execute', lambda *args, **kwargs: sentencias.append(args[2]))
+import app as modulo
+importado = time.perf_counter()
+en_importacion = len(sentencias)
+respuesta = modulo.app.test_client().get('/login')
+primera = time.perf_counter()
+print(json.dumps({
+    'importacion_ms': (importado - inicio) * 1000,
+    'primera_peticion_ms': (primera - importado) * 1000,
+    'sentencias_importacion': en_importacion,
+    'estado': respuesta.status_code
+}))
+'''
+
+
+def medir_ronda():
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    salida = subprocess.run([sys.executable, '-c', SONDA], cwd=directorio, capture_output=True,
+                            text=True, check=True)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide el arranque en frío de un worker')
+    parser.add_argument('--rondas', type=int, default=10, help='Intérpretes a lanzar')
+    parser.add_argument('--presupuesto-ms', type=float, default=1500,
+                        help='Máximo aceptable para la mediana de importación + primera petición')
+    argumentos = parser.parse_args()
+
+    rondas = [medir_ronda() for _ in range(argumentos.rondas)]
+    importacion = [r['importacion_ms'] for r in rondas]
+    primera = [r['primera_peticion_ms'] for r in rondas]
+    total = [a + b for a, b in zip(importacion, primera)]
+    sentencias = max(r['sentencias_importacion'] for r in rondas)
+
+    print(f"{'':>20} {'mediana':>9} {'máximo':>9}")
+    print(f"{'importación':>20} {statistics.median(importacion):>7.0f}ms {max(importacion):>7.0f}ms")
+    print(f"{'primera petición':>20} {statistics.median(primera):>7.0f}ms {max(primera):>7.0f}ms")
+    print(f"{'total':>20} {statistics.median(total):>7.0f}ms {max(total):>7.0f}ms")
+    print(f"Sentencias SQL al importar: {sentencias}")
+
+    fallos = []
+    if statistics.median(total) > argumentos.presupuesto_ms:
+        fallos.append(f"la mediana de arranque supera el presupuesto de {argumentos.presupuesto_ms:.0f} ms")
+    if sentencias:
+        fallos.append("la importación de app.py ejecutó sentencias SQL")
+    for fallo in fallos:
+        print(f"FALLO: {fallo}", file=sys.stderr)
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark de inicios de sesión según el número de procesos de hashing.
+
+Simula un worker con hilos (como `gunicorn --threads`): varios hilos envían
+POST /login sin pausa mientras otro hilo mide la latencia de una ruta liviana.
+Con el hashing en línea (0 procesos) el KDF retiene el GIL y la ruta liviana
+espera detrás de los inicios de sesión; con el pool de procesos no.
+
+Uso:
+    python benchmark_login.py --procesos 0 1 2 4 --hilos 16 --duracion 10
+"""
+
+import argparse
+import statistics
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app import app
+from auditoria import escritor_auditoria
+from hashing import servicio_hash
+from models import db, Usuario, HistorialAcciones, TipoUsuario
+
+CEDULA_BENCHMARK = 'bench-login'
+PASSWORD_BENCHMARK = 'benchmark123'
+
+
+def _percentil(valores, percentil):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * percentil / 100))]
+
+
+def crear_usuario_benchmark():
+    with app.app_context():
+        usuario = Usuario.query.filter_by(cedula=CEDULA_BENCHMARK).first()
+        if not usuario:
+            usuario = Usuario(
+                cedula=CEDULA_BENCHMARK,
+                nombre='Benchmark',
+                apellido='Login',
+                password_hash=generate_password_hash(PASSWORD_BENCHMARK),
+                tipo_usuario=TipoUsuario.ESTUDIANTE
+            )
+            db.session.add(usuario)
+            db.session.commit()
+        return usuario.id
+
+
+def eliminar_usuario_benchmark(usuario_id):
+    with app.app_context():
+        escritor_auditoria.vaciar()
+        HistorialAcciones.query.filter_by(usuario_id=usuario_id).delete()
+        Usuario.query.filter_by(id=usuario_id).delete()
+        db.session.commit()
+
+
+def medir(procesos, hilos, duracion):
+    """Ejecuta una ronda y retorna las métricas de inicios de sesión y de la ruta liviana"""
+    servicio_hash.configurar(procesos=procesos, cola_maxima=hilos * 2)
+    servicio_hash.rechazadas = servicio_hash.vencidas = 0
+    if procesos:
+        # Arranca los procesos antes de medir
+        servicio_hash.verificar(generate_password_hash('calentamiento'), 'calentamiento')
+
+    fin = time.monotonic() + duracion
+    latencias_login = []
+    latencias_liviana = []
+    errores = []
+    lock = threading.Lock()
+
+    def iniciar_sesiones():
+        cliente = app.test_client()
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            respuesta = cliente.post('/login', data={'cedula': CEDULA_BENCHMARK, 'password': PASSWORD_BENCHMARK})
+            transcurrido = time.perf_counter() - inicio
+            with lock:
+                if respuesta.status_code == 302:
+                    latencias_login.append(transcurrido)
+                else:
+                    errores.append(respuesta.status_code)
+            cliente.get('/logout')
+
+    def sondear_ruta_liviana():
+        cliente = app.test_client()
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            cliente.get('/static/images/university_logo.jpg')
+            latencias_liviana.append(time.perf_counter() - inicio)
+            time.sleep(0.01)
+
+    trabajadores = [threading.Thread(target=iniciar_sesiones) for _ in range(hilos)]
+    trabajadores.append(threading.Thread(target=sondear_ruta_liviana))
+    for hilo in trabajadores:
+        hilo.start()
+    for hilo in trabajadores:
+        hilo.join()
+
+    return {
+        'procesos': procesos,
+        'logins_por_segundo': len(latencias_login) / duracion,
+        'login_p95_ms': _percentil(latencias_login, 95) * 1000,
+        'liviana_p50_ms': statistics.median(latencias_liviana) * 1000 if latencias_liviana else 0.0,
+        'liviana_p95_ms': _percentil(latencias_liviana, 95) * 1000,
+        'rechazados': len(errores)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de /login según procesos de hashing')
+    parser.add_argument('--procesos', type=int, nargs='+', default=[0, 1, 2, 4],
+                        help='Tamaños del pool a medir (0 = hashing en línea)')
+    parser.add_argument('--hilos', type=int, default=16, help='Hilos concurrentes enviando inicios de sesión')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos por ronda')
+    argumentos = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    usuario_id = crear_usuario_benchmark()
+    try:
+        print(f"{'procesos':>8} {'logins/s':>9} {'login p95':>10} {'liviana p50':>12} {'liviana p95':>12} {'503':>5}")
+        for procesos in argumentos.procesos:
+            r = medir(procesos, argumentos.hilos, argumentos.duracion)
+            print(f"{r['procesos']:>8} {r['logins_por_segundo']:>9.1f} {r['login_p95_ms']:>8.1f}ms "
+                  f"{r['liviana_p50_ms']:>10.1f}ms {r['liviana_p95_ms']:>10.1f}ms {r['rechazados']:>5}")
+    finally:
+        servicio_hash.cerrar()
+        eliminar_usuario_benchmark(usuario_id)
+
+
+if __name__ == '__main__':
+    main()
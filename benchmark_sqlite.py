@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Benchmark de lecturas y escrituras concurrentes sobre SQLite según el perfil del motor.
+
+Simula varios workers de gunicorn (procesos), cada uno con hilos lectores que
+consultan los préstamos recientes de un usuario y hilos escritores que
+actualizan un préstamo y agregan una fila al historial en transacciones
+cortas. Cada perfil corre sobre una copia nueva de la base de datos:
+
+    predeterminado  motor sin PRAGMAs ni opciones de pool (configuración anterior)
+    produccion      SQLALCHEMY_ENGINE_OPTIONS y PRAGMAs de base_datos.PRAGMAS_SQLITE
+
+Uso:
+    python benchmark_sqlite.py --base instance/sistema_prestamos.db --workers 4 --lectores 4 --escritores 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from base_datos import PRAGMAS_SQLITE, aplicar_pragmas
+from config import Config
+
+CONSULTA_LECTURA = text("""
+    SELECT p.id, p.estado, p.fecha_solicitud, e.nombre
+    FROM prestamos p JOIN equipos e ON e.id = p.equipo_id
+    WHERE p.usuario_id = :usuario_id
+    ORDER BY p.fecha_solicitud DESC
+    LIMIT 20
+""")
+ACTUALIZACION = text("UPDATE prestamos SET observaciones_admin = :texto WHERE id = :prestamo_id")
+INSERCION_HISTORIAL = text("""
+    INSERT INTO historial_acciones (usuario_id, prestamo_id, accion, descripcion, fecha)
+    VALUES (:usuario_id, :prestamo_id, 'benchmark', :texto, CURRENT_TIMESTAMP)
+""")
+
+PERFILES = ('predeterminado', 'produccion')
+
+
+def _percentil(valores, percentil):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * percentil / 100))]
+
+
+def crear_motor(ruta, perfil):
+    url = f'sqlite:///{ruta}'
+    if perfil == 'predeterminado':
+        return create_engine(url)
+    motor = create_engine(url, **Config.SQLALCHEMY_ENGINE_OPTIONS)
+    aplicar_pragmas(motor, {**PRAGMAS_SQLITE, **Config.SQLITE_PRAGMAS})
+    return motor
+
+
+def preparar_copia(base, directorio, perfil):
+    """Copia la base de datos y la deja en modo de journal por omisión"""
+    ruta = os.path.join(directorio, f'{perfil}.db')
+    origen = sqlite3.connect(base)
+    destino = sqlite3.connect(ruta)
+    origen.backup(destino)
+    origen.close()
+    destino.execute('PRAGMA journal_mode = DELETE')
+    destino.close()
+    return ruta
+
+
+def _worker(ruta, perfil, lectores, escritores, duracion, usuarios, prestamos, resultados):
+    motor = crear_motor(ruta, perfil)
+    fin = time.monotonic() + duracion
+    lecturas, escrituras, errores = [], [], []
+    lock = threading.Lock()
+
+    def leer():
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                with motor.connect() as conexion:
+                    conexion.execute(CONSULTA_LECTURA, {'usuario_id': random.choice(usuarios)}).fetchall()
+            except OperationalError:
+                with lock:
+                    errores.append('lectura')
+                continue
+            with lock:
+                lecturas.append(time.perf_counter() - inicio)
+
+    def escribir():
+        while time.monotonic() < fin:
+            prestamo_id = random.choice(prestamos)
+            parametros = {'prestamo_id': prestamo_id, 'usuario_id': random.choice(usuarios),
+                          'texto': f'benchmark {time.time()}'}
+            inicio = time.perf_counter()
+            try:
+                with motor.begin() as conexion:
+                    conexion.execute(ACTUALIZACION, parametros)
+                    conexion.execute(INSERCION_HISTORIAL, parametros)
+            except OperationalError:
+                with lock:
+                    errores.append('escritura')
+                continue
+            with lock:
+                escrituras.append(time.perf_counter() - inicio)
+
+    hilos = [threading.Thread(target=leer) for _ in range(lectores)]
+    hilos += [threading.Thread(target=escribir) for _ in range(escritores)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    motor.dispose()
+    resultados.put((lecturas, escrituras, errores))
+
+
+def medir(ruta, perfil, workers, lectores, escritores, duracion):
+    """Ejecuta una ronda con `workers` procesos y retorna las métricas agregadas"""
+    with sqlite3.connect(ruta) as conexion:
+        usuarios = [fila[0] for fila in conexion.execute('SELECT DISTINCT usuario_id FROM prestamos LIMIT 5000')]
+        prestamos = [fila[0] for fila in conexion.execute('SELECT id FROM prestamos LIMIT 50000')]
+    if not prestamos:
+        raise SystemExit('La base de datos no tiene préstamos; ejecutar antes `flask iunp datos-carga`.')
+
+    resultados = multiprocessing.Queue()
+    procesos = [
+        multiprocessing.Process(target=_worker, args=(ruta, perfil, lectores, escritores, duracion,
+                                                      usuarios, prestamos, resultados))
+        for _ in range(workers)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    lecturas, escrituras, errores = [], [], []
+    for _ in procesos:
+        parciales = resultados.get()
+        lecturas += parciales[0]
+        escrituras += parciales[1]
+        errores += parciales[2]
+    for proceso in procesos:
+        proceso.join()
+
+    return {
+        'perfil': perfil,
+        'lecturas_por_segundo': len(lecturas) / duracion,
+        'lectura_p95_ms': _percentil(lecturas, 95) * 1000,
+        'escrituras_por_segundo': len(escrituras) / duracion,
+        'escritura_p95_ms': _percentil(escrituras, 95) * 1000,
+        'bloqueos': len(errores)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de SQLite con y sin el perfil de producción')
+    parser.add_argument('--base', default=os.path.join('instance', 'sistema_prestamos.db'),
+                        help='Base de datos a copiar (no se modifica)')
+    parser.add_argument('--perfiles', nargs='+', choices=PERFILES, default=list(PERFILES))
+    parser.add_argument('--workers', type=int, default=4, help='Procesos, como workers de gunicorn')
+    parser.add_argument('--lectores', type=int, default=4, help='Hilos lectores por worker')
+    parser.add_argument('--escritores', type=int, default=2, help='Hilos escritores por worker')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos por ronda')
+    argumentos = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix='benchmark-sqlite-')
+    try:
+        print(f"{'perfil':>15} {'lecturas/s':>11} {'lectura p95':>12} {'escrituras/s':>13} "
+              f"{'escritura p95':>14} {'bloqueos':>9}")
+        for perfil in argumentos.perfiles:
+            ruta = preparar_copia(argumentos.base, directorio, perfil)
+            r = medir(ruta, perfil, argumentos.workers, argumentos.lectores, argumentos.escritores,
+                      argumentos.duracion)
+            print(f"{r['perfil']:>15} {r['lecturas_por_segundo']:>11.1f} {r['lectura_p95_ms']:>10.1f}ms "
+                  f"{r['escrituras_por_segundo']:>13.1f} {r['escritura_p95_ms']:>12.1f}ms {r['bloqueos']:>9}")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Peticiones por segundo según la cantidad de workers de gunicorn.
+
+Para cada cantidad de workers levanta gunicorn con gunicorn.conf.py sobre la
+base de datos configurada, inicia sesión desde varios procesos cliente y los
+deja recorrer las rutas indicadas sin pausa durante la duración de la ronda.
+Al final de cada ronda mide la memoria privada (USS) de cada worker: con
+`preload_app` la parte heredada del maestro se comparte y no cuenta.
+
+Uso:
+    python benchmark_workers.py --workers 1 2 4 --clientes 8 --duracion 10
+    python benchmark_workers.py --workers 4 --sin-precarga   # comparar la memoria sin preload
+
+Los clientes corren en la misma máquina: con pocas CPU compiten con los
+workers y el techo lo pone el total de CPU, no gunicorn.
+"""
+
+import argparse
+import http.cookiejar
+import multiprocessing
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+RUTAS = ['/dashboard', '/equipos', '/prestamos']
+PATRON_CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def _percentil(valores, percentil):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * percentil / 100))]
+
+
+def _memoria_privada_kib(pid):
+    """USS del proceso: páginas que no comparte con ningún otro"""
+    total = 0
+    with open(f'/proc/{pid}/smaps_rollup') as archivo:
+        for linea in archivo:
+            if linea.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(linea.split()[1])
+    return total
+
+
+def _workers_de(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as archivo:
+        return [int(hijo) for hijo in archivo.read().split()]
+
+
+def _esperar_servidor(base, proceso, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó con código {proceso.returncode}")
+        try:
+            urllib.request.urlopen(base + '/login', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn no respondió a tiempo")
+
+
+def cliente(base, cedula, password, rutas, duracion):
+    """Inicia sesión y recorre las rutas hasta agotar la duración; retorna latencias y errores"""
+    abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    formulario = abridor.open(base + '/login').read().decode()
+    datos = urllib.parse.urlencode({
+        'csrf_token': PATRON_CSRF.search(formulario).group(1), 'cedula': cedula, 'password': password
+    }).encode()
+    abridor.open(base + '/login', datos).read()
+
+    latencias, errores = [], 0
+    fin = time.monotonic() + duracion
+    i = 0
+    while time.monotonic() < fin:
+        inicio = time.perf_counter()
+        try:
+            respuesta = abridor.open(base + rutas[i % len(rutas)])
+            respuesta.read()
+            if respuesta.url.rstrip('/').endswith('/login'):
+                errores += 1
+            else:
+                latencias.append(time.perf_counter() - inicio)
+        except OSError:
+            errores += 1
+        i += 1
+    return latencias, errores
+
+
+def medir(workers, argumentos):
+    base = f'http://127.0.0.1:{argumentos.puerto}'
+    entorno = dict(os.environ, GUNICORN_PRELOAD='0' if argumentos.sin_precarga else '1')
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+         '--threads', str(argumentos.hilos), '--bind', f'127.0.0.1:{argumentos.puerto}',
+         '--max-requests', '0', '--log-level', 'warning'],
+        cwd=directorio, env=entorno
+    )
+    try:
+        _esperar_servidor(base, proceso)
+        with multiprocessing.Pool(argumentos.clientes) as pool:
+            resultados = pool.starmap(cliente, [
+                (base, argumentos.cedula, argumentos.password, argumentos.rutas, argumentos.duracion)
+            ] * argumentos.clientes)
+        memoria = [_memoria_privada_kib(pid) for pid in _workers_de(proceso.pid)]
+    finally:
+        proceso.send_signal(signal.SIGTERM)
+        proceso.wait(timeout=60)
+
+    latencias = [latencia for parcial, _ in resultados for latencia in parcial]
+    return {
+        'workers': workers,
+        'peticiones_por_segundo': len(latencias) / argumentos.duracion,
+        'p50_ms': statistics.median(latencias) * 1000 if latencias else 0.0,
+        'p95_ms': _percentil(latencias, 95) * 1000,
+        'errores': sum(errores for _, errores in resultados),
+        'uss_mib': statistics.mean(memoria) / 1024 if memoria else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de peticiones por segundo según workers de gunicorn')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Cantidades de workers a medir')
+    parser.add_argument('--hilos', type=int, default=8, help='Hilos por worker')
+    parser.add_argument('--clientes', type=int, default=8, help='Procesos cliente concurrentes')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos por ronda')
+    parser.add_argument('--rutas', nargs='+', default=RUTAS, help='Rutas que recorre cada cliente')
+    parser.add_argument('--cedula', default='admin')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--sin-precarga', action='store_true', help='Levantar gunicorn sin preload_app')
+    argumentos = parser.parse_args()
+
+    print(f"{'workers':>7} {'pet/s':>8} {'p50':>9} {'p95':>9} {'errores':>8} {'USS/worker':>11}")
+    for workers in argumentos.workers:
+        r = medir(workers, argumentos)
+        print(f"{r['workers']:>7} {r['peticiones_por_segundo']:>8.1f} {r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms "
+              f"{r['errores']:>8} {r['uss_mib']:>8.1f}MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import bisect
+import re
+import threading
+import unicodedata
+
+from sqlalchemy import event, func, literal_column, or_, select, table, column, text
+
+from models import db, Equipo, Usuario, ESTADOS_EQUIPO_RESERVABLES
+from invalidacion import generaciones, invalidar_al_confirmar
+
+TABLA_FTS = 'equipos_fts'
+TABLA_FTS_USUARIOS = 'usuarios_fts'
+
+# Pesos de bm25 por columna del índice: codigo, nombre, descripcion
+PESOS_BM25 = (10.0, 5.0, 1.0)
+
+_SENTENCIAS_INDICE = (
+    # remove_diacritics 2 hace que "camara" encuentre "Cámara"
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5(
+        codigo, nombre, descripcion,
+        content='equipos', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS equipos_fts_ai AFTER INSERT ON equipos BEGIN
+        INSERT INTO {TABLA_FTS}(rowid, codigo, nombre, descripcion)
+        VALUES (new.id, new.codigo, new.nombre, new.descripcion);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS equipos_fts_ad AFTER DELETE ON equipos BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, codigo, nombre, descripcion)
+        VALUES ('delete', old.id, old.codigo, old.nombre, old.descripcion);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS equipos_fts_au AFTER UPDATE OF codigo, nombre, descripcion ON equipos BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, codigo, nombre, descripcion)
+        VALUES ('delete', old.id, old.codigo, old.nombre, old.descripcion);
+        INSERT INTO {TABLA_FTS}(rowid, codigo, nombre, descripcion)
+        VALUES (new.id, new.codigo, new.nombre, new.descripcion);
+    END""",
+)
+
+# Búsqueda de usuarios del panel de administración (nombre, apellido y cédula). Los trigramas
+# conservan la búsqueda por subcadena de ILIKE: "11111" encuentra la cédula "V11111"
+_SENTENCIAS_INDICE_USUARIOS = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS_USUARIOS} USING fts5(
+        nombre, apellido, cedula,
+        content='usuarios', content_rowid='id',
+        tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS usuarios_fts_ai AFTER INSERT ON usuarios BEGIN
+        INSERT INTO {TABLA_FTS_USUARIOS}(rowid, nombre, apellido, cedula)
+        VALUES (new.id, new.nombre, new.apellido, new.cedula);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS usuarios_fts_ad AFTER DELETE ON usuarios BEGIN
+        INSERT INTO {TABLA_FTS_USUARIOS}({TABLA_FTS_USUARIOS}, rowid, nombre, apellido, cedula)
+        VALUES ('delete', old.id, old.nombre, old.apellido, old.cedula);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS usuarios_fts_au AFTER UPDATE OF nombre, apellido, cedula ON usuarios BEGIN
+        INSERT INTO {TABLA_FTS_USUARIOS}({TABLA_FTS_USUARIOS}, rowid, nombre, apellido, cedula)
+        VALUES ('delete', old.id, old.nombre, old.apellido, old.cedula);
+        INSERT INTO {TABLA_FTS_USUARIOS}(rowid, nombre, apellido, cedula)
+        VALUES (new.id, new.nombre, new.apellido, new.cedula);
+    END""",
+)
+
+# Tabla FTS5 -> sentencias que la crean junto con sus triggers
+INDICES_BUSQUEDA = {
+    TABLA_FTS: _SENTENCIAS_INDICE,
+    TABLA_FTS_USUARIOS: _SENTENCIAS_INDICE_USUARIOS,
+}
+
+# Tokenizador de cada tabla: una tabla creada con otro se elimina y se vuelve a crear
+TOKENIZADORES = {
+    TABLA_FTS: 'unicode61',
+    TABLA_FTS_USUARIOS: 'trigram',
+}
+
+# Los trigramas no indexan términos más cortos; esos se buscan con ILIKE
+LONGITUD_MINIMA_TRIGRAMA = 3
+
+_fts = table(TABLA_FTS, column('rowid'))
+_columna_fts = literal_column(TABLA_FTS)
+_fts_usuarios = table(TABLA_FTS_USUARIOS, column('rowid'))
+_columna_fts_usuarios = literal_column(TABLA_FTS_USUARIOS)
+
+# Caché por motor y tabla de si el índice FTS5 está disponible
+_fts_disponible = {}
+
+
+def _es_sqlite(conexion):
+    return conexion.dialect.name == 'sqlite'
+
+
+def _crear_fts(conexion, nombre, reconstruir=False):
+    definicion = conexion.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :nombre"),
+        {'nombre': nombre}
+    ).scalar()
+    existia = definicion is not None
+    if existia and f"tokenize='{TOKENIZADORES[nombre]}" not in definicion:
+        conexion.execute(text(f"DROP TABLE {nombre}"))
+        existia = False
+
+    try:
+        for sentencia in INDICES_BUSQUEDA[nombre]:
+            conexion.execute(text(sentencia))
+    except Exception:
+        # SQLite compilado sin FTS5
+        return False
+
+    if reconstruir or not existia:
+        conexion.execute(text(f"INSERT INTO {nombre}({nombre}) VALUES ('rebuild')"))
+    return True
+
+
+def crear_indice_busqueda(conexion, reconstruir=False):
+    """Crea las tablas FTS5 y sus triggers de sincronización; retorna False si el backend no las soporta"""
+    if not _es_sqlite(conexion):
+        return False
+    return all([_crear_fts(conexion, nombre, reconstruir) for nombre in INDICES_BUSQUEDA])
+
+
+@event.listens_for(Equipo.__table__, 'after_create')
+def _crear_indice_con_tabla(target, conexion, **kw):
+    if _es_sqlite(conexion):
+        _crear_fts(conexion, TABLA_FTS)
+
+
+@event.listens_for(Usuario.__table__, 'after_create')
+def _crear_indice_usuarios_con_tabla(target, conexion, **kw):
+    if _es_sqlite(conexion):
+        _crear_fts(conexion, TABLA_FTS_USUARIOS)
+
+
+def asegurar_indice_busqueda(reconstruir=False):
+    """Crea (o reconstruye) los índices de búsqueda en bases de datos existentes"""
+    with db.engine.begin() as conexion:
+        disponible = crear_indice_busqueda(conexion, reconstruir=reconstruir)
+    for nombre in INDICES_BUSQUEDA:
+        _fts_disponible.pop((db.engine.url, nombre), None)
+    return disponible
+
+
+def _indice_disponible(nombre=TABLA_FTS):
+    clave = (db.engine.url, nombre)
+    if clave not in _fts_disponible:
+        if db.engine.dialect.name != 'sqlite':
+            _fts_disponible[clave] = False
+        else:
+            _fts_disponible[clave] = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :nombre"),
+                {'nombre': nombre}
+            ).first() is not None
+    return _fts_disponible[clave]
+
+
+def _expresion_fts(termino):
+    """Convierte el texto del usuario en una consulta FTS5 segura (cada palabra como prefijo)"""
+    palabras = re.findall(r'\w+', termino)
+    return ' AND '.join(f'"{palabra}"*' for palabra in palabras)
+
+
+def buscar_equipos(consulta, termino, ordenar_por_relevancia=True):
+    """Filtra una consulta de Equipo por texto en código, nombre y descripción.
+
+    En SQLite usa el índice FTS5 (sin distinguir acentos) y ordena por
+    relevancia bm25 (salvo que el llamador necesite su propio orden, como la
+    paginación por cursor); en otros backends recurre a ILIKE. Los criterios de
+    orden que agregue el llamador quedan como desempate.
+    """
+    termino = (termino or '').strip()
+    if not termino:
+        return consulta
+
+    if _indice_disponible():
+        expresion = _expresion_fts(termino)
+        if not expresion:
+            return consulta
+        consulta = consulta.join(_fts, _fts.c.rowid == Equipo.id) \
+            .filter(_columna_fts.op('MATCH')(expresion))
+        if ordenar_por_relevancia:
+            consulta = consulta.order_by(func.bm25(_columna_fts, *PESOS_BM25))
+        return consulta
+
+    patron = f'%{termino}%'
+    return consulta.filter(or_(
+        Equipo.nombre.ilike(patron),
+        Equipo.codigo.ilike(patron),
+        Equipo.descripcion.ilike(patron)
+    ))
+
+
+def ids_equipos_coincidentes(termino):
+    """Subconsulta con los ids de los equipos que coinciden con el texto, o None si no hay nada que buscar"""
+    termino = (termino or '').strip()
+    if _indice_disponible():
+        expresion = _expresion_fts(termino)
+        if not expresion:
+            return None
+        # Solo código y nombre, como el filtro de préstamos por equipo
+        return select(_fts.c.rowid).where(_columna_fts.op('MATCH')(f'{{codigo nombre}} : ({expresion})'))
+    if not termino:
+        return None
+    patron = f'%{termino}%'
+    return select(Equipo.id).where(or_(Equipo.nombre.ilike(patron), Equipo.codigo.ilike(patron)))
+
+
+def ids_usuarios_coincidentes(termino):
+    """Subconsulta con los ids de los usuarios cuyo nombre, apellido o cédula contienen el texto.
+
+    Busca el texto completo como subcadena, igual que ILIKE '%texto%'. En SQLite
+    la resuelve el índice de trigramas (sin distinguir mayúsculas); los textos de
+    menos de tres caracteres y los demás backends usan ILIKE. Retorna None si el
+    texto está vacío.
+    """
+    termino = (termino or '').strip()
+    if not termino:
+        return None
+    if len(termino) >= LONGITUD_MINIMA_TRIGRAMA and _indice_disponible(TABLA_FTS_USUARIOS):
+        frase = termino.replace('"', '""')
+        return select(_fts_usuarios.c.rowid).where(_columna_fts_usuarios.op('MATCH')(f'"{frase}"'))
+    patron = f'%{termino}%'
+    return select(Usuario.id).where(or_(
+        Usuario.nombre.ilike(patron),
+        Usuario.apellido.ilike(patron),
+        Usuario.cedula.ilike(patron)
+    ))
+
+
+ESPACIO_TYPEAHEAD = 'equipos_typeahead'
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, para comparar como lo hace el índice FTS5"""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+
+class IndiceTypeahead:
+    """Índice ordenado en memoria de código y nombre de los equipos que admiten reservas.
+
+    Guarda pares (clave, equipo_id) ordenados para el código, el nombre completo
+    y cada palabra del nombre; un prefijo se resuelve con bisect sin consultar
+    la base de datos. Cualquier cambio confirmado en `equipos` incrementa una
+    generación compartida y el índice se reconstruye en la siguiente búsqueda.
+    """
+
+    def __init__(self):
+        self._claves = []
+        self._equipos = {}
+        self._generacion = None
+        self._lock = threading.Lock()
+
+    def _reconstruir(self, generacion):
+        filas = db.session.query(Equipo.id, Equipo.codigo, Equipo.nombre, Equipo.estado) \
+            .filter(Equipo.estado.in_(ESTADOS_EQUIPO_RESERVABLES)).all()
+        claves = []
+        equipos = {}
+        for fila in filas:
+            codigo, nombre = normalizar(fila.codigo), normalizar(fila.nombre)
+            equipos[fila.id] = (fila.codigo, fila.nombre, fila.estado, f'{codigo} {nombre}')
+            claves.append((codigo, 0, fila.id))
+            claves.append((nombre, 1, fila.id))
+            for palabra in nombre.split()[1:]:
+                claves.append((palabra, 2, fila.id))
+        claves.sort()
+        with self._lock:
+            self._claves, self._equipos, self._generacion = claves, equipos, generacion
+
+    def _vigente(self):
+        generacion = generaciones.leer(ESPACIO_TYPEAHEAD, 0)
+        if self._generacion != generacion:
+            self._reconstruir(generacion)
+
+    def cargar(self):
+        """Carga el índice ahora en lugar de esperar a la primera búsqueda"""
+        self._vigente()
+
+    def buscar(self, termino, limite=10):
+        """Retorna hasta `limite` equipos cuyo código o nombre empieza con (o contiene) el término"""
+        self._vigente()
+        palabras = normalizar(termino).split()
+        if not palabras:
+            return []
+        with self._lock:
+            claves, equipos = self._claves, self._equipos
+
+        # Prefijo de la primera palabra; el resto debe aparecer en código o nombre
+        mejores = {}
+        prefijo = palabras[0]
+        posicion = bisect.bisect_left(claves, (prefijo,))
+        while posicion < len(claves) and claves[posicion][0].startswith(prefijo):
+            _, prioridad, equipo_id = claves[posicion]
+            if all(palabra in equipos[equipo_id][3] for palabra in palabras[1:]):
+                mejores[equipo_id] = min(prioridad, mejores.get(equipo_id, prioridad))
+            posicion += 1
+
+        # Sin suficientes coincidencias por prefijo, se completa buscando como subcadena
+        if len(mejores) < limite and len(prefijo) >= 3:
+            for equipo_id, datos in equipos.items():
+                if equipo_id not in mejores and all(palabra in datos[3] for palabra in palabras):
+                    mejores[equipo_id] = 3
+
+        ordenados = sorted(mejores, key=lambda equipo_id: (mejores[equipo_id], equipos[equipo_id][0]))
+        return [
+            {'id': equipo_id, 'codigo': equipos[equipo_id][0], 'nombre': equipos[equipo_id][1],
+             'estado': equipos[equipo_id][2]}
+            for equipo_id in ordenados[:limite]
+        ]
+
+
+indice_typeahead = IndiceTypeahead()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _detectar_cambios_equipos(session, flush_context):
+    """Invalida el índice del selector cuando se crea, modifica o elimina un equipo"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Equipo):
+            invalidar_al_confirmar(ESPACIO_TYPEAHEAD, 0, session)
+            return
@@ -0,0 +1,158 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, make_response, request, session
+from flask_login import current_user
+from markupsafe import escape
+from sqlalchemy import event
+
+from models import db, Equipo, Prestamo, Usuario
+from invalidacion import generaciones, invalidar_al_confirmar
+
+ESPACIO_INVENTARIO = 'inventario'
+
+# Se reemplaza por el nombre del usuario al servir una página compartida
+MARCA_NOMBRE_USUARIO = '\x00nombre-usuario\x00'
+
+
+def _version_plantillas(app):
+    """Huella de las plantillas instaladas y del manifiesto de activos (ruta, tamaño y fecha de
+    modificación), igual en todos los workers"""
+    huella = hashlib.sha256()
+    carpeta = os.path.join(app.root_path, app.template_folder)
+    for directorio, _, archivos in sorted(os.walk(carpeta)):
+        for archivo in sorted(archivos):
+            estado = os.stat(os.path.join(directorio, archivo))
+            huella.update(f'{os.path.relpath(os.path.join(directorio, archivo), carpeta)}:{estado.st_size}:{estado.st_mtime_ns};'.encode())
+    # Las páginas enlazan los nombres con hash de static/dist/: una construcción nueva las cambia
+    manifiesto = os.path.join(app.static_folder, 'dist', 'manifest.json')
+    if os.path.isfile(manifiesto):
+        estado = os.stat(manifiesto)
+        huella.update(f'manifest.json:{estado.st_size}:{estado.st_mtime_ns};'.encode())
+    return huella.hexdigest()[:12]
+
+
+class CacheRespuestas:
+    """Páginas del catálogo ya renderizadas, compartidas por todos los usuarios del mismo tipo.
+
+    La clave es la ruta, sus argumentos y los de la URL, y el tipo de usuario;
+    cada entrada guarda la versión del inventario con la que se renderizó.
+    Cualquier cambio confirmado en equipos, préstamos o usuarios incrementa esa
+    versión en todos los workers. Lo único propio del usuario en la página (su
+    nombre en la barra de navegación) se inserta al servirla, y el ETag se
+    calcula sin consultar la base de datos, así que un If-None-Match vigente se
+    responde con 304 antes de ejecutar la vista.
+    """
+
+    def __init__(self, max_entradas=500):
+        self.max_entradas = max_entradas
+        self.habilitada = True
+        self.version_plantillas = ''
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = self.fallos = self.no_modificadas = 0
+
+    def init_app(self, app):
+        self.max_entradas = app.config.get('RESPUESTAS_CACHE_MAX', self.max_entradas)
+        self.habilitada = app.config.get('RESPUESTAS_CACHE', True)
+        # Un despliegue puede cambiar las plantillas: los ETags anteriores dejan de valer
+        self.version_plantillas = _version_plantillas(app)
+
+    def _clave(self, kwargs):
+        return (
+            request.endpoint,
+            tuple(sorted(kwargs.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            current_user.tipo_usuario.value
+        )
+
+    def _etag(self, version, clave):
+        datos = repr((self.version_plantillas, version, clave, current_user.id, current_user.nombre_completo)).encode()
+        return hashlib.sha256(datos).hexdigest()[:32]
+
+    def _obtener(self, clave, version):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == version:
+                self._entradas.move_to_end(clave)
+                return entrada[1]
+        return None
+
+    def _guardar(self, clave, version, cuerpo):
+        with self._lock:
+            self._entradas[clave] = (version, cuerpo)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def _responder(self, cuerpo, etag):
+        nombre = str(escape(current_user.nombre_completo)).encode()
+        respuesta = make_response(cuerpo.replace(MARCA_NOMBRE_USUARIO.encode(), nombre))
+        respuesta.mimetype = 'text/html'
+        respuesta.set_etag(etag)
+        # private: la página lleva el nombre del usuario; no-cache: el navegador revalida con el ETag
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta
+
+    def cachear(self, vista):
+        """Decorador para vistas GET cuyo HTML solo depende de sus argumentos y del tipo de usuario"""
+
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            # Los mensajes flash son de la sesión y se consumen al renderizar: esa página no se comparte
+            if not self.habilitada or request.method != 'GET' or session.get('_flashes'):
+                return vista(*args, **kwargs)
+
+            # La versión se lee antes de renderizar: si cambia mientras tanto, la entrada nace vencida
+            version = generaciones.leer(ESPACIO_INVENTARIO, 0)
+            clave = self._clave(kwargs)
+            etag = self._etag(version, clave)
+            # Comparación débil: con compresión el navegador devuelve el ETag como W/"..."
+            if request.if_none_match.contains_weak(etag):
+                self.no_modificadas += 1
+                respuesta = make_response('', 304)
+                respuesta.set_etag(etag)
+                respuesta.headers['Cache-Control'] = 'private, no-cache'
+                return respuesta
+
+            cuerpo = self._obtener(clave, version)
+            if cuerpo is None:
+                self.fallos += 1
+                g.respuesta_compartida = True
+                try:
+                    respuesta = make_response(vista(*args, **kwargs))
+                finally:
+                    g.respuesta_compartida = False
+                if respuesta.status_code != 200 or respuesta.mimetype != 'text/html':
+                    return respuesta
+                cuerpo = respuesta.get_data()
+                self._guardar(clave, version, cuerpo)
+            else:
+                self.aciertos += 1
+            return self._responder(cuerpo, etag)
+
+        return envoltura
+
+    def metricas(self):
+        return {
+            'entradas': len(self._entradas),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'no_modificadas': self.no_modificadas,
+            'version': generaciones.leer(ESPACIO_INVENTARIO, 0)
+        }
+
+
+cache_respuestas = CacheRespuestas()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _detectar_cambios_inventario(session, flush_context):
+    """Cualquier equipo, préstamo o usuario creado, modificado o eliminado vence las páginas cacheadas"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Equipo, Prestamo, Usuario)):
+            invalidar_al_confirmar(ESPACIO_INVENTARIO, 0, session)
+            return
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from models import db, Usuario, TipoUsuario
+from invalidacion import generaciones, invalidar_al_confirmar
+
+ESPACIO_USUARIOS = 'usuarios'
+
+
+class UsuarioSesion(UserMixin):
+    """Copia de solo lectura de los datos de un usuario que usan las peticiones autenticadas"""
+
+    __slots__ = ('id', 'cedula', 'nombre', 'apellido', 'tipo_usuario', 'activo')
+
+    def __init__(self, id, cedula, nombre, apellido, tipo_usuario, activo):
+        self.id = id
+        self.cedula = cedula
+        self.nombre = nombre
+        self.apellido = apellido
+        self.tipo_usuario = tipo_usuario
+        self.activo = activo
+
+    def __repr__(self):
+        return f'<UsuarioSesion {self.nombre} {self.apellido}>'
+
+    @property
+    def nombre_completo(self):
+        return f"{self.nombre} {self.apellido}"
+
+    @property
+    def is_active(self):
+        return bool(self.activo)
+
+    def es_admin(self):
+        return self.tipo_usuario == TipoUsuario.ADMIN
+
+    def puede_aprobar_prestamos(self):
+        return self.tipo_usuario in [TipoUsuario.ADMIN, TipoUsuario.PROFESOR]
+
+
+class CacheUsuarios:
+    """Usuarios de las sesiones activas, cacheados en cada worker para el user_loader.
+
+    Igual que el conteo de notificaciones, cada entrada guarda la generación
+    compartida con la que se leyó: cualquier cambio confirmado sobre el usuario
+    (desactivarlo, editarlo, resetear su contraseña) la invalida en todos los
+    workers. Además vence a los `ttl` segundos, por si la base de datos se
+    modifica por fuera de la aplicación.
+    """
+
+    def __init__(self, max_entradas=10000, ttl=60):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entradas = app.config.get('USUARIOS_CACHE_MAX', self.max_entradas)
+        self.ttl = app.config.get('USUARIOS_CACHE_TTL', self.ttl)
+
+    def obtener(self, usuario_id):
+        """Retorna el usuario de la sesión, o None si no existe"""
+        generacion = generaciones.leer(ESPACIO_USUARIOS, usuario_id)
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(usuario_id)
+            if entrada is not None and entrada[0] == generacion and entrada[1] > ahora:
+                self._entradas.move_to_end(usuario_id)
+                return entrada[2]
+
+        # La generación se lee antes de consultar, como en CacheConteoPendientes
+        fila = db.session.query(
+            Usuario.id, Usuario.cedula, Usuario.nombre, Usuario.apellido, Usuario.tipo_usuario, Usuario.activo
+        ).filter(Usuario.id == usuario_id).first()
+        usuario = UsuarioSesion(*fila) if fila is not None else None
+        with self._lock:
+            self._entradas[usuario_id] = (generacion, ahora + self.ttl, usuario)
+            self._entradas.move_to_end(usuario_id)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return usuario
+
+    def descartar(self, usuario_id):
+        """Quita al usuario de la caché de este worker"""
+        with self._lock:
+            self._entradas.pop(usuario_id, None)
+
+
+cache_usuarios = CacheUsuarios()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _detectar_cambios_usuarios(session, flush_context):
+    """Invalida en todos los workers a los usuarios modificados o eliminados"""
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Usuario):
+            invalidar_al_confirmar(ESPACIO_USUARIOS, obj.id, session)
@@ -0,0 +1,219 @@
+import click
+from flask.cli import AppGroup
+
+cli = AppGroup('iunp', help='Comandos de mantenimiento del Sistema de Préstamos IUNP.')
+
+
+def inicializar_base_datos(ejemplos=True):
+    """Crea el esquema, los índices y los datos iniciales; retorna los índices creados"""
+    from models import init_db, create_admin_user, crear_equipos_ejemplo
+    from indices import aplicar_indices
+    from busqueda import asegurar_indice_busqueda
+    from resumenes import asegurar_resumenes
+    from estadisticas import asegurar_estadisticas
+
+    init_db()
+    creados = aplicar_indices()
+    asegurar_indice_busqueda()
+    # Antes de los datos iniciales, para que sus altas pasen por los contadores
+    asegurar_estadisticas()
+    create_admin_user()
+    if ejemplos:
+        crear_equipos_ejemplo()
+    asegurar_resumenes()
+    return creados
+
+
+@cli.command('init')
+@click.option('--sin-ejemplos', is_flag=True, help='No crear los equipos de ejemplo.')
+def inicializar(sin_ejemplos):
+    """Crea el esquema, los índices y los datos iniciales (administrador y equipos de ejemplo)"""
+    for nombre in inicializar_base_datos(ejemplos=not sin_ejemplos):
+        click.echo(f"Índice creado: {nombre}")
+    click.echo("Base de datos inicializada.")
+
+
+@cli.command('vencimientos')
+def barrer_vencimientos():
+    """Marca como vencidos los préstamos aprobados cuya fecha de fin ya pasó y como prestados los equipos cuyo préstamo empezó"""
+    from vencimientos import barredor_vencimientos
+
+    ejecucion = barredor_vencimientos.barrer(origen='cli')
+    click.echo(f"Préstamos marcados como vencidos: {ejecucion['vencidos']}")
+    click.echo(f"Equipos marcados como prestados: {ejecucion['equipos_prestados']}")
+    click.echo(f"Duración: {ejecucion['duracion_ms']} ms")
+
+
+@cli.command('reconciliar-estadisticas')
+def reconciliar():
+    """Reconstruye desde cero los contadores materializados de estadísticas"""
+    from estadisticas import reconciliar_estadisticas
+
+    estadisticas = reconciliar_estadisticas()
+    for columna in estadisticas.__table__.columns.keys():
+        if columna != 'id':
+            click.echo(f"{columna}: {getattr(estadisticas, columna)}")
+
+
+@cli.command('outbox')
+@click.option('--despachar', is_flag=True, help='Reparte de inmediato las notificaciones pendientes.')
+@click.option('--purgar', is_flag=True, help='Elimina las entradas enviadas hace más de OUTBOX_RETENCION_DIAS.')
+def outbox(despachar, purgar):
+    """Muestra la profundidad de la bandeja de salida de notificaciones"""
+    from outbox import despachador_notificaciones, purgador_outbox
+
+    if despachar:
+        total = 0
+        while True:
+            reclamadas = despachador_notificaciones.despachar()
+            total += reclamadas
+            if reclamadas < despachador_notificaciones.entradas_por_ciclo:
+                break
+        click.echo(f"Entradas despachadas: {total}")
+    if purgar:
+        click.echo(f"Entradas enviadas eliminadas: {purgador_outbox.purgar()}")
+
+    for estado, cantidad in despachador_notificaciones.profundidad().items():
+        click.echo(f"{estado}: {cantidad}")
+
+
+@cli.command('purgar-tokens')
+@click.option('--retencion-horas', type=int, default=None,
+              help='Horas que se conserva un token tras expirar (por defecto TOKENS_RETENCION_HORAS).')
+def purgar_tokens(retencion_horas):
+    """Elimina los tokens de acceso único expirados"""
+    from tokens_acceso import purgador_tokens
+
+    purgados = purgador_tokens.purgar(retencion_horas)
+    click.echo(f"Tokens expirados eliminados: {purgados}")
+
+
+@cli.command('resumenes')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Primer día a recalcular (por defecto, desde el primer préstamo).')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Último día a recalcular (por defecto, hasta el último préstamo).')
+def resumenes(desde, hasta):
+    """Recalcula el resumen diario de préstamos que alimenta los gráficos de reportes"""
+    from resumenes import reconstruir_resumenes
+
+    totales = reconstruir_resumenes(desde.date() if desde else None, hasta.date() if hasta else None)
+    click.echo(f"Préstamos leídos: {totales['prestamos']}")
+    click.echo(f"Filas de resumen escritas: {totales['filas']}")
+
+
+@cli.command('reindexar-busqueda')
+def reindexar_busqueda():
+    """Reconstruye los índices de búsqueda de texto completo de equipos y usuarios"""
+    from busqueda import asegurar_indice_busqueda
+
+    if asegurar_indice_busqueda(reconstruir=True):
+        click.echo("Índices de búsqueda FTS5 reconstruidos.")
+    else:
+        click.echo("El backend de base de datos no soporta FTS5; se usará búsqueda con ILIKE.")
+
+
+@cli.command('activos')
+@click.option('--descargar', is_flag=True, help='Descargar antes las dependencias fijadas a static/vendor/ (requiere red).')
+def construir_activos(descargar):
+    """Publica en static/dist/ los paquetes CSS/JS, fuentes e imágenes con hash, .gz, .br y WebP"""
+    from flask import current_app
+    from activos import activos, construir, descargar_dependencias
+
+    if descargar:
+        for relativa in descargar_dependencias(current_app.static_folder):
+            click.echo(f"Descargado: vendor/{relativa}")
+    try:
+        resumen = construir(current_app.static_folder)
+    except FileNotFoundError as error:
+        raise click.ClickException(str(error))
+    activos.cargar_manifiesto()
+    click.echo(f"Archivos publicados: {resumen['archivos']}")
+    click.echo(f"CSS/JS/fuentes: {resumen['original'] // 1024} KiB, gzip {resumen['gzip'] // 1024} KiB, "
+               f"brotli {resumen['brotli'] // 1024} KiB")
+
+
+@cli.command('migrar-indices')
+def migrar_indices():
+    """Crea en la base de datos existente los índices declarados en los modelos"""
+    from indices import aplicar_indices
+
+    creados = aplicar_indices()
+    for nombre in creados:
+        click.echo(f"Índice creado: {nombre}")
+    click.echo(f"Índices creados: {len(creados)}")
+
+
+@cli.command('migrar-postgresql')
+@click.argument('origen')
+@click.option('--reemplazar', is_flag=True, help='Sobrescribir una base de datos destino que ya tiene préstamos.')
+@click.option('--filas-por-copy', default=10000, show_default=True, help='Filas enviadas en cada COPY.')
+def migrar_postgresql(origen, reemplazar, filas_por_copy):
+    """Copia una base de datos SQLite (ruta o URL) a la base PostgreSQL de DATABASE_URL"""
+    from migracion_postgresql import migrar_desde_sqlite
+
+    try:
+        totales = migrar_desde_sqlite(origen, reemplazar=reemplazar, filas_por_copy=filas_por_copy)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    segundos = totales.pop('segundos')
+    for tabla, cantidad in totales.items():
+        click.echo(f"{tabla}: {cantidad}")
+    click.echo(f"Duración: {segundos} s")
+
+
+@cli.command('explicar-consultas')
+def explicar():
+    """Recorre las rutas con el cliente de pruebas y ejecuta EXPLAIN QUERY PLAN sobre el SQL que emiten;
+    falla si alguna sentencia recorre una tabla sin estar admitida"""
+    from flask import current_app
+    from indices import explicar_consultas
+
+    fallos = 0
+    for resultado in explicar_consultas(current_app._get_current_object()):
+        if resultado['error']:
+            click.echo(f"[ERROR {resultado['error']}] {resultado['consulta']}: sus consultas no se pudieron verificar",
+                       err=True)
+            continue
+        if resultado['admitido']:
+            estado = f"RECORRIDO ADMITIDO: {resultado['admitido']}"
+        elif resultado['recorridos_completos']:
+            estado = 'RECORRIDO COMPLETO'
+            fallos += 1
+        else:
+            estado = 'ok'
+        click.echo(f"[{estado}] {resultado['consulta']}")
+        if resultado['sql']:
+            click.echo(f"    {' '.join(resultado['sql'].split())}")
+        for detalle in resultado['plan']:
+            click.echo(f"    -> {detalle}")
+
+    if fallos:
+        click.echo(f"{fallos} sentencia(s) recorren tablas completas.", err=True)
+        raise SystemExit(1)
+    click.echo("Todas las sentencias usan índices o tienen un recorrido admitido.")
+
+
+@cli.command('datos-carga')
+@click.option('--usuarios', default=50000, show_default=True, help='Usuarios a generar.')
+@click.option('--equipos', default=5000, show_default=True, help='Equipos a generar.')
+@click.option('--prestamos', default=1000000, show_default=True, help='Préstamos a generar.')
+@click.option('--semilla', default=42, show_default=True, help='Semilla del generador aleatorio.')
+@click.option('--anios', default=3, show_default=True, help='Años de historia hacia atrás.')
+@click.option('--fecha-referencia', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Fecha "actual" de los datos (por defecto hoy); fijarla hace el resultado reproducible.')
+@click.option('--sin-historial', is_flag=True, help='No generar historial de acciones.')
+@click.option('--sin-notificaciones', is_flag=True, help='No generar notificaciones.')
+def datos_carga(usuarios, equipos, prestamos, semilla, anios, fecha_referencia, sin_historial, sin_notificaciones):
+    """Puebla la base de datos con un conjunto de datos de carga a escala de producción"""
+    from datos_carga import generar_datos_carga
+
+    totales = generar_datos_carga(
+        usuarios=usuarios, equipos=equipos, prestamos=prestamos, semilla=semilla, anios=anios,
+        fecha_referencia=fecha_referencia, historial=not sin_historial,
+        notificaciones=not sin_notificaciones
+    )
+    segundos = totales.pop('segundos')
+    for tabla, cantidad in totales.items():
+        click.echo(f"{tabla}: {cantidad}")
+    click.echo(f"Duración: {segundos} s")
@@ -0,0 +1,227 @@
+"""
+Compresión de respuestas dinámicas y minificado del HTML de las plantillas.
+
+El middleware WSGI comprime con brotli o gzip (según Accept-Encoding) las
+respuestas de texto que superan un umbral, a medida que la aplicación entrega
+cada fragmento: una exportación CSV o un flujo largo nunca se acumula entero en
+memoria. Las respuestas que ya traen Content-Encoding (los activos
+precomprimidos de static/dist/) y los flujos SSE pasan sin tocar.
+
+El minificado ocurre al compilar cada plantilla: la extensión de Jinja colapsa
+los espacios del texto HTML de la plantilla (no el de las expresiones ni el de
+<pre>/<textarea>), así que no cuesta nada por petición.
+"""
+
+import re
+import threading
+import zlib
+
+from flask import request
+from jinja2.ext import Extension
+from jinja2.lexer import TOKEN_DATA, Token
+
+try:
+    import brotli
+except ImportError:  # Sin brotli se negocia solo gzip
+    brotli = None
+
+TIPOS_COMPRIMIBLES = ('text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+                      'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+_ESPACIOS = re.compile(r'\s+')
+_PRESERVAR = re.compile(r'(<(pre|textarea)\b|</(pre|textarea)\s*>)', re.IGNORECASE)
+
+
+def _colapsar(texto):
+    # Un salto de línea se conserva: termina los comentarios // de los scripts en línea
+    return _ESPACIOS.sub(lambda m: '\n' if '\n' in m.group(0) else ' ', texto)
+
+
+class MinificarHTML(Extension):
+    """Colapsa los espacios del texto literal de las plantillas al compilarlas"""
+
+    def filter_stream(self, stream):
+        preservando = False
+        for token in stream:
+            if token.type != TOKEN_DATA:
+                yield token
+                continue
+            partes = []
+            posicion = 0
+            for etiqueta in _PRESERVAR.finditer(token.value):
+                tramo = token.value[posicion:etiqueta.start()]
+                partes.append(tramo if preservando else _colapsar(tramo))
+                partes.append(etiqueta.group(0))
+                preservando = not etiqueta.group(0).startswith('</')
+                posicion = etiqueta.end()
+            tramo = token.value[posicion:]
+            partes.append(tramo if preservando else _colapsar(tramo))
+            yield Token(token.lineno, TOKEN_DATA, ''.join(partes))
+
+
+class _Gzip:
+    def __init__(self, nivel):
+        self._compresor = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def comprimir(self, datos):
+        return self._compresor.compress(datos)
+
+    def terminar(self):
+        return self._compresor.flush()
+
+
+class _Brotli:
+    def __init__(self, calidad):
+        self._compresor = brotli.Compressor(quality=calidad)
+
+    def comprimir(self, datos):
+        return self._compresor.process(datos)
+
+    def terminar(self):
+        return self._compresor.finish()
+
+
+class Compresion:
+    """Middleware de compresión y contabilidad de bytes ahorrados por ruta"""
+
+    def __init__(self):
+        self.umbral = 1024
+        self.nivel_gzip = 6
+        self.calidad_brotli = 4
+        self._lock = threading.Lock()
+        self._rutas = {}
+
+    def init_app(self, app):
+        self.umbral = app.config.get('COMPRESION_UMBRAL', self.umbral)
+        self.nivel_gzip = app.config.get('COMPRESION_NIVEL_GZIP', self.nivel_gzip)
+        self.calidad_brotli = app.config.get('COMPRESION_CALIDAD_BROTLI', self.calidad_brotli)
+        if app.config.get('HTML_MINIFICAR', True):
+            app.jinja_env.add_extension(MinificarHTML)
+        if app.config.get('COMPRESION', True):
+            app.wsgi_app = self._envolver(app.wsgi_app)
+
+            @app.before_request
+            def _anotar_ruta():
+                # El middleware ve el entorno WSGI, no la regla de Flask que atendió la petición
+                request.environ['iunp.ruta'] = request.endpoint
+
+    def _codificacion(self, environ):
+        aceptadas = environ.get('HTTP_ACCEPT_ENCODING', '').lower()
+        if environ.get('REQUEST_METHOD') == 'HEAD' or environ.get('HTTP_RANGE'):
+            return None
+        calidades = {}
+        for parte in aceptadas.split(','):
+            nombre, _, parametros = parte.strip().partition(';')
+            calidad = 1.0
+            if parametros.strip().startswith('q='):
+                try:
+                    calidad = float(parametros.strip()[2:])
+                except ValueError:
+                    calidad = 0.0
+            calidades[nombre.strip()] = calidad
+        if brotli is not None and calidades.get('br', 0) > 0:
+            return 'br'
+        if calidades.get('gzip', 0) > 0:
+            return 'gzip'
+        return None
+
+    def _comprimible(self, status, cabeceras):
+        if not status.startswith('200'):
+            return False
+        valores = {nombre.lower(): valor for nombre, valor in cabeceras}
+        tipo = valores.get('content-type', '').split(';')[0].strip().lower()
+        if tipo not in TIPOS_COMPRIMIBLES or 'content-encoding' in valores:
+            return False
+        if 'no-transform' in valores.get('cache-control', '').lower():
+            return False
+        longitud = valores.get('content-length')
+        # Sin Content-Length es una respuesta en streaming: se comprime sin esperar al final
+        return longitud is None or int(longitud) >= self.umbral
+
+    def _registrar(self, ruta, original, comprimido):
+        with self._lock:
+            datos = self._rutas.setdefault(ruta or '(sin ruta)', [0, 0, 0])
+            datos[0] += 1
+            datos[1] += original
+            datos[2] += comprimido
+
+    def _envolver(self, wsgi_app):
+        def middleware(environ, start_response):
+            codificacion = self._codificacion(environ)
+            if codificacion is None:
+                return wsgi_app(environ, start_response)
+
+            estado = {}
+
+            def iniciar(status, cabeceras, exc_info=None):
+                if not self._comprimible(status, cabeceras):
+                    if status.startswith('304'):
+                        # Mismo ETag débil que la respuesta comprimida que el navegador tiene guardada
+                        cabeceras = [(nombre, _etag_debil(valor) if nombre.lower() == 'etag' else valor)
+                                     for nombre, valor in cabeceras]
+                    return start_response(status, cabeceras, exc_info)
+                estado['compresor'] = _Brotli(self.calidad_brotli) if codificacion == 'br' else _Gzip(self.nivel_gzip)
+                nuevas = []
+                vary = []
+                for nombre, valor in cabeceras:
+                    clave = nombre.lower()
+                    if clave == 'content-length':
+                        continue
+                    if clave == 'vary':
+                        vary.append(valor)
+                        continue
+                    if clave == 'etag':
+                        # El cuerpo cambia byte a byte: el ETag fuerte del original ya no lo identifica
+                        valor = _etag_debil(valor)
+                    nuevas.append((nombre, valor))
+                vary.append('Accept-Encoding')
+                nuevas.append(('Vary', ', '.join(vary)))
+                nuevas.append(('Content-Encoding', codificacion))
+                return start_response(status, nuevas, exc_info)
+
+            respuesta = wsgi_app(environ, iniciar)
+            if 'compresor' not in estado:
+                # start_response ya se llamó (las vistas de Flask lo hacen antes del primer fragmento)
+                return respuesta
+            return self._comprimir(respuesta, estado['compresor'], environ)
+
+        return middleware
+
+    def _comprimir(self, respuesta, compresor, environ):
+        original = comprimido = 0
+        try:
+            for fragmento in respuesta:
+                if not fragmento:
+                    continue
+                original += len(fragmento)
+                salida = compresor.comprimir(fragmento)
+                if salida:
+                    comprimido += len(salida)
+                    yield salida
+            salida = compresor.terminar()
+            comprimido += len(salida)
+            yield salida
+        finally:
+            if hasattr(respuesta, 'close'):
+                respuesta.close()
+            self._registrar(environ.get('iunp.ruta'), original, comprimido)
+
+    def metricas(self):
+        """Bytes sin comprimir y enviados por ruta, de la que más ahorra a la que menos"""
+        with self._lock:
+            rutas = [{
+                'ruta': ruta,
+                'respuestas': respuestas,
+                'bytes_originales': original,
+                'bytes_enviados': enviado,
+                'bytes_ahorrados': original - enviado,
+                'proporcion': round(enviado / original, 3) if original else None
+            } for ruta, (respuestas, original, enviado) in self._rutas.items()]
+        return sorted(rutas, key=lambda ruta: ruta['bytes_ahorrados'], reverse=True)
+
+
+def _etag_debil(valor):
+    return valor if valor.startswith('W/') else f'W/{valor}'
+
+
+compresion = Compresion()
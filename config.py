@@ -2,5 +2,42 @@ import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'sistema-prestamos-secreto-2025'
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///prestamos.db'
+    # Ruta relativa: Flask-SQLAlchemy la ubica dentro de la carpeta instance/
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///sistema_prestamos.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Pool de conexiones por worker; pre_ping descarta conexiones caídas antes de entregarlas
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 10,
+        'pool_recycle': 3600,
+        'pool_pre_ping': True,
+    }
+    # PRAGMAs de SQLite que reemplazan los del perfil de base_datos.PRAGMAS_SQLITE
+    SQLITE_PRAGMAS = {}
+
+    # Ranuras de la tabla de generaciones por espacio; reemplaza tamaños de invalidacion.RANURAS_POR_ESPACIO
+    GENERACIONES_RANURAS = {}
+    BARREDOR_VENCIMIENTOS_INTERVALO = 60  # segundos entre pasadas
+    NOTIFICACIONES_STREAM_LATIDO = 15  # segundos entre heartbeats del flujo SSE
+    NOTIFICACIONES_STREAM_REVISION = 2  # segundos entre revisiones de cambios de otros workers
+    NOTIFICACIONES_STREAM_DURACION = 300  # luego el navegador reconecta con Last-Event-ID
+    # Flujos SSE abiertos a la vez por worker: cada uno ocupa un hilo; gunicorn.conf.py lo ajusta a sus hilos
+    NOTIFICACIONES_STREAM_MAX = int(os.environ.get('NOTIFICACIONES_STREAM_MAX', 4))
+    NOTIFICACIONES_SONDEO = 30  # segundos entre consultas del conteo cuando no hay flujo disponible
+    OUTBOX_PURGA_INTERVALO = 3600  # segundos entre purgas de la bandeja de salida
+    OUTBOX_RETENCION_DIAS = 7  # días que se conserva una entrada ya enviada
+    TOKENS_PURGA_INTERVALO = 3600  # segundos entre purgas de tokens expirados
+    TOKENS_RETENCION_HORAS = 24  # horas que se conserva un token después de expirar
+    # Procesos para hashear contraseñas en cada worker (0 = en línea); gunicorn.conf.py lo reparte entre los workers
+    HASH_PROCESOS = int(os.environ.get('HASH_PROCESOS', min(os.cpu_count() or 1, 4)))
+    HASH_TIMEOUT = 5  # segundos máximos de espera por un hash
+    USUARIOS_CACHE_TTL = 60  # segundos que un worker reutiliza los datos de un usuario
+    RESPUESTAS_CACHE_MAX = 500  # páginas del catálogo renderizadas que guarda cada worker
+    COMPRESION_UMBRAL = 1024  # bytes mínimos de una respuesta de texto para comprimirla
+    COMPRESION_NIVEL_GZIP = 6
+    COMPRESION_CALIDAD_BROTLI = 4  # 0-11; las calidades altas son para activos precomprimidos, no por petición
+    HTML_MINIFICAR = True  # colapsar espacios de las plantillas al compilarlas
+    AUDITORIA_INTERVALO_MS = 500  # milisegundos entre escrituras del historial en lote
+    AUDITORIA_TAMANO_LOTE = 200  # eventos que adelantan la escritura
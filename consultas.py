@@ -0,0 +1,41 @@
+from sqlalchemy import exists
+from sqlalchemy.orm import configure_mappers, joinedload, with_expression
+
+from models import Equipo, Prestamo, EstadoPrestamo
+
+# Las relaciones definidas con backref solo existen una vez configurados los mappers
+configure_mappers()
+
+# Indica si el equipo tiene un préstamo aprobado, sin cargar su historial
+_EQUIPO_CON_PRESTAMO_ACTIVO = exists().where(
+    Prestamo.equipo_id == Equipo.id,
+    Prestamo.estado == EstadoPrestamo.APROBADO
+).correlate(Equipo)
+
+# Perfiles de carga por vista: precargan en la misma consulta lo que usa cada
+# template, de modo que el número de consultas no depende del tamaño de la página
+PERFILES_CARGA = {
+    # admin/admin_prestamos.html: usuario, equipo y aprobador de cada fila
+    'admin_prestamos': (
+        joinedload(Prestamo.usuario),
+        joinedload(Prestamo.equipo),
+        joinedload(Prestamo.aprobado_por),
+    ),
+    # prestamos/listar.html: equipo de cada préstamo activo del usuario
+    'prestamos_usuario': (
+        joinedload(Prestamo.equipo),
+    ),
+    # equipos/ver.html: usuario de los últimos préstamos del equipo
+    'historial_equipo': (
+        joinedload(Prestamo.usuario),
+    ),
+    # prestamos/listar.html: equipo.tiene_prestamo_activo() sin cargar equipo.prestamos
+    'catalogo_equipos': (
+        with_expression(Equipo.prestamo_activo, _EQUIPO_CON_PRESTAMO_ACTIVO),
+    ),
+}
+
+
+def con_perfil(consulta, nombre):
+    """Aplica a la consulta las opciones de carga del perfil indicado"""
+    return consulta.options(*PERFILES_CARGA[nombre])
@@ -0,0 +1,394 @@
+"""
+Generador de datos de carga para pruebas de rendimiento.
+
+Amplía los datos de demostración (demo_data.py) a volúmenes de producción:
+decenas de miles de usuarios, miles de equipos y millones de préstamos con su
+historial y notificaciones. Es determinista por semilla y escribe con
+`executemany` por lotes, sin pasar por la sesión del ORM. En SQLite las filas
+se generan ya en el formato de almacenamiento y se envían al driver sin el
+procesamiento por valor de SQLAlchemy, que dominaba el tiempo de carga.
+"""
+
+import random
+import unicodedata
+from datetime import datetime, timedelta
+from itertools import accumulate
+from time import perf_counter
+
+from sqlalchemy import func, select, text, update
+from werkzeug.security import generate_password_hash
+
+from models import (db, Usuario, Equipo, Prestamo, HistorialAcciones, Notificacion,
+                    TipoUsuario, EstadoPrestamo, CategoriaEquipo, TipoNotificacion)
+from base_datos import sin_limite_de_tiempo, sincronizar_secuencias
+
+CONTRASENA_CARGA = 'carga123'
+
+NOMBRES = ['María', 'José', 'Ana', 'Luis', 'Carmen', 'Carlos', 'Rosa', 'Juan', 'Daniela', 'Pedro',
+           'Gabriela', 'Miguel', 'Valentina', 'Andrés', 'Sofía', 'Jesús', 'Isabel', 'Roberto',
+           'Andrea', 'Francisco', 'Lucía', 'Alejandro', 'Paola', 'Ricardo', 'Mariana', 'Eduardo']
+APELLIDOS = ['González', 'Rodríguez', 'Pérez', 'Martínez', 'López', 'Fernández', 'Hernández',
+             'García', 'Díaz', 'Ramírez', 'Torres', 'Rojas', 'Morales', 'Álvarez', 'Romero',
+             'Suárez', 'Castillo', 'Mendoza', 'Vargas', 'Gutiérrez', 'Silva', 'Medina']
+
+# Catálogo base (el de demo_data.py): categoría -> (prefijo de código, peso, modelos)
+CATALOGO = {
+    CategoriaEquipo.COMPUTADORA: ('LAP', 45, [
+        ('Laptop Dell Inspiron 15', 'Dell', 'Inspiron 15 3000'),
+        ('Laptop HP Pavilion', 'HP', 'Pavilion 15-eh'),
+        ('MacBook Air M1', 'Apple', 'MacBook Air M1'),
+        ('Tablet iPad Air', 'Apple', 'iPad Air 4ta Gen'),
+    ]),
+    CategoriaEquipo.PROYECTOR: ('PROJ', 15, [
+        ('Proyector Epson PowerLite', 'Epson', 'PowerLite 1795F'),
+        ('Proyector BenQ MX531', 'BenQ', 'MX531'),
+    ]),
+    CategoriaEquipo.AUDIOVISUAL: ('AV', 15, [
+        ('Cámara Canon EOS Rebel', 'Canon', 'EOS Rebel T7i'),
+        ('Micrófono Blue Yeti', 'Blue', 'Yeti USB'),
+    ]),
+    CategoriaEquipo.LABORATORIO: ('LAB', 12, [
+        ('Osciloscopio Digital', 'Rigol', 'DS1054Z'),
+    ]),
+    CategoriaEquipo.HERRAMIENTAS: ('HER', 8, [
+        ('Impresora 3D Ender 3', 'Creality', 'Ender 3 V2'),
+    ]),
+    CategoriaEquipo.OTROS: ('OTR', 5, [
+        ('Kit de Arduino', 'Arduino', 'Starter Kit'),
+    ]),
+}
+
+# Orden de las columnas de cada fila generada
+COLUMNAS = {
+    Usuario: ('id', 'cedula', 'nombre', 'apellido', 'email', 'telefono', 'password_hash',
+              'tipo_usuario', 'activo', 'fecha_registro'),
+    Equipo: ('id', 'codigo', 'nombre', 'descripcion', 'categoria', 'marca', 'modelo', 'numero_serie',
+             'estado', 'disponible', 'fecha_adquisicion', 'fecha_registro'),
+    Prestamo: ('id', 'usuario_id', 'equipo_id', 'fecha_solicitud', 'fecha_inicio', 'fecha_fin_programada',
+               'fecha_devolucion', 'aprobado_por_id', 'fecha_aprobacion', 'motivo', 'estado'),
+    HistorialAcciones: ('usuario_id', 'prestamo_id', 'accion', 'descripcion', 'fecha'),
+    Notificacion: ('usuario_id', 'prestamo_id', 'tipo', 'titulo', 'mensaje', 'leida', 'fecha_creacion',
+                   'fecha_lectura', 'urgencia', 'icono'),
+}
+
+# Demanda relativa por mes: picos a mitad y final de cada semestre, vacaciones en julio-agosto
+PESOS_MES = (0.4, 0.9, 1.3, 1.2, 1.4, 1.6, 0.5, 0.3, 1.0, 1.3, 1.5, 0.7)
+PESO_FIN_DE_SEMANA = 0.15
+DURACIONES_DIAS = (1, 2, 3, 5, 7, 14)
+PESOS_DURACION = (10, 15, 25, 20, 20, 10)
+
+
+def _ascii(texto):
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def _pesos_acumulados(rng, cantidad, forma=1.2):
+    """Pesos de popularidad con cola larga (Pareto): pocos concentran la mayoría de préstamos"""
+    return list(accumulate(rng.paretovariate(forma) for _ in range(cantidad)))
+
+
+def _pesos_dias(desde, cantidad):
+    """Peso acumulado de cada día del rango según el mes y el día de la semana"""
+    dias = (desde + timedelta(days=n) for n in range(cantidad))
+    return list(accumulate(PESOS_MES[d.month - 1] * (PESO_FIN_DE_SEMANA if d.weekday() >= 5 else 1.0)
+                           for d in dias))
+
+
+class GeneradorDatosCarga:
+    """Construye un conjunto de datos sintético y reproducible para pruebas de carga.
+
+    Las tasas controlan la distribución de estados: `tasa_rechazo` de las
+    solicitudes procesadas, `tasa_vencidos` de los préstamos cuyo plazo venció
+    en los últimos 60 días y siguen sin devolverse, y `tasa_devolucion_tardia`
+    de los devueltos después de la fecha programada.
+    """
+
+    def __init__(self, usuarios=50000, equipos=5000, prestamos=1000000, semilla=42, anios=3,
+                 fecha_referencia=None, historial=True, notificaciones=True, tamano_lote=20000,
+                 tasa_rechazo=0.08, tasa_vencidos=0.1, tasa_devolucion_tardia=0.15):
+        self.usuarios = usuarios
+        self.equipos = equipos
+        self.prestamos = prestamos
+        self.semilla = semilla
+        self.anios = anios
+        # Con la misma semilla y fecha de referencia, el resultado es idéntico
+        self.fecha_referencia = (fecha_referencia or datetime.utcnow()).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        self.historial = historial
+        self.notificaciones = notificaciones
+        self.tamano_lote = tamano_lote
+        self.tasa_rechazo = tasa_rechazo
+        self.tasa_vencidos = tasa_vencidos
+        self.tasa_devolucion_tardia = tasa_devolucion_tardia
+
+        self.rng = random.Random(semilla)
+        self.inicio_rango = self.fecha_referencia - timedelta(days=365 * anios)
+        self._pendientes = {modelo: [] for modelo in COLUMNAS}
+        self._sentencias = None
+        self.totales = {}
+
+    # --- Escritura por lotes -------------------------------------------------
+
+    def _preparar(self, conexion):
+        """Elige el formato de los valores según el backend"""
+        if conexion.dialect.name == 'sqlite':
+            # Mismo formato de almacenamiento que usa SQLAlchemy (las fechas generadas no tienen microsegundos)
+            self._fecha = lambda valor: valor.isoformat(' ') + '.000000'
+            self._enum = lambda miembro: miembro.name
+            self._sentencias = {
+                modelo: 'INSERT INTO {} ({}) VALUES ({})'.format(
+                    modelo.__tablename__, ', '.join(columnas), ', '.join('?' * len(columnas)))
+                for modelo, columnas in COLUMNAS.items()
+            }
+        else:
+            self._fecha = self._enum = lambda valor: valor
+            self._sentencias = None
+
+    def _agregar(self, conexion, modelo, fila):
+        pendientes = self._pendientes[modelo]
+        pendientes.append(fila)
+        if len(pendientes) >= self.tamano_lote:
+            self._vaciar(conexion, modelo)
+
+    def _vaciar(self, conexion, modelo):
+        filas = self._pendientes[modelo]
+        if not filas:
+            return
+        if self._sentencias is not None:
+            conexion.exec_driver_sql(self._sentencias[modelo], filas)
+        else:
+            columnas = COLUMNAS[modelo]
+            conexion.execute(modelo.__table__.insert(), [dict(zip(columnas, fila)) for fila in filas])
+        self.totales[modelo.__tablename__] = self.totales.get(modelo.__tablename__, 0) + len(filas)
+        self._pendientes[modelo] = []
+
+    def _siguiente_id(self, conexion, modelo):
+        return (conexion.execute(select(func.max(modelo.id))).scalar() or 0) + 1
+
+    # --- Generación -----------------------------------------------------------
+
+    def _generar_usuarios(self, conexion):
+        rng, fecha, enum = self.rng, self._fecha, self._enum
+        # Un solo hash para todas las cuentas: calcular 50.000 hashes tomaría minutos
+        password_hash = generate_password_hash(CONTRASENA_CARGA)
+        primer_id = self._siguiente_id(conexion, Usuario)
+        admins, solicitantes = [], []
+
+        for usuario_id in range(primer_id, primer_id + self.usuarios):
+            sorteo = rng.random()
+            if sorteo < 0.0005 or not admins:
+                tipo = TipoUsuario.ADMIN
+                admins.append(usuario_id)
+            else:
+                tipo = TipoUsuario.PROFESOR if sorteo < 0.13 else TipoUsuario.ESTUDIANTE
+                solicitantes.append(usuario_id)
+            nombre, apellido = rng.choice(NOMBRES), rng.choice(APELLIDOS)
+            # Todos registrados antes del primer préstamo generado
+            registro = self.inicio_rango - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            self._agregar(conexion, Usuario, (
+                usuario_id, f'V-{10000000 + usuario_id}', nombre, apellido,
+                f'{_ascii(nombre)}.{_ascii(apellido)}{usuario_id}@carga.iunp.edu.ve',
+                f'0414-{rng.randint(1000000, 9999999)}', password_hash, enum(tipo),
+                rng.random() > 0.02, fecha(registro)
+            ))
+        self._vaciar(conexion, Usuario)
+        return admins, solicitantes
+
+    def _generar_equipos(self, conexion):
+        rng, fecha, enum = self.rng, self._fecha, self._enum
+        categorias = list(CATALOGO)
+        pesos_categoria = list(accumulate(CATALOGO[c][1] for c in categorias))
+        primer_id = self._siguiente_id(conexion, Equipo)
+        equipos, fuera_de_servicio = [], set()
+
+        for equipo_id in range(primer_id, primer_id + self.equipos):
+            categoria = rng.choices(categorias, cum_weights=pesos_categoria)[0]
+            prefijo, _, modelos = CATALOGO[categoria]
+            nombre, marca, modelo = rng.choice(modelos)
+            sorteo = rng.random()
+            estado = 'mantenimiento' if sorteo < 0.05 else 'dañado' if sorteo < 0.07 else 'disponible'
+            if estado != 'disponible':
+                fuera_de_servicio.add(equipo_id)
+            registro = self.inicio_rango - timedelta(days=rng.randint(30, 720))
+            self._agregar(conexion, Equipo, (
+                equipo_id, f'{prefijo}-{equipo_id:06d}', f'{nombre} #{equipo_id}',
+                f'{nombre} ({marca} {modelo}) del inventario de carga.', enum(categoria), marca, modelo,
+                f'{marca[:3].upper()}-{rng.getrandbits(40):010X}', estado, estado == 'disponible',
+                str(registro.date()) if self._sentencias is not None else registro.date(), fecha(registro)
+            ))
+            equipos.append(equipo_id)
+        self._vaciar(conexion, Equipo)
+        return equipos, fuera_de_servicio
+
+    def _formato_minutos(self, total_dias):
+        """Convierte minutos desde el inicio del rango al valor de fecha de la base de datos.
+
+        Los préstamos se generan con aritmética entera de minutos; en SQLite el
+        texto se arma con tablas precalculadas de días y horas del día.
+        """
+        if self._sentencias is None:
+            inicio_rango = self.inicio_rango
+            return lambda minutos: inicio_rango + timedelta(minutes=minutos)
+        dias = [str((self.inicio_rango + timedelta(days=n)).date()) + ' ' for n in range(total_dias)]
+        horas = [f'{m // 60:02d}:{m % 60:02d}:00.000000' for m in range(1440)]
+        return lambda minutos: dias[minutos // 1440] + horas[minutos % 1440]
+
+    def _generar_prestamos(self, conexion, admins, solicitantes, equipos, fuera_de_servicio):
+        rng, enum = self.rng, self._enum
+        aleatorio = rng.random
+        total_dias = (self.fecha_referencia - self.inicio_rango).days
+        # Margen para los préstamos que terminan después de la fecha de referencia
+        fecha = self._formato_minutos(total_dias + 30)
+        pesos_dias = _pesos_dias(self.inicio_rango, total_dias)
+        dias = range(total_dias)
+        pesos_usuarios = _pesos_acumulados(rng, len(solicitantes))
+        pesos_equipos = _pesos_acumulados(rng, len(equipos))
+        # Un equipo solo puede estar en un préstamo activo (aprobado o vencido)
+        ocupados = set(fuera_de_servicio)
+        prestados = []
+
+        estados = {estado: enum(estado) for estado in EstadoPrestamo}
+        tipo_aprobacion = enum(TipoNotificacion.APROBACION_PRESTAMO)
+        tipo_rechazo = enum(TipoNotificacion.RECHAZO_PRESTAMO)
+        tipo_vencimiento = enum(TipoNotificacion.VENCIMIENTO_PRESTAMO)
+        # Todos los instantes en minutos desde el inicio del rango
+        una_hora, un_dia = 60, 1440
+        referencia = total_dias * un_dia
+        pendientes_recientes = referencia - 3 * un_dia
+        ventana_vencidos = referencia - 60 * un_dia
+        leidas_antes_de = referencia - 7 * un_dia
+        motivo = 'Préstamo generado para pruebas de carga'
+
+        restantes = self.prestamos
+        prestamo_id = self._siguiente_id(conexion, Prestamo)
+        while restantes > 0:
+            lote = min(restantes, self.tamano_lote)
+            restantes -= lote
+            fechas = rng.choices(dias, cum_weights=pesos_dias, k=lote)
+            usuarios = rng.choices(solicitantes, cum_weights=pesos_usuarios, k=lote)
+            candidatos = rng.choices(equipos, cum_weights=pesos_equipos, k=lote)
+            duraciones = rng.choices(DURACIONES_DIAS, weights=PESOS_DURACION, k=lote)
+
+            for dia, usuario_id, equipo_id, duracion in zip(fechas, usuarios, candidatos, duraciones):
+                # Solicitudes en horario de oficina (7:00 a 18:59)
+                solicitud = dia * un_dia + 420 + int(aleatorio() * 720)
+                inicio = solicitud + un_dia * int(aleatorio() * 4)
+                fin = inicio + un_dia * duracion
+                devolucion = aprobador = aprobacion = None
+
+                # Las solicitudes de los últimos días pueden seguir pendientes
+                if solicitud > pendientes_recientes and aleatorio() < 0.7:
+                    estado = EstadoPrestamo.SOLICITADO
+                else:
+                    aprobador = admins[int(aleatorio() * len(admins))]
+                    aprobacion = min(solicitud + una_hora * (1 + int(aleatorio() * 48)), referencia)
+                    # Los vencidos sin devolver son préstamos recientes; los antiguos ya se cerraron
+                    activo = fin >= referencia or (fin > ventana_vencidos and aleatorio() < self.tasa_vencidos)
+                    if aleatorio() < self.tasa_rechazo or (activo and equipo_id in ocupados):
+                        estado = EstadoPrestamo.RECHAZADO
+                    elif activo:
+                        estado = EstadoPrestamo.APROBADO if fin >= referencia else EstadoPrestamo.VENCIDO
+                        ocupados.add(equipo_id)
+                        prestados.append(equipo_id)
+                    else:
+                        estado = EstadoPrestamo.DEVUELTO
+                        if aleatorio() < self.tasa_devolucion_tardia:
+                            devolucion = fin + una_hora * (24 + int(aleatorio() * 240))
+                        else:
+                            devolucion = fin - una_hora * int(aleatorio() * 24 * duracion)
+                        devolucion = min(max(devolucion, aprobacion), referencia)
+
+                self._agregar(conexion, Prestamo, (
+                    prestamo_id, usuario_id, equipo_id, fecha(solicitud), fecha(inicio), fecha(fin),
+                    fecha(devolucion) if devolucion is not None else None, aprobador,
+                    fecha(aprobacion) if aprobacion is not None else None, motivo, estados[estado]
+                ))
+
+                # Acciones y notificaciones que habría registrado la aplicación
+                if self.historial:
+                    self._agregar(conexion, HistorialAcciones, (
+                        usuario_id, prestamo_id, 'solicitar_prestamo', 'Solicitado préstamo de equipo',
+                        fecha(solicitud)))
+                    if aprobacion is not None:
+                        self._agregar(conexion, HistorialAcciones, (
+                            aprobador, prestamo_id, 'aprobar_prestamo',
+                            'Préstamo rechazado' if estado == EstadoPrestamo.RECHAZADO else 'Préstamo aprobado',
+                            fecha(aprobacion)))
+                    if devolucion is not None:
+                        self._agregar(conexion, HistorialAcciones, (
+                            usuario_id, prestamo_id, 'devolver_equipo', 'Devuelto equipo', fecha(devolucion)))
+
+                if self.notificaciones and aprobacion is not None:
+                    rechazado = estado == EstadoPrestamo.RECHAZADO
+                    # Las notificaciones de más de una semana casi siempre ya se leyeron
+                    leida = aprobacion < leidas_antes_de or aleatorio() < 0.3
+                    self._agregar(conexion, Notificacion, (
+                        usuario_id, prestamo_id, tipo_rechazo if rechazado else tipo_aprobacion,
+                        'Préstamo rechazado' if rechazado else 'Préstamo aprobado',
+                        'Tu solicitud de préstamo fue procesada.', leida, fecha(aprobacion),
+                        fecha(aprobacion + 2 * una_hora) if leida else None,
+                        'alta' if rechazado else 'normal', 'times-circle' if rechazado else 'check-circle'))
+                    if estado == EstadoPrestamo.VENCIDO:
+                        self._agregar(conexion, Notificacion, (
+                            usuario_id, prestamo_id, tipo_vencimiento, 'Préstamo vencido',
+                            'El plazo de tu préstamo venció; devuelve el equipo.', False, fecha(fin), None,
+                            'critica', 'exclamation-triangle'))
+
+                prestamo_id += 1
+
+        for modelo in (Prestamo, HistorialAcciones, Notificacion):
+            self._vaciar(conexion, modelo)
+
+        # Los equipos con préstamo activo quedan prestados
+        for inicio in range(0, len(prestados), self.tamano_lote):
+            conexion.execute(
+                update(Equipo).where(Equipo.id.in_(prestados[inicio:inicio + self.tamano_lote]))
+                .values(estado='prestado', disponible=False)
+            )
+
+    def generar(self):
+        """Inserta el conjunto de datos en una sola transacción y retorna los totales por tabla"""
+        from estadisticas import reconciliar_estadisticas
+        from resumenes import reconstruir_resumenes
+
+        inicio = perf_counter()
+        with db.engine.begin() as conexion:
+            sin_limite_de_tiempo(conexion)
+            self._preparar(conexion)
+            es_sqlite = conexion.dialect.name == 'sqlite'
+            # Mantener los índices secundarios fila a fila cuesta más que reconstruirlos
+            # al final; en SQLite el DDL es transaccional y un fallo los restaura
+            indices = [indice for modelo in (Prestamo, HistorialAcciones, Notificacion)
+                       for indice in modelo.__table__.indexes] if es_sqlite else []
+            if es_sqlite:
+                # Carga masiva: menos sincronizaciones a disco y más caché de páginas
+                conexion.execute(text('PRAGMA synchronous = OFF'))
+                conexion.execute(text('PRAGMA cache_size = -262144'))
+                for indice in indices:
+                    indice.drop(conexion, checkfirst=True)
+
+            admins, solicitantes = self._generar_usuarios(conexion)
+            equipos, fuera_de_servicio = self._generar_equipos(conexion)
+            if solicitantes and equipos:
+                self._generar_prestamos(conexion, admins, solicitantes, equipos, fuera_de_servicio)
+
+            for indice in indices:
+                indice.create(conexion)
+            # Los ids se asignan aquí: en PostgreSQL las secuencias deben continuar desde el máximo
+            sincronizar_secuencias(conexion, [modelo.__table__ for modelo in COLUMNAS])
+            if es_sqlite:
+                conexion.execute(text('ANALYZE'))
+        if es_sqlite:
+            # La conexión de la carga quedó con synchronous = OFF: no debe volver al pool
+            db.engine.dispose()
+
+        # Las inserciones masivas no pasan por los contadores de la sesión
+        reconciliar_estadisticas()
+        reconstruir_resumenes()
+        self.totales['segundos'] = round(perf_counter() - inicio, 2)
+        return self.totales
+
+
+def generar_datos_carga(**opciones):
+    """Atajo para GeneradorDatosCarga(**opciones).generar()"""
+    return GeneradorDatosCarga(**opciones).generar()
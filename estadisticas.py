@@ -0,0 +1,168 @@
+import logging
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect, update
+
+from models import db, Usuario, Equipo, Prestamo, EstadoPrestamo, EstadisticasSistema
+
+logger = logging.getLogger(__name__)
+
+ESTADISTICAS_ID = 1
+
+# Contador de cada estado de préstamo en la tabla de estadísticas
+COLUMNAS_ESTADO_PRESTAMO = {
+    EstadoPrestamo.SOLICITADO: 'prestamos_solicitados',
+    EstadoPrestamo.APROBADO: 'prestamos_aprobados',
+    EstadoPrestamo.RECHAZADO: 'prestamos_rechazados',
+    EstadoPrestamo.DEVUELTO: 'prestamos_devueltos',
+    EstadoPrestamo.VENCIDO: 'prestamos_vencidos',
+}
+
+# Contador de cada estado de equipo en la tabla de estadísticas
+COLUMNAS_ESTADO_EQUIPO = {
+    'prestado': 'equipos_prestados',
+    'mantenimiento': 'equipos_mantenimiento',
+    'dañado': 'equipos_danados',
+}
+
+
+def _contribucion_equipo(estado, disponible):
+    """Contadores a los que aporta un equipo con el estado dado"""
+    estado = estado if estado is not None else 'disponible'
+    disponible = disponible if disponible is not None else True
+
+    contribucion = Counter(total_equipos=1)
+    if disponible and estado == 'disponible':
+        contribucion['equipos_disponibles'] += 1
+    if estado in COLUMNAS_ESTADO_EQUIPO:
+        contribucion[COLUMNAS_ESTADO_EQUIPO[estado]] += 1
+    return contribucion
+
+
+def _contribucion_prestamo(estado):
+    """Contadores a los que aporta un préstamo con el estado dado"""
+    estado = estado if estado is not None else EstadoPrestamo.SOLICITADO
+    return Counter({'total_prestamos': 1, COLUMNAS_ESTADO_PRESTAMO[estado]: 1})
+
+
+def _valores_anteriores(obj, *atributos):
+    """Valores de los atributos antes de los cambios pendientes de la sesión"""
+    estado = inspect(obj)
+    valores = []
+    for atributo in atributos:
+        historial = estado.attrs[atributo].history
+        if historial.deleted:
+            valores.append(historial.deleted[0])
+        elif historial.unchanged:
+            valores.append(historial.unchanged[0])
+        else:
+            valores.append(getattr(obj, atributo))
+    return valores
+
+
+def _contribucion(obj, anterior=False):
+    if isinstance(obj, Equipo):
+        if anterior:
+            return _contribucion_equipo(*_valores_anteriores(obj, 'estado', 'disponible'))
+        return _contribucion_equipo(obj.estado, obj.disponible)
+    if isinstance(obj, Prestamo):
+        if anterior:
+            return _contribucion_prestamo(*_valores_anteriores(obj, 'estado'))
+        return _contribucion_prestamo(obj.estado)
+    if isinstance(obj, Usuario):
+        return Counter(total_usuarios=1)
+    return Counter()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _actualizar_contadores(session, flush_context):
+    """Aplica a la tabla de estadísticas los cambios de estado del flush, en la misma transacción"""
+    deltas = Counter()
+
+    for obj in session.new:
+        deltas.update(_contribucion(obj))
+
+    for obj in session.deleted:
+        deltas.subtract(_contribucion(obj, anterior=True))
+
+    for obj in session.dirty:
+        if isinstance(obj, (Equipo, Prestamo)) and session.is_modified(obj, include_collections=False):
+            deltas.update(_contribucion(obj))
+            deltas.subtract(_contribucion(obj, anterior=True))
+
+    valores = {
+        columna: getattr(EstadisticasSistema, columna) + delta
+        for columna, delta in deltas.items() if delta
+    }
+    if valores:
+        session.connection().execute(
+            update(EstadisticasSistema)
+            .where(EstadisticasSistema.id == ESTADISTICAS_ID)
+            .values(**valores)
+        )
+
+
+def _contar():
+    """Cuenta desde las tablas el valor de cada contador"""
+    contadores = Counter(total_usuarios=db.session.query(func.count(Usuario.id)).scalar())
+
+    equipos = db.session.query(Equipo.estado, Equipo.disponible, func.count(Equipo.id)) \
+        .group_by(Equipo.estado, Equipo.disponible)
+    for estado, disponible, cantidad in equipos:
+        for columna, valor in _contribucion_equipo(estado, disponible).items():
+            contadores[columna] += valor * cantidad
+
+    prestamos = db.session.query(Prestamo.estado, func.count(Prestamo.id)).group_by(Prestamo.estado)
+    for estado, cantidad in prestamos:
+        for columna, valor in _contribucion_prestamo(estado).items():
+            contadores[columna] += valor * cantidad
+    return contadores
+
+
+def _columnas_contadores():
+    return [columna for columna in EstadisticasSistema.__table__.columns.keys()
+            if columna not in ('id', 'fecha_reconciliacion')]
+
+
+def reconciliar_estadisticas():
+    """Recalcula todos los contadores desde cero a partir de las tablas"""
+    contadores = _contar()
+
+    estadisticas = db.session.get(EstadisticasSistema, ESTADISTICAS_ID)
+    if estadisticas is None:
+        estadisticas = EstadisticasSistema(id=ESTADISTICAS_ID)
+        db.session.add(estadisticas)
+
+    for columna in _columnas_contadores():
+        setattr(estadisticas, columna, contadores[columna])
+    estadisticas.fecha_reconciliacion = datetime.utcnow()
+    db.session.commit()
+
+    return estadisticas
+
+
+def asegurar_estadisticas():
+    """Crea la fila de contadores si falta (p. ej. al actualizar una instalación existente).
+
+    Debe existir antes de servir peticiones: los UPDATE de after_flush no
+    modifican nada sin ella.
+    """
+    if db.session.get(EstadisticasSistema, ESTADISTICAS_ID) is None:
+        reconciliar_estadisticas()
+
+
+def obtener_estadisticas():
+    """Retorna los contadores del sistema con una sola lectura por clave primaria.
+
+    No escribe: si falta la fila (la base no pasó por `flask iunp init`), los
+    cuenta desde las tablas y retorna un objeto que no se guarda.
+    """
+    estadisticas = db.session.get(EstadisticasSistema, ESTADISTICAS_ID)
+    if estadisticas is None:
+        logger.warning("Falta la fila de estadisticas_sistema; ejecutar `flask iunp init` o "
+                       "`flask iunp reconciliar-estadisticas`")
+        contadores = _contar()
+        estadisticas = EstadisticasSistema(id=ESTADISTICAS_ID,
+                                           **{columna: contadores[columna] for columna in _columnas_contadores()})
+    return estadisticas
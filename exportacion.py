@@ -0,0 +1,294 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime, time, timedelta
+from enum import Enum
+from xml.sax.saxutils import escape
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from models import db, Usuario, Equipo, Prestamo, EstadisticasSistema
+from estadisticas import obtener_estadisticas
+
+# Filas que se piden al cursor por vez y filas por fragmento de la respuesta
+FILAS_POR_LOTE = 1000
+# Filas leídas en cada transacción de lectura
+FILAS_POR_TRANSACCION = 5000
+
+_Aprobador = aliased(Usuario)
+
+_REPORTES = {
+    'prestamos': (
+        ('ID', 'Fecha de solicitud', 'Estado', 'Cédula', 'Usuario', 'Código del equipo', 'Equipo',
+         'Inicio', 'Fin programado', 'Devolución', 'Aprobado por', 'Motivo'),
+        lambda: select(
+            Prestamo.id, Prestamo.fecha_solicitud, Prestamo.estado, Usuario.cedula,
+            Usuario.nombre + ' ' + Usuario.apellido, Equipo.codigo, Equipo.nombre,
+            Prestamo.fecha_inicio, Prestamo.fecha_fin_programada, Prestamo.fecha_devolucion,
+            _Aprobador.nombre + ' ' + _Aprobador.apellido, Prestamo.motivo
+        ).join(Usuario, Prestamo.usuario_id == Usuario.id)
+         # + 0: sin él SQLite recorre equipos y busca sus préstamos por equipo_id, en lugar de leer
+         # los préstamos por tramos de id
+         .join(Equipo, Prestamo.equipo_id + 0 == Equipo.id)
+         .outerjoin(_Aprobador, Prestamo.aprobado_por_id == _Aprobador.id),
+        Prestamo.id, Prestamo.fecha_solicitud
+    ),
+    'equipos': (
+        ('ID', 'Código', 'Nombre', 'Categoría', 'Marca', 'Modelo', 'Número de serie', 'Estado',
+         'Fecha de adquisición', 'Fecha de registro'),
+        lambda: select(
+            Equipo.id, Equipo.codigo, Equipo.nombre, Equipo.categoria, Equipo.marca, Equipo.modelo,
+            Equipo.numero_serie, Equipo.estado, Equipo.fecha_adquisicion, Equipo.fecha_registro
+        ),
+        Equipo.id, Equipo.fecha_registro
+    ),
+    'usuarios': (
+        ('ID', 'Cédula', 'Nombre', 'Apellido', 'Email', 'Teléfono', 'Tipo', 'Activo', 'Fecha de registro'),
+        lambda: select(
+            Usuario.id, Usuario.cedula, Usuario.nombre, Usuario.apellido, Usuario.email, Usuario.telefono,
+            Usuario.tipo_usuario, Usuario.activo, Usuario.fecha_registro
+        ),
+        Usuario.id, Usuario.fecha_registro
+    ),
+}
+
+TITULOS = {
+    'prestamos': 'Préstamos',
+    'equipos': 'Equipos',
+    'usuarios': 'Usuarios',
+    'estadisticas': 'Estadísticas',
+}
+
+
+def _rango(columna, fecha_desde, fecha_hasta):
+    """Condiciones del filtro de fechas; `fecha_hasta` incluye el día completo"""
+    condiciones = []
+    if fecha_desde:
+        condiciones.append(columna >= datetime.combine(fecha_desde, time.min))
+    if fecha_hasta:
+        condiciones.append(columna < datetime.combine(fecha_hasta + timedelta(days=1), time.min))
+    return condiciones
+
+
+def _filas_estadisticas(fecha_desde, fecha_hasta):
+    if not fecha_desde and not fecha_hasta:
+        estadisticas = obtener_estadisticas()
+        for columna in EstadisticasSistema.__table__.columns.keys():
+            if columna not in ('id', 'fecha_reconciliacion'):
+                yield (columna.replace('_', ' ').capitalize(), getattr(estadisticas, columna))
+        return
+
+    # Con rango de fechas los contadores globales no sirven: se agregan los préstamos del período
+    consulta = select(Prestamo.estado, func.count(Prestamo.id)) \
+        .where(*_rango(Prestamo.fecha_solicitud, fecha_desde, fecha_hasta)) \
+        .group_by(Prestamo.estado)
+    total = 0
+    for estado, cantidad in db.session.execute(consulta):
+        total += cantidad
+        yield (f'Préstamos {estado.value}s', cantidad)
+    yield ('Total préstamos', total)
+
+
+def _filas(consulta, columna_id):
+    """Lee la consulta por tramos de clave primaria, cada uno en su propia transacción.
+
+    Dentro de cada tramo las filas llegan del cursor con yield_per (cursor de
+    servidor en PostgreSQL), así que nunca se cargan todas a la vez. Cerrar la
+    transacción entre tramos evita que una exportación larga retenga el lock
+    de lectura de SQLite e impida escribir al resto de la aplicación.
+    """
+    ultimo_id = None
+    while True:
+        tramo = consulta.order_by(columna_id).limit(FILAS_POR_TRANSACCION)
+        if ultimo_id is not None:
+            tramo = tramo.where(columna_id > ultimo_id)
+        leidas = 0
+        for fila in db.session.execute(tramo.execution_options(yield_per=FILAS_POR_LOTE)):
+            leidas += 1
+            ultimo_id = fila[0]
+            yield tuple(fila)
+        db.session.rollback()
+        if leidas < FILAS_POR_TRANSACCION:
+            return
+
+
+def reporte(tipo, fecha_desde=None, fecha_hasta=None):
+    """Retorna (encabezados, filas) del reporte; las filas se leen a medida que se consumen"""
+    if tipo == 'estadisticas':
+        return ('Indicador', 'Valor'), _filas_estadisticas(fecha_desde, fecha_hasta)
+
+    encabezados, construir, columna_id, columna_fecha = _REPORTES[tipo]
+    consulta = construir().where(*_rango(columna_fecha, fecha_desde, fecha_hasta))
+    return encabezados, _filas(consulta, columna_id)
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, Enum):
+        return valor.value
+    if isinstance(valor, bool):
+        return 'Sí' if valor else 'No'
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor)
+
+
+def generar_csv(encabezados, filas):
+    """Genera el CSV por fragmentos; la memoria usada no depende del total de filas"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM para que Excel reconozca UTF-8 (acentos y ñ)
+    buffer.write('\ufeff')
+    escritor.writerow(encabezados)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow([_texto(valor) for valor in fila])
+        pendientes += 1
+        if pendientes >= FILAS_POR_LOTE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _SalidaFragmentos(io.RawIOBase):
+    """Destino de zipfile que acumula los bytes escritos hasta que el generador los entrega"""
+
+    def __init__(self):
+        self._fragmentos = []
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._fragmentos.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        # zipfile necesita la posición para el directorio central, aunque no pueda hacer seek
+        return self._posicion
+
+    def vaciar(self):
+        datos = b''.join(self._fragmentos)
+        self._fragmentos = []
+        return datos
+
+
+_CARACTERES_INVALIDOS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+# Estilo 1: fecha y hora; estilo 2: fecha; estilo 3: encabezado en negrita
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+
+
+def _celda(valor, estilo_texto=''):
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, bool):
+        return f'<c t="inlineStr"{estilo_texto}><is><t>{"Sí" if valor else "No"}</t></is></c>'
+    if isinstance(valor, (int, float)):
+        return f'<c><v>{valor}</v></c>'
+    if isinstance(valor, datetime):
+        return f'<c s="1"><v>{(valor - _EPOCA_EXCEL).total_seconds() / 86400:.6f}</v></c>'
+    if isinstance(valor, date):
+        return f'<c s="2"><v>{(valor - _EPOCA_EXCEL.date()).days}</v></c>'
+    texto = escape(_CARACTERES_INVALIDOS_XML.sub('', _texto(valor)))
+    return f'<c t="inlineStr"{estilo_texto}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def generar_xlsx(encabezados, filas, nombre_hoja='Reporte'):
+    """Genera un libro XLSX de una hoja por fragmentos.
+
+    El libro se escribe a mano (cadenas en línea, sin tabla de cadenas
+    compartidas) en un zip que se entrega a medida que se comprime, así que
+    no hace falta tener el archivo completo en memoria ni en disco.
+    """
+    salida = _SalidaFragmentos()
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_DEFLATED) as libro:
+        libro.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        libro.writestr('_rels/.rels', _RELS)
+        libro.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        libro.writestr('xl/styles.xml', _STYLES)
+        libro.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(nombre_hoja[:31])}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+        ))
+        yield salida.vaciar()
+
+        with libro.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja:
+            hoja.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                '<row>' + ''.join(_celda(titulo, ' s="3"') for titulo in encabezados) + '</row>'
+            ).encode('utf-8'))
+            lote = []
+            for fila in filas:
+                lote.append('<row>' + ''.join(_celda(valor) for valor in fila) + '</row>')
+                if len(lote) >= FILAS_POR_LOTE:
+                    hoja.write(''.join(lote).encode('utf-8'))
+                    lote = []
+                    yield salida.vaciar()
+            hoja.write((''.join(lote) + '</sheetData></worksheet>').encode('utf-8'))
+    yield salida.vaciar()
+
+
+FORMATOS = {
+    'csv': ('text/csv', 'csv', generar_csv),
+    'excel': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx', generar_xlsx),
+}
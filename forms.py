@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField, SelectField, DateTimeField, BooleanField, DateField, SubmitField
+from wtforms import StringField, PasswordField, TextAreaField, SelectField, DateTimeField, BooleanField, DateField, SubmitField, IntegerField
 from wtforms.validators import DataRequired, Email, Length, ValidationError, EqualTo, Optional
-from wtforms.widgets import TextArea
+from wtforms.widgets import TextArea, HiddenInput
 from datetime import datetime, timedelta
 from models import Usuario, Equipo, TipoUsuario, CategoriaEquipo, EstadoPrestamo
 
@@ -74,7 +74,9 @@ class EquipoForm(FlaskForm):
 
 
 class PrestamoForm(FlaskForm):
-    equipo_id = SelectField('Equipo', coerce=int, validators=[DataRequired()])
+    # Lo completa el buscador de equipos (/api/equipos/buscar); solo se valida el id enviado
+    equipo_id = IntegerField('Equipo', validators=[DataRequired(message='Selecciona un equipo.')],
+                             widget=HiddenInput())
     fecha_inicio = DateTimeField('Fecha y Hora de Inicio', 
                                 validators=[DataRequired()], 
                                 format='%Y-%m-%d %H:%M')
@@ -90,13 +92,14 @@ class PrestamoForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(PrestamoForm, self).__init__(*args, **kwargs)
-        # Cargar solo equipos disponibles
-        self.equipo_id.choices = [
-            (equipo.id, f"{equipo.codigo} - {equipo.nombre}")
-            for equipo in Equipo.query.filter_by(disponible=True, estado='disponible').all()
-        ]
-        if not self.equipo_id.choices:
-            self.equipo_id.choices = [(0, 'No hay equipos disponibles')]
+        self.equipo = None
+
+    def validate_equipo_id(self, equipo_id):
+        # El choque de fechas se valida al solicitar, contra el índice de reservas
+        equipo = Equipo.query.get(equipo_id.data)
+        if not equipo or not equipo.admite_reservas():
+            raise ValidationError('El equipo seleccionado no está disponible.')
+        self.equipo = equipo
 
     def validate_fecha_inicio(self, fecha_inicio):
         if fecha_inicio.data <= datetime.now():
@@ -227,10 +230,13 @@ class ReporteForm(FlaskForm):
     fecha_desde = DateField('Desde', validators=[Optional()])
     fecha_hasta = DateField('Hasta', validators=[Optional()])
     formato = SelectField('Formato', choices=[
-        ('html', 'Ver en Pantalla'),
-        ('pdf', 'Descargar PDF'),
-        ('excel', 'Descargar Excel')
-    ], default='html')
+        ('excel', 'Descargar Excel'),
+        ('csv', 'Descargar CSV')
+    ], default='excel')
+
+    def validate_fecha_hasta(self, fecha_hasta):
+        if fecha_hasta.data and self.fecha_desde.data and fecha_hasta.data < self.fecha_desde.data:
+            raise ValidationError('La fecha final debe ser posterior a la inicial.')
     
     submit = SubmitField('Generar Reporte')
 
@@ -0,0 +1,45 @@
+# Configuración de gunicorn para producción: `gunicorn` la lee desde el directorio actual.
+# Los valores se pueden ajustar por variables de entorno sin editar el archivo.
+import os
+
+wsgi_app = 'app:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Procesos: 2 por CPU + 1 es el punto de partida habitual; medir con benchmark_workers.py
+workers = int(os.environ.get('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+# gthread: cada flujo SSE de notificaciones ocupa un hilo, no un worker completo.
+# No conviene superar el pool de conexiones (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Los flujos SSE pueden ocupar hasta la mitad de los hilos; el resto queda para las páginas
+os.environ.setdefault('NOTIFICACIONES_STREAM_MAX', str(max(1, threads // 2)))
+
+# Cada worker tiene su propio pool de hashing: entre todos no deben superar las CPU
+os.environ.setdefault('HASH_PROCESOS', str(max(1, (os.cpu_count() or 1) // workers)))
+
+# Reciclar workers acota el crecimiento de memoria; el jitter evita que reinicien todos a la vez
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# La aplicación se importa y precalienta una vez en el maestro y los workers la heredan por fork
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def when_ready(server):
+    # Se ejecuta en el maestro antes de crear los workers
+    if server.cfg.preload_app:
+        from precarga import precalentar
+        resultado = precalentar(server.app.wsgi())
+        server.log.info("Precarga: %(plantillas)s plantillas, índices en memoria: %(indices)s, %(segundos)ss",
+                        resultado)
+
+
+def post_fork(server, worker):
+    # Sin preload el worker importa la aplicación por su cuenta y no hereda nada
+    if server.cfg.preload_app:
+        from precarga import reiniciar_worker
+        reiniciar_worker(server.app.wsgi())
@@ -0,0 +1,144 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class HashNoDisponible(Exception):
+    """El servicio de hashing está saturado o no respondió a tiempo"""
+
+
+class ServicioHash:
+    """Calcula y verifica hashes de contraseñas en un pool de procesos acotado.
+
+    El KDF de werkzeug es deliberadamente costoso y retiene el GIL mientras
+    corre; en procesos aparte, un pico de inicios de sesión no detiene al resto
+    de las rutas del worker. Como mucho `cola_maxima` operaciones esperan o
+    corren a la vez: las que exceden ese límite, o tardan más que `timeout`
+    segundos, fallan con `HashNoDisponible` en lugar de acumularse. Con
+    `procesos=0` el hashing se hace en línea, como antes.
+
+    Como en todo pool de multiprocessing, los procesos importan el módulo
+    principal: los scripts que lo usen deben proteger su arranque con
+    `if __name__ == '__main__'`.
+    """
+
+    def __init__(self, procesos=None, cola_maxima=None, timeout=5):
+        self.procesos = procesos if procesos is not None else min(os.cpu_count() or 1, 4)
+        self.cola_maxima = cola_maxima
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._cupos = None
+        self._lock = threading.Lock()
+        self.rechazadas = 0
+        self.vencidas = 0
+
+    def init_app(self, app):
+        self.configurar(
+            procesos=app.config.get('HASH_PROCESOS', self.procesos),
+            cola_maxima=app.config.get('HASH_COLA_MAXIMA', self.cola_maxima),
+            timeout=app.config.get('HASH_TIMEOUT', self.timeout)
+        )
+
+    def configurar(self, procesos=None, cola_maxima=None, timeout=None):
+        """Cambia el tamaño del pool; el pool anterior se cierra y el nuevo se crea al primer uso"""
+        with self._lock:
+            if procesos is not None:
+                self.procesos = procesos
+            if cola_maxima is not None:
+                self.cola_maxima = cola_maxima
+            if timeout is not None:
+                self.timeout = timeout
+            self._cerrar_pool()
+            limite = self.cola_maxima or max(self.procesos, 1) * 4
+            self._cupos = threading.BoundedSemaphore(limite)
+
+    def _cerrar_pool(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def _obtener_pool(self):
+        # Un pool heredado por fork pertenece al proceso padre: cada worker crea el suyo
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    # forkserver evita forkear un proceso que ya tiene hilos corriendo
+                    metodos = multiprocessing.get_all_start_methods()
+                    contexto = multiprocessing.get_context('forkserver' if 'forkserver' in metodos else 'spawn')
+                    if contexto.get_start_method() == 'forkserver':
+                        contexto.set_forkserver_preload(['werkzeug.security'])
+                    self._pool = ProcessPoolExecutor(max_workers=self.procesos, mp_context=contexto)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _pool_roto(self):
+        """Descarta el pool roto para que el próximo uso cree otro y falla con HashNoDisponible"""
+        logger.exception("El pool de hashing se cerró inesperadamente; se recreará")
+        with self._lock:
+            self._pool = None
+        raise HashNoDisponible('El pool de hashing no está disponible')
+
+    def _ejecutar(self, funcion, *argumentos):
+        if self._cupos is None:
+            self.configurar()
+        if not self.procesos:
+            return funcion(*argumentos)
+
+        # El semáforo puede reemplazarse en configurar(); el cupo se devuelve al mismo que lo dio
+        cupos = self._cupos
+        if not cupos.acquire(blocking=False):
+            self.rechazadas += 1
+            raise HashNoDisponible('Demasiadas operaciones de contraseña en espera')
+        try:
+            futuro = self._obtener_pool().submit(funcion, *argumentos)
+        except BrokenProcessPool:
+            cupos.release()
+            self._pool_roto()
+        except BaseException:
+            cupos.release()
+            raise
+        # Tras un timeout el proceso sigue calculando: el cupo se libera cuando el cálculo termina de verdad
+        futuro.add_done_callback(lambda _futuro: cupos.release())
+
+        try:
+            return futuro.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            futuro.cancel()
+            self.vencidas += 1
+            raise HashNoDisponible('La operación de contraseña excedió el tiempo de espera')
+        except BrokenProcessPool:
+            self._pool_roto()
+
+    def generar(self, password):
+        """Retorna el hash de la contraseña (equivalente a generate_password_hash)"""
+        return self._ejecutar(generate_password_hash, password)
+
+    def verificar(self, password_hash, password):
+        """Verifica la contraseña contra su hash (equivalente a check_password_hash)"""
+        return self._ejecutar(check_password_hash, password_hash, password)
+
+    def metricas(self):
+        """Retorna la configuración y los rechazos acumulados en este proceso"""
+        return {
+            'procesos': self.procesos,
+            'cola_maxima': self.cola_maxima or max(self.procesos, 1) * 4,
+            'timeout_segundos': self.timeout,
+            'rechazadas': self.rechazadas,
+            'vencidas': self.vencidas
+        }
+
+    def cerrar(self):
+        """Detiene los procesos del pool"""
+        with self._lock:
+            self._cerrar_pool()
+
+
+servicio_hash = ServicioHash()
@@ -0,0 +1,288 @@
+import html
+import re
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from flask import url_for
+from sqlalchemy import event, func, select, text, update
+
+from models import (db, Usuario, Equipo, Prestamo, Notificacion, TokenAcceso, OutboxNotificacion,
+                    EstadoPrestamo, TipoUsuario)
+
+
+def aplicar_indices():
+    """Crea en una base de datos existente los índices declarados en los modelos que falten.
+
+    db.create_all() solo crea los índices de las tablas nuevas, por lo que las
+    bases de datos anteriores (por ejemplo sistema_prestamos.db) necesitan esta
+    migración. Retorna los nombres de los índices creados.
+    """
+    creados = []
+    with db.engine.begin() as conexion:
+        for tabla in db.metadata.sorted_tables:
+            for indice in sorted(tabla.indexes, key=lambda i: i.name):
+                if not db.inspect(conexion).has_index(tabla.name, indice.name):
+                    indice.create(conexion)
+                    creados.append(indice.name)
+        if creados:
+            # Actualizar las estadísticas del planificador con los índices nuevos
+            conexion.execute(text('ANALYZE'))
+    return creados
+
+
+# Visitas con un SCAN deliberado y su motivo: se informan, pero no hacen fallar la verificación.
+# La clave es (vista, parámetros de la visita, tabla); '' es la visita sin parámetros
+_PRIMERA_PAGINA = 'primera página sin filtros: lee el índice de orden solo hasta el LIMIT'
+RECORRIDOS_ADMITIDOS = {
+    ('listar_equipos', '', 'equipos'): _PRIMERA_PAGINA,
+    ('admin_usuarios', '', 'usuarios'): _PRIMERA_PAGINA,
+    ('admin_equipos', '', 'equipos'): _PRIMERA_PAGINA,
+    ('admin_prestamos', '', 'prestamos'): _PRIMERA_PAGINA,
+    ('listar_tokens', '', 'tokens_acceso'): _PRIMERA_PAGINA,
+    ('listar_prestamos', '', 'equipos'): 'el catálogo muestra todos los equipos; la página renderizada se cachea',
+    ('admin_usuarios', 'buscar=na', 'usuarios'):
+        'texto de menos de tres caracteres: el índice de trigramas no lo cubre y se busca con ILIKE',
+    ('admin_outbox', '', 'outbox_notificaciones'):
+        'conteo por estado sobre el índice cubriente; las entradas enviadas se purgan tras OUTBOX_RETENCION_DIAS',
+}
+
+# Vistas que no se visitan: cierran la sesión, escriben datos o sirven archivos
+VISTAS_EXCLUIDAS = {'logout', 'generar_token_admin', 'static', 'activo'}
+
+
+def _variantes_rutas():
+    """Parámetros con que se visita cada vista, además de la visita sin parámetros"""
+    hoy = datetime.utcnow().date()
+    fechas = {'fecha_desde': (hoy - timedelta(days=30)).isoformat(), 'fecha_hasta': hoy.isoformat()}
+    return {
+        'listar_equipos': [{'busqueda': 'laptop'}, {'categoria': 'proyector'}, {'estado': 'disponible'},
+                           {'page': '2'}],
+        'listar_prestamos': [{'busqueda': 'laptop'}, {'categoria': 'proyector'}, {'estado': 'disponible'}],
+        'admin_usuarios': [{'buscar': 'ana'}, {'buscar': 'na'}, {'tipo': 'estudiante'}, {'estado': 'inactivo'},
+                           {'buscar': 'ana', 'total': 'exacto'}],
+        'admin_equipos': [{'buscar': 'laptop'}, {'categoria': 'computadora'}, {'estado': 'mantenimiento'},
+                          {'disponible': 'true'}],
+        'admin_prestamos': [{'buscar': 'laptop'}, {'estado': 'solicitado'}, {'usuario': 'ana'}, fechas,
+                            {'estado': 'aprobado', 'total': 'exacto'}],
+        'datos_reportes': [{'desde': fechas['fecha_desde'], 'hasta': fechas['fecha_hasta']}],
+        # Sin fechas el reporte recorre toda la historia: se exporta el último mes
+        'exportar_reporte': [{'tipo_reporte': tipo, 'formato': 'csv', **fechas}
+                             for tipo in ('equipos', 'prestamos', 'usuarios', 'estadisticas')],
+        'buscar_equipos_selector': [{'q': 'lap'}, {'q': 'laptop dell'}],
+    }
+
+
+# Cabeceras con que se repite la visita de una vista
+CABECERAS_RUTAS = {
+    'stream_notificaciones': [{'Last-Event-ID': '0'}],
+}
+
+_ENLACE_CURSOR = re.compile(r'href="([^"]*[?&](?:amp;)?cursor=[^"]*)"')
+
+
+def _argumentos_rutas(usuario):
+    """Un valor existente para cada argumento de las reglas de URL"""
+    def ultimo(columna):
+        return db.session.query(func.max(columna)).scalar() or 1
+
+    return {
+        'equipo_id': ultimo(Equipo.id),
+        'prestamo_id': ultimo(Prestamo.id),
+        'usuario_id': usuario.id if usuario else 1,
+        'notificacion_id': ultimo(Notificacion.id),
+        'token_id': ultimo(TokenAcceso.id),
+        # Un token que no existe: el UPDATE condicional no marca nada
+        'token': 'x' * 32,
+    }
+
+
+def _visitantes():
+    """Perfiles con que se recorren las rutas: anónimo, un usuario con préstamos y un administrador"""
+    usuario_id = db.session.execute(
+        select(Prestamo.usuario_id).join(Usuario, Usuario.id == Prestamo.usuario_id)
+        .where(Usuario.tipo_usuario != TipoUsuario.ADMIN, Usuario.activo.is_(True))
+        .order_by(Prestamo.id.desc()).limit(1)
+    ).scalar()
+    usuario = db.session.get(Usuario, usuario_id) if usuario_id else None
+    administrador = Usuario.query.filter_by(tipo_usuario=TipoUsuario.ADMIN, activo=True).order_by(Usuario.id).first()
+    return [('anónimo', None), ('usuario', usuario), ('administrador', administrador)], usuario
+
+
+def capturar_consultas_rutas(app):
+    """Recorre las rutas con el cliente de pruebas y retorna las sentencias que ejecutan.
+
+    Visita cada regla GET (sin y con los filtros de `_variantes_rutas()`, y la
+    página siguiente de los listados por cursor) como anónimo, usuario y
+    administrador, y envía el formulario de inicio de sesión con una contraseña
+    incorrecta. Las sentencias se registran con `before_cursor_execute` tal como
+    las genera la ruta, con sus joinedload y with_expression. Retorna
+    ({sql: visita}, visitas con error); cada visita es un dict con la etiqueta,
+    la vista, sus parámetros y los de la primera ejecución de la sentencia.
+    """
+    sentencias = {}
+    errores = []
+    hilo = threading.get_ident()
+    visita_actual = {}
+
+    def _registrar(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() != hilo or executemany or not visita_actual:
+            return
+        if statement.lstrip().split(None, 1)[0].upper() not in ('SELECT', 'WITH', 'UPDATE', 'DELETE'):
+            return
+        sentencias.setdefault(statement, {**visita_actual, 'parametros': parameters})
+
+    def _visitar(cliente, etiqueta, vista, variante, url, metodo='GET', **opciones):
+        visita_actual.update(etiqueta=etiqueta, vista=vista, variante=variante)
+        # Contexto propio, como en el servidor: si no, la petición hereda el `g` (y el usuario
+        # de Flask-Login) y la sesión de base de datos del contexto del comando
+        with app.app_context():
+            respuesta = cliente.open(url, method=metodo, **opciones)
+            try:
+                if respuesta.status_code >= 500:
+                    errores.append((etiqueta, respuesta.status_code))
+                # Un flujo SSE no termina: sus consultas iniciales ya corrieron en la vista
+                if respuesta.mimetype == 'text/event-stream':
+                    return ''
+                return respuesta.get_data(as_text=True)
+            finally:
+                respuesta.close()
+                visita_actual.clear()
+
+    visitantes, usuario = _visitantes()
+    argumentos = _argumentos_rutas(usuario)
+    variantes = _variantes_rutas()
+    reglas = [regla for regla in app.url_map.iter_rules()
+              if 'GET' in regla.methods and regla.endpoint not in VISTAS_EXCLUIDAS
+              and all(nombre in argumentos for nombre in regla.arguments)]
+
+    csrf = app.config.get('WTF_CSRF_ENABLED', True)
+    app.config['WTF_CSRF_ENABLED'] = False
+    event.listen(db.engine, 'before_cursor_execute', _registrar)
+    try:
+        for perfil, visitante in visitantes:
+            if perfil != 'anónimo' and visitante is None:
+                continue
+            cliente = app.test_client()
+            if visitante is None:
+                administrador = visitantes[-1][1]
+                _visitar(cliente, 'anónimo POST /login', 'login', '', '/login', metodo='POST',
+                         data={'cedula': administrador.cedula if administrador else 'admin', 'password': 'x'})
+            else:
+                with cliente.session_transaction() as sesion:
+                    sesion['_user_id'] = str(visitante.id)
+                    sesion['_fresh'] = True
+
+            for regla in reglas:
+                valores = {nombre: argumentos[nombre] for nombre in regla.arguments}
+                with app.test_request_context():
+                    urls = [url_for(regla.endpoint, **valores)]
+                    urls += [url_for(regla.endpoint, **valores, **parametros)
+                             for parametros in variantes.get(regla.endpoint, [])]
+                # (url, cabeceras, variante): la variante identifica la visita en RECORRIDOS_ADMITIDOS
+                visitas = [(url, None, urlsplit(url).query) for url in urls]
+                visitas += [(urls[0], cabeceras, ', '.join(f'{clave}: {valor}' for clave, valor in cabeceras.items()))
+                            for cabeceras in CABECERAS_RUTAS.get(regla.endpoint, [])]
+                for url, cabeceras, variante in visitas:
+                    etiqueta = f"{perfil} GET {url}" + (f" [{variante}]" if cabeceras else '')
+                    cuerpo = _visitar(cliente, etiqueta, regla.endpoint, variante, url, headers=cabeceras)
+                    enlace = _ENLACE_CURSOR.search(cuerpo)
+                    if enlace:
+                        _visitar(cliente, f"{etiqueta} (página siguiente)", regla.endpoint, variante,
+                                 html.unescape(enlace.group(1)))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _registrar)
+        app.config['WTF_CSRF_ENABLED'] = csrf
+    return sentencias, errores
+
+
+def _consultas_tareas():
+    """Consultas de las tareas en segundo plano, que no corren en una ruta; escriben, así que no se ejecutan"""
+    ahora = datetime.utcnow()
+    return {
+        'barredor: vencimientos': update(Prestamo).where(
+            Prestamo.estado == EstadoPrestamo.APROBADO, Prestamo.fecha_fin_programada < ahora
+        ).values(estado=Prestamo.estado),
+        'barredor: préstamos a vencer': select(Prestamo).where(
+            Prestamo.estado == EstadoPrestamo.APROBADO, Prestamo.fecha_fin_programada < ahora),
+        'barredor: próximo vencimiento': select(func.min(Prestamo.fecha_fin_programada)).where(
+            Prestamo.estado == EstadoPrestamo.APROBADO),
+        'barredor: equipos con préstamo iniciado': select(Prestamo.equipo_id)
+            .join(Equipo, Equipo.id == Prestamo.equipo_id)
+            .where(Prestamo.estado == EstadoPrestamo.APROBADO, Prestamo.fecha_inicio <= ahora,
+                   Equipo.estado == 'disponible').distinct(),
+        'outbox: pendientes': select(OutboxNotificacion.id).where(
+            OutboxNotificacion.estado == 'pendiente', OutboxNotificacion.proximo_intento <= ahora
+        ).order_by(OutboxNotificacion.id).limit(100),
+        'outbox: destinatarios por tipo': select(Usuario.id).where(
+            Usuario.tipo_usuario == TipoUsuario.ADMIN, Usuario.activo.is_(True)),
+        'outbox: purga': select(OutboxNotificacion.id).where(
+            OutboxNotificacion.estado == 'enviado', OutboxNotificacion.fecha_envio < ahora).limit(1000),
+        'purga de tokens': select(TokenAcceso.id).where(TokenAcceso.expira_en < ahora).limit(1000),
+    }
+
+
+def _plan(conexion, consulta):
+    """Ejecuta EXPLAIN QUERY PLAN de la consulta con sus parámetros ya procesados"""
+    def _explicar(conn, cursor, statement, parameters, context, executemany):
+        return 'EXPLAIN QUERY PLAN ' + statement, parameters
+
+    event.listen(conexion, 'before_cursor_execute', _explicar, retval=True)
+    try:
+        resultado = conexion.execute(consulta)
+        return [fila[3] for fila in resultado.cursor.fetchall()]
+    finally:
+        event.remove(conexion, 'before_cursor_execute', _explicar)
+
+
+def _es_recorrido_completo(detalle, tablas):
+    """Un 'SCAN tabla' recorre la tabla completa, aunque lo haga por un índice o un índice cubriente.
+
+    Solo SEARCH acota las filas con una condición; recorrer un índice entero
+    cuesta lo mismo que la tabla cuando el filtro no está en su prefijo. Una
+    tabla virtual FTS5 sin expresión MATCH también se recorre completa.
+    """
+    coincidencia = re.match(r'SCAN (?:TABLE )?(\w+)', detalle)
+    if not coincidencia:
+        return False
+    if coincidencia.group(1) in tablas:
+        return True
+    return bool(re.search(r'VIRTUAL TABLE INDEX \d+:$', detalle))
+
+
+def _tabla_recorrida(detalle):
+    return re.match(r'SCAN (?:TABLE )?(\w+)', detalle).group(1)
+
+
+def explicar_consultas(app):
+    """Retorna el plan de cada sentencia que emiten las rutas y las tareas, con sus recorridos completos.
+
+    Cada resultado lleva la visita que la emitió, el SQL, el plan, los
+    recorridos completos y el motivo si están admitidos; una visita que
+    respondió con un error 5xx se informa con 'error' y sin plan.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError("EXPLAIN QUERY PLAN solo está disponible con SQLite")
+
+    sentencias, errores = capturar_consultas_rutas(app)
+    tablas = set(db.metadata.tables)
+    resultados = [{'consulta': etiqueta, 'sql': None, 'plan': [], 'recorridos_completos': [], 'admitido': None,
+                   'error': estado} for etiqueta, estado in errores]
+    with db.engine.connect() as conexion:
+        for sql, visita in sentencias.items():
+            plan = [fila[3] for fila in conexion.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, visita['parametros'])]
+            recorridos = [detalle for detalle in plan if _es_recorrido_completo(detalle, tablas)]
+            admitido = None
+            if recorridos:
+                motivos = {RECORRIDOS_ADMITIDOS.get((visita['vista'], visita['variante'], _tabla_recorrida(detalle)))
+                           for detalle in recorridos}
+                if None not in motivos:
+                    admitido = '; '.join(sorted(motivos))
+            resultados.append({'consulta': visita['etiqueta'], 'sql': sql, 'plan': plan,
+                               'recorridos_completos': recorridos, 'admitido': admitido, 'error': None})
+        for nombre, consulta in _consultas_tareas().items():
+            plan = _plan(conexion, consulta)
+            recorridos = [detalle for detalle in plan if _es_recorrido_completo(detalle, tablas)]
+            resultados.append({'consulta': f'tarea: {nombre}', 'sql': None, 'plan': plan,
+                               'recorridos_completos': recorridos, 'admitido': None, 'error': None})
+    return resultados
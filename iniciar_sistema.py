@@ -110,6 +110,9 @@ def main():
     try:
         # Iniciar el servidor Flask
         from app import app
+        from comandos import inicializar_base_datos
+        with app.app_context():
+            inicializar_base_datos()
         app.run(debug=True, host='0.0.0.0', port=5000)
     except ImportError as e:
         print(f"❌ Error importando módulos: {e}")
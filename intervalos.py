@@ -0,0 +1,385 @@
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, event, inspect, or_, select
+
+from models import db, Equipo, Prestamo, EstadoPrestamo, ESTADOS_EQUIPO_RESERVABLES
+from invalidacion import generaciones
+
+ESPACIO_RESERVAS = 'reservas'
+
+# Estados en los que un préstamo ocupa su ventana del equipo
+ESTADOS_QUE_RESERVAN = (EstadoPrestamo.SOLICITADO, EstadoPrestamo.APROBADO, EstadoPrestamo.VENCIDO)
+
+# Un préstamo vencido ocupa el equipo hasta que se devuelva, sin fecha conocida
+SIN_FIN = datetime.max
+
+Reserva = namedtuple('Reserva', ['prestamo_id', 'inicio', 'fin', 'estado'])
+
+
+def _fin_reserva(prestamo):
+    return SIN_FIN if prestamo.estado == EstadoPrestamo.VENCIDO else prestamo.fecha_fin_programada
+
+
+class _Nodo:
+    __slots__ = ('reserva', 'clave', 'max_fin', 'altura', 'izq', 'der')
+
+    def __init__(self, reserva):
+        self.reserva = reserva
+        self.clave = (reserva.inicio, reserva.prestamo_id)
+        self.max_fin = reserva.fin
+        self.altura = 1
+        self.izq = None
+        self.der = None
+
+
+def _altura(nodo):
+    return nodo.altura if nodo else 0
+
+
+def _actualizar(nodo):
+    nodo.altura = 1 + max(_altura(nodo.izq), _altura(nodo.der))
+    nodo.max_fin = nodo.reserva.fin
+    if nodo.izq and nodo.izq.max_fin > nodo.max_fin:
+        nodo.max_fin = nodo.izq.max_fin
+    if nodo.der and nodo.der.max_fin > nodo.max_fin:
+        nodo.max_fin = nodo.der.max_fin
+
+
+def _rotar_derecha(nodo):
+    raiz = nodo.izq
+    nodo.izq = raiz.der
+    raiz.der = nodo
+    _actualizar(nodo)
+    _actualizar(raiz)
+    return raiz
+
+
+def _rotar_izquierda(nodo):
+    raiz = nodo.der
+    nodo.der = raiz.izq
+    raiz.izq = nodo
+    _actualizar(nodo)
+    _actualizar(raiz)
+    return raiz
+
+
+def _balancear(nodo):
+    _actualizar(nodo)
+    balance = _altura(nodo.izq) - _altura(nodo.der)
+    if balance > 1:
+        if _altura(nodo.izq.izq) < _altura(nodo.izq.der):
+            nodo.izq = _rotar_izquierda(nodo.izq)
+        return _rotar_derecha(nodo)
+    if balance < -1:
+        if _altura(nodo.der.der) < _altura(nodo.der.izq):
+            nodo.der = _rotar_derecha(nodo.der)
+        return _rotar_izquierda(nodo)
+    return nodo
+
+
+def _insertar(nodo, nuevo):
+    if nodo is None:
+        return nuevo
+    if nuevo.clave < nodo.clave:
+        nodo.izq = _insertar(nodo.izq, nuevo)
+    else:
+        nodo.der = _insertar(nodo.der, nuevo)
+    return _balancear(nodo)
+
+
+def _extraer_minimo(nodo):
+    """Retorna (subárbol sin su mínimo, nodo mínimo)"""
+    if nodo.izq is None:
+        return nodo.der, nodo
+    nodo.izq, minimo = _extraer_minimo(nodo.izq)
+    return _balancear(nodo), minimo
+
+
+def _eliminar(nodo, clave):
+    if nodo is None:
+        return None
+    if clave < nodo.clave:
+        nodo.izq = _eliminar(nodo.izq, clave)
+    elif clave > nodo.clave:
+        nodo.der = _eliminar(nodo.der, clave)
+    else:
+        if nodo.izq is None:
+            return nodo.der
+        if nodo.der is None:
+            return nodo.izq
+        nodo.der, sucesor = _extraer_minimo(nodo.der)
+        sucesor.izq, sucesor.der = nodo.izq, nodo.der
+        nodo = sucesor
+    return _balancear(nodo)
+
+
+class ArbolIntervalos:
+    """Árbol AVL de intervalos semiabiertos [inicio, fin) aumentado con el fin máximo de cada subárbol.
+
+    Ordenado por (inicio, prestamo_id); el fin máximo permite descartar
+    subárboles completos, así que saber si una ventana está libre cuesta
+    O(log n) y listar sus k conflictos O(log n + k).
+    """
+
+    def __init__(self):
+        self._raiz = None
+        self._cantidad = 0
+
+    def __len__(self):
+        return self._cantidad
+
+    def insertar(self, reserva):
+        self._raiz = _insertar(self._raiz, _Nodo(reserva))
+        self._cantidad += 1
+
+    def eliminar(self, reserva):
+        self._raiz = _eliminar(self._raiz, (reserva.inicio, reserva.prestamo_id))
+        self._cantidad -= 1
+
+    def hay_conflicto(self, inicio, fin):
+        """Indica si algún intervalo se superpone con [inicio, fin)"""
+        nodo = self._raiz
+        while nodo is not None:
+            if nodo.reserva.inicio < fin and nodo.reserva.fin > inicio:
+                return True
+            # Si ningún intervalo de la izquierda termina después de `inicio`, solo puede estar a la derecha
+            if nodo.izq is not None and nodo.izq.max_fin > inicio:
+                nodo = nodo.izq
+            else:
+                nodo = nodo.der
+        return False
+
+    def conflictos(self, inicio, fin):
+        """Retorna, ordenados por inicio, los intervalos que se superponen con [inicio, fin)"""
+        encontrados = []
+        pendientes = [self._raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo is None or nodo.max_fin <= inicio:
+                continue
+            if nodo.reserva.inicio < fin:
+                if nodo.reserva.fin > inicio:
+                    encontrados.append(nodo.reserva)
+                pendientes.append(nodo.der)
+            pendientes.append(nodo.izq)
+        return sorted(encontrados, key=lambda reserva: (reserva.inicio, reserva.prestamo_id))
+
+
+class IndiceReservas:
+    """Índice en memoria de las ventanas reservadas de cada equipo.
+
+    El árbol de cada equipo se carga desde `prestamos` con la primera consulta
+    sobre él y se actualiza al confirmar cada transacción que cambia un préstamo. Cada árbol guarda la generación
+    compartida con la que se cargó: si otro worker confirma un cambio sobre el
+    equipo, el árbol se recarga desde la base de datos en la siguiente consulta.
+    """
+
+    def __init__(self):
+        self._arboles = {}
+        self._generaciones = {}
+        self._reservas = {}
+        self._lock = threading.RLock()
+
+    def _cargar(self, equipo_ids=None):
+        """Carga desde la base de datos los árboles de los equipos indicados (o de todos)"""
+        if equipo_ids is None:
+            equipo_ids = [fila.id for fila in db.session.query(Equipo.id)]
+        # La generación se lee antes de consultar: un cambio concurrente fuerza otra recarga
+        leidas = {equipo_id: generaciones.leer(ESPACIO_RESERVAS, equipo_id) for equipo_id in equipo_ids}
+
+        consulta = db.session.query(
+            Prestamo.id, Prestamo.equipo_id, Prestamo.fecha_inicio, Prestamo.fecha_fin_programada, Prestamo.estado
+        ).filter(Prestamo.estado.in_(ESTADOS_QUE_RESERVAN))
+        if len(equipo_ids) == 1:
+            consulta = consulta.filter(Prestamo.equipo_id == equipo_ids[0])
+
+        arboles = {equipo_id: ArbolIntervalos() for equipo_id in equipo_ids}
+        reservas = {}
+        for fila in consulta:
+            if fila.equipo_id in arboles:
+                reserva = Reserva(fila.id, fila.fecha_inicio, _fin_reserva(fila), fila.estado)
+                arboles[fila.equipo_id].insertar(reserva)
+                reservas[fila.id] = (fila.equipo_id, reserva)
+
+        with self._lock:
+            recargados = set(equipo_ids)
+            self._reservas = {prestamo_id: valor for prestamo_id, valor in self._reservas.items()
+                              if valor[0] not in recargados}
+            self._reservas.update(reservas)
+            self._arboles.update(arboles)
+            self._generaciones.update(leidas)
+
+    def reconstruir(self):
+        """Reconstruye el índice completo desde la tabla de préstamos"""
+        with self._lock:
+            self._arboles.clear()
+            self._generaciones.clear()
+            self._reservas.clear()
+        self._cargar()
+
+    def _arbol(self, equipo_id):
+        with self._lock:
+            arbol = self._arboles.get(equipo_id)
+            vigente = arbol is not None and \
+                self._generaciones.get(equipo_id) == generaciones.leer(ESPACIO_RESERVAS, equipo_id)
+        if not vigente:
+            self._cargar([equipo_id])
+            with self._lock:
+                arbol = self._arboles[equipo_id]
+        return arbol
+
+    def esta_libre(self, equipo_id, inicio, fin, excluir=None):
+        """Indica si la ventana [inicio, fin) del equipo no choca con ninguna reserva"""
+        if excluir is None:
+            arbol = self._arbol(equipo_id)
+            with self._lock:
+                return not arbol.hay_conflicto(inicio, fin)
+        return not self.conflictos(equipo_id, inicio, fin, excluir)
+
+    def conflictos(self, equipo_id, inicio, fin, excluir=None):
+        """Retorna las reservas del equipo que se superponen con [inicio, fin)"""
+        arbol = self._arbol(equipo_id)
+        with self._lock:
+            return [reserva for reserva in arbol.conflictos(inicio, fin) if reserva.prestamo_id != excluir]
+
+    def siguiente_ventana_libre(self, equipo_id, desde, duracion, excluir=None):
+        """Retorna el primer inicio >= desde con `duracion` libre, o None si un préstamo vencido lo impide"""
+        inicio = desde
+        while True:
+            choques = self.conflictos(equipo_id, inicio, inicio + duracion, excluir)
+            if not choques:
+                return inicio
+            inicio = max(reserva.fin for reserva in choques)
+            if inicio == SIN_FIN:
+                return None
+
+    def _aplicar(self, cambios):
+        """Aplica los préstamos confirmados en este proceso a los árboles afectados"""
+        afectados = set()
+        for prestamo_id, (equipo_anterior, datos) in cambios.items():
+            afectados.add(equipo_anterior)
+            if datos is not None:
+                afectados.add(datos[0])
+        afectados.discard(None)
+
+        with self._lock:
+            vigentes = set()
+            for equipo_id in afectados:
+                nueva = generaciones.incrementar(ESPACIO_RESERVAS, equipo_id)
+                # Solo se actualiza en sitio si nadie más cambió el equipo desde la última carga
+                if equipo_id in self._arboles and self._generaciones.get(equipo_id) == nueva - 1:
+                    self._generaciones[equipo_id] = nueva
+                    vigentes.add(equipo_id)
+                else:
+                    self._arboles.pop(equipo_id, None)
+                    self._generaciones.pop(equipo_id, None)
+
+            for prestamo_id, (_, datos) in cambios.items():
+                anterior = self._reservas.pop(prestamo_id, None)
+                if anterior is not None and anterior[0] in vigentes:
+                    self._arboles[anterior[0]].eliminar(anterior[1])
+                if datos is None:
+                    continue
+                equipo_id, reserva = datos
+                if equipo_id in vigentes and reserva.estado in ESTADOS_QUE_RESERVAN:
+                    self._arboles[equipo_id].insertar(reserva)
+                    self._reservas[prestamo_id] = (equipo_id, reserva)
+
+
+indice_reservas = IndiceReservas()
+
+
+def bloquear_equipo(equipo_id):
+    """Bloquea la fila del equipo hasta el fin de la transacción (SELECT ... FOR UPDATE).
+
+    Serializa en PostgreSQL las transacciones que reservan el mismo equipo;
+    SQLite ignora la cláusula, pero allí la escritura ya toma el bloqueo de
+    toda la base antes de que `ventana_ocupada()` consulte.
+    """
+    db.session.execute(select(Equipo.id).where(Equipo.id == equipo_id).with_for_update())
+
+
+def ventana_ocupada(equipo_id, inicio, fin, excluir=None, estados=ESTADOS_QUE_RESERVAN):
+    """Comprueba en la base de datos, dentro de la transacción de escritura, si otro préstamo ocupa [inicio, fin).
+
+    El índice en memoria responde antes de escribir, pero dos peticiones
+    concurrentes pueden ver la misma ventana libre. Esta consulta se hace tras
+    bloquear el equipo y volcar la escritura propia, así que ve todo lo
+    confirmado por las demás.
+    """
+    consulta = select(Prestamo.id).where(
+        Prestamo.equipo_id == equipo_id,
+        Prestamo.estado.in_(estados),
+        Prestamo.fecha_inicio < fin,
+        or_(Prestamo.estado == EstadoPrestamo.VENCIDO, Prestamo.fecha_fin_programada > inicio)
+    )
+    if excluir is not None:
+        consulta = consulta.where(Prestamo.id != excluir)
+    return db.session.execute(select(consulta.exists())).scalar()
+
+
+def en_curso(ahora):
+    """Condición de los préstamos que tienen el equipo en manos del usuario: aprobados ya iniciados o vencidos"""
+    return or_(
+        Prestamo.estado == EstadoPrestamo.VENCIDO,
+        and_(Prestamo.estado == EstadoPrestamo.APROBADO, Prestamo.fecha_inicio <= ahora)
+    )
+
+
+def actualizar_estado_equipo(equipo, ahora=None):
+    """Deriva el estado del equipo del préstamo que lo ocupa ahora.
+
+    Un préstamo aprobado para el mes próximo no presta el equipo todavía, y
+    devolver o cancelar un préstamo no lo libera si otro sigue en curso. Los
+    estados que fija un administrador (mantenimiento, dañado) no se tocan. Se
+    llama tras cambiar el préstamo; la consulta vuelca antes los cambios propios.
+    """
+    if equipo.estado not in ESTADOS_EQUIPO_RESERVABLES:
+        return
+    ahora = ahora or datetime.utcnow()
+    prestado = db.session.execute(select(
+        select(Prestamo.id).where(Prestamo.equipo_id == equipo.id, en_curso(ahora)).exists()
+    )).scalar()
+    estado = 'prestado' if prestado else 'disponible'
+    if equipo.estado != estado:
+        equipo.estado = estado
+    if equipo.disponible != (not prestado):
+        equipo.disponible = not prestado
+
+_CAMPOS_RESERVA = ('estado', 'fecha_inicio', 'fecha_fin_programada', 'equipo_id')
+
+
+@event.listens_for(db.session, 'after_flush')
+def _registrar_cambios_reservas(session, flush_context):
+    """Anota los préstamos creados, modificados o eliminados para aplicarlos al confirmar"""
+    cambios = session.info.setdefault('reservas', {})
+    for prestamo in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(prestamo, Prestamo):
+            continue
+        estado = inspect(prestamo)
+        historial_equipo = estado.attrs.equipo_id.history
+        equipo_anterior = historial_equipo.deleted[0] if historial_equipo.deleted else prestamo.equipo_id
+        if prestamo in session.deleted:
+            datos = None
+        elif prestamo in session.new or any(estado.attrs[campo].history.has_changes() for campo in _CAMPOS_RESERVA):
+            datos = (prestamo.equipo_id, Reserva(prestamo.id, prestamo.fecha_inicio,
+                                                 _fin_reserva(prestamo), prestamo.estado))
+        else:
+            continue
+        # Conservar el equipo original si el préstamo cambió varias veces en la transacción
+        previo = cambios.get(prestamo.id)
+        cambios[prestamo.id] = (previo[0] if previo else equipo_anterior, datos)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _aplicar_cambios_reservas(session):
+    cambios = session.info.pop('reservas', None)
+    if cambios:
+        indice_reservas._aplicar(cambios)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_cambios_reservas(session):
+    session.info.pop('reservas', None)
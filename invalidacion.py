@@ -0,0 +1,128 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from sqlalchemy import event
+
+from models import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: basta el lock de hilos con el servidor de desarrollo
+    fcntl = None
+
+_FORMATO = '<Q'
+_TAMANO = struct.calcsize(_FORMATO)
+
+
+# Ranuras de cada espacio. Las claves enteras (ids) ocupan la ranura clave % ranuras, así que un
+# espacio con más ranuras que filas no tiene colisiones; los espacios de una sola clave tienen la suya
+RANURAS_POR_ESPACIO = {
+    'usuarios': 65536,
+    'notificaciones_pendientes': 65536,
+    'reservas': 16384,
+    'inventario': 1,
+    'equipos_typeahead': 1,
+}
+RANURAS_OTROS = 4096  # espacios sin región propia
+
+
+class TablaGeneraciones:
+    """Números de generación compartidos entre procesos para invalidar cachés locales.
+
+    Cada clave (espacio, clave) se asigna a una ranura de un archivo mapeado en
+    memoria dentro de la carpeta instance/. Los workers de gunicorn que mapean el
+    mismo archivo ven los incrementos de los demás sin consultar la base de
+    datos. Cada espacio tiene su propia región del archivo (GENERACIONES_RANURAS
+    reemplaza tamaños de RANURAS_POR_ESPACIO), de modo que las claves de un
+    espacio nunca invalidan las de otro; dentro de una región, una colisión solo
+    provoca una invalidación de más. Todos los workers deben usar la misma
+    configuración: otra distribución de regiones se lee como generaciones nuevas.
+    """
+
+    def __init__(self, ranuras=None, ranuras_otros=RANURAS_OTROS):
+        self._configurar_regiones(ranuras if ranuras is not None else RANURAS_POR_ESPACIO, ranuras_otros)
+        self.ruta = None
+        self._mapa = bytearray(self.ranuras * _TAMANO)
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _configurar_regiones(self, ranuras, ranuras_otros):
+        # Orden por nombre: la misma configuración produce la misma distribución en todos los procesos
+        self._regiones = {}
+        inicio = 0
+        for espacio in sorted(ranuras):
+            self._regiones[espacio] = (inicio, ranuras[espacio])
+            inicio += ranuras[espacio]
+        self._otros = (inicio, ranuras_otros)
+        self.ranuras = inicio + ranuras_otros
+
+    def init_app(self, app):
+        self._configurar_regiones({**RANURAS_POR_ESPACIO, **app.config.get('GENERACIONES_RANURAS', {})},
+                                  app.config.get('GENERACIONES_RANURAS_OTROS', RANURAS_OTROS))
+        self.ruta = app.config.get('GENERACIONES_ARCHIVO') or os.path.join(app.instance_path, 'generaciones.bin')
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+
+        tamano = self.ranuras * _TAMANO
+        fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < tamano:
+            os.ftruncate(fd, tamano)
+        self._mapa = mmap.mmap(fd, tamano)
+        self._fd = fd
+
+    def _posicion(self, espacio, clave):
+        region = self._regiones.get(espacio)
+        if region is None:
+            inicio, cantidad = self._otros
+            indice = zlib.crc32(f'{espacio}:{clave}'.encode('utf-8')) % cantidad
+        else:
+            inicio, cantidad = region
+            if isinstance(clave, int):
+                indice = clave % cantidad
+            else:
+                indice = zlib.crc32(str(clave).encode('utf-8')) % cantidad
+        return (inicio + indice) * _TAMANO
+
+    def leer(self, espacio, clave):
+        """Retorna la generación actual de la clave"""
+        return struct.unpack_from(_FORMATO, self._mapa, self._posicion(espacio, clave))[0]
+
+    def incrementar(self, espacio, clave):
+        """Invalida la clave en todos los procesos y retorna la generación nueva"""
+        posicion = self._posicion(espacio, clave)
+        with self._lock:
+            if fcntl is not None and self._fd is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, _TAMANO, posicion)
+            try:
+                valor = struct.unpack_from(_FORMATO, self._mapa, posicion)[0] + 1
+                struct.pack_into(_FORMATO, self._mapa, posicion, valor)
+            finally:
+                if fcntl is not None and self._fd is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, _TAMANO, posicion)
+        return valor
+
+
+generaciones = TablaGeneraciones()
+
+
+def invalidar_al_confirmar(espacio, clave, session=None):
+    """Programa la invalidación de la clave para cuando se confirme la transacción actual.
+
+    Invalidar antes del commit permitiría que otro proceso volviera a cachear el
+    valor anterior con la generación nueva.
+    """
+    session = session if session is not None else db.session()
+    session.info.setdefault('invalidaciones', set()).add((espacio, clave))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _aplicar_invalidaciones(session):
+    for espacio, clave in session.info.pop('invalidaciones', ()):
+        generaciones.incrementar(espacio, clave)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _descartar_invalidaciones(session):
+    session.info.pop('invalidaciones', None)
@@ -0,0 +1,116 @@
+"""
+Migración de una base de datos SQLite existente a PostgreSQL.
+
+Copia todas las tablas de los modelos, en orden de dependencias, con COPY FROM
+STDIN en bloques de `FILAS_POR_COPY` filas: la lectura de SQLite es por
+streaming y cada bloque viaja en un solo mensaje, sin un INSERT por fila. Todo
+ocurre en una transacción de la base de datos destino, así que una migración
+fallida no deja datos a medias. Al final se adelantan las secuencias de las
+claves primarias y se ejecuta ANALYZE.
+"""
+
+import io
+import os
+from datetime import date, datetime
+from enum import Enum
+from time import perf_counter
+
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from models import db, Prestamo
+from base_datos import sin_limite_de_tiempo, sincronizar_secuencias
+
+FILAS_POR_COPY = 10000
+
+
+def _valor_copy(valor):
+    """Representa un valor en el formato de texto de COPY"""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, Enum):
+        # Los tipos enumerados guardan el nombre del miembro, igual que en SQLite
+        return valor.name
+    if isinstance(valor, datetime):
+        return valor.isoformat(' ')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    texto = str(valor)
+    return texto.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copiar(cursor, tabla, columnas, filas):
+    """Envía un bloque de filas con COPY FROM STDIN (psycopg2 o psycopg 3)"""
+    datos = ''.join('\t'.join(_valor_copy(valor) for valor in fila) + '\n' for fila in filas)
+    sentencia = 'COPY {} ({}) FROM STDIN'.format(tabla, ', '.join(columnas))
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sentencia, io.StringIO(datos))
+    else:
+        with cursor.copy(sentencia) as copia:
+            copia.write(datos)
+
+
+def _url_origen(origen):
+    if '://' in origen:
+        return origen
+    return f'sqlite:///{os.path.abspath(origen)}'
+
+
+def migrar_desde_sqlite(origen, reemplazar=False, filas_por_copy=FILAS_POR_COPY):
+    """Copia la base SQLite `origen` (ruta o URL) a la base PostgreSQL de la aplicación.
+
+    Las tablas destino se vacían antes de copiar (`flask iunp init` ya crea
+    el administrador y los equipos de ejemplo); si el destino ya tiene
+    préstamos hay que pedirlo explícitamente con `reemplazar=True`. Retorna las
+    filas copiadas por tabla y la duración.
+    """
+    destino = db.engine
+    if destino.dialect.name != 'postgresql':
+        raise ValueError(f"La base de datos de la aplicación es {destino.dialect.name}; "
+                         "configurar DATABASE_URL con una URL postgresql://")
+
+    motor_origen = create_engine(_url_origen(origen))
+    if motor_origen.dialect.name != 'sqlite':
+        raise ValueError("El origen debe ser una base de datos SQLite")
+
+    inicio = perf_counter()
+    totales = {}
+    tablas = db.metadata.sorted_tables
+    try:
+        tablas_origen = set(inspect(motor_origen).get_table_names())
+        with destino.begin() as conexion, motor_origen.connect() as lectura:
+            sin_limite_de_tiempo(conexion)
+            if not reemplazar and conexion.execute(select(Prestamo.id).limit(1)).first() is not None:
+                raise ValueError("La base de datos destino ya tiene préstamos; usar --reemplazar para sobrescribirla")
+            conexion.execute(text('TRUNCATE {} RESTART IDENTITY CASCADE'.format(
+                ', '.join(tabla.name for tabla in tablas))))
+
+            cursor = conexion.connection.cursor()
+            for tabla in tablas:
+                if tabla.name not in tablas_origen:
+                    continue
+                # Una base anterior puede no tener las columnas agregadas después
+                existentes = {columna['name'] for columna in inspect(motor_origen).get_columns(tabla.name)}
+                columnas = [columna for columna in tabla.columns if columna.name in existentes]
+                nombres = [columna.name for columna in columnas]
+
+                resultado = lectura.execution_options(yield_per=filas_por_copy).execute(select(*columnas))
+                copiadas = 0
+                for bloque in resultado.partitions():
+                    _copiar(cursor, tabla.name, nombres, bloque)
+                    copiadas += len(bloque)
+                totales[tabla.name] = copiadas
+
+                en_destino = conexion.execute(select(func.count()).select_from(tabla)).scalar()
+                if en_destino != copiadas:
+                    raise RuntimeError(f"{tabla.name}: se copiaron {copiadas} filas pero el destino tiene {en_destino}")
+            cursor.close()
+
+            sincronizar_secuencias(conexion, tablas)
+            conexion.execute(text('ANALYZE'))
+    finally:
+        motor_origen.dispose()
+
+    totales['segundos'] = round(perf_counter() - inicio, 2)
+    return totales
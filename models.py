@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime
+from sqlalchemy.orm import query_expression
+from datetime import datetime, timedelta
 from enum import Enum
 import secrets
 import string
@@ -36,8 +37,22 @@ class TipoNotificacion(Enum):
     EQUIPO_DISPONIBLE = "equipo_disponible"
     SISTEMA = "sistema"
 
+ESTADOS_EQUIPO_RESERVABLES = ('disponible', 'prestado')
+
+# Tipos enumerados compartidos por todas sus columnas: en PostgreSQL son tipos nativos
+# (CREATE TYPE) con un nombre estable; en SQLite se guardan como VARCHAR con el nombre del miembro
+TIPO_USUARIO = db.Enum(TipoUsuario, name='tipo_usuario')
+ESTADO_PRESTAMO = db.Enum(EstadoPrestamo, name='estado_prestamo')
+CATEGORIA_EQUIPO = db.Enum(CategoriaEquipo, name='categoria_equipo')
+TIPO_NOTIFICACION = db.Enum(TipoNotificacion, name='tipo_notificacion')
+
 class Usuario(UserMixin, db.Model):
     __tablename__ = 'usuarios'
+    __table_args__ = (
+        db.Index('ix_usuarios_fecha_registro', 'fecha_registro'),
+        db.Index('ix_usuarios_tipo_registro', 'tipo_usuario', 'fecha_registro'),
+        db.Index('ix_usuarios_activo_registro', 'activo', 'fecha_registro'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cedula = db.Column(db.String(20), unique=True, nullable=False)
@@ -46,7 +61,7 @@ class Usuario(UserMixin, db.Model):
     email = db.Column(db.String(120), unique=True, nullable=True)
     telefono = db.Column(db.String(20))
     password_hash = db.Column(db.String(200), nullable=False)
-    tipo_usuario = db.Column(db.Enum(TipoUsuario), nullable=False, default=TipoUsuario.ESTUDIANTE)
+    tipo_usuario = db.Column(TIPO_USUARIO, nullable=False, default=TipoUsuario.ESTUDIANTE)
     activo = db.Column(db.Boolean, default=True)
     fecha_registro = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -69,12 +84,22 @@ class Usuario(UserMixin, db.Model):
 
 class Equipo(db.Model):
     __tablename__ = 'equipos'
+    __table_args__ = (
+        db.Index('ix_equipos_estado_disponible', 'estado', 'disponible'),
+        db.Index('ix_equipos_nombre', 'nombre'),
+        db.Index('ix_equipos_fecha_registro', 'fecha_registro'),
+        db.Index('ix_equipos_categoria_nombre', 'categoria', 'nombre'),
+        db.Index('ix_equipos_categoria_registro', 'categoria', 'fecha_registro'),
+        db.Index('ix_equipos_estado_nombre', 'estado', 'nombre'),
+        db.Index('ix_equipos_estado_registro', 'estado', 'fecha_registro'),
+        db.Index('ix_equipos_disponible_registro', 'disponible', 'fecha_registro'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     codigo = db.Column(db.String(50), unique=True, nullable=False)
     nombre = db.Column(db.String(100), nullable=False)
     descripcion = db.Column(db.Text)
-    categoria = db.Column(db.Enum(CategoriaEquipo), nullable=False)
+    categoria = db.Column(CATEGORIA_EQUIPO, nullable=False)
     marca = db.Column(db.String(50))
     modelo = db.Column(db.String(50))
     numero_serie = db.Column(db.String(100))
@@ -87,18 +112,35 @@ class Equipo(db.Model):
     # Relaciones
     prestamos = db.relationship('Prestamo', backref='equipo', lazy=True)
     
+    # Calculado en la consulta por los perfiles de carga (ver consultas.py)
+    prestamo_activo = query_expression()
+    
     def __repr__(self):
         return f'<Equipo {self.codigo} - {self.nombre}>'
     
     def esta_disponible(self):
         return self.disponible and self.estado == 'disponible'
     
+    def admite_reservas(self):
+        """Un equipo prestado puede reservarse para fechas futuras; uno en mantenimiento o dañado no"""
+        return self.estado in ESTADOS_EQUIPO_RESERVABLES
+    
     def tiene_prestamo_activo(self):
+        if self.prestamo_activo is not None:
+            return bool(self.prestamo_activo)
         return any(prestamo.estado in [EstadoPrestamo.APROBADO] 
                   for prestamo in self.prestamos)
 
 class Prestamo(db.Model):
     __tablename__ = 'prestamos'
+    __table_args__ = (
+        db.Index('ix_prestamos_usuario_estado', 'usuario_id', 'estado'),
+        db.Index('ix_prestamos_estado_fin', 'estado', 'fecha_fin_programada'),
+        db.Index('ix_prestamos_equipo_solicitud', 'equipo_id', 'fecha_solicitud'),
+        db.Index('ix_prestamos_equipo_estado', 'equipo_id', 'estado'),
+        db.Index('ix_prestamos_fecha_solicitud', 'fecha_solicitud'),
+        db.Index('ix_prestamos_estado_solicitud', 'estado', 'fecha_solicitud'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
@@ -111,7 +153,7 @@ class Prestamo(db.Model):
     fecha_devolucion = db.Column(db.DateTime)
     
     # Estado y aprobación
-    estado = db.Column(db.Enum(EstadoPrestamo), default=EstadoPrestamo.SOLICITADO)
+    estado = db.Column(ESTADO_PRESTAMO, default=EstadoPrestamo.SOLICITADO)
     aprobado_por_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
     fecha_aprobacion = db.Column(db.DateTime)
     
@@ -152,10 +194,13 @@ class Prestamo(db.Model):
         return self.estado == EstadoPrestamo.APROBADO
     
     def puede_ser_aprobado(self):
-        return self.estado == EstadoPrestamo.SOLICITADO and self.equipo.esta_disponible()
+        return self.estado == EstadoPrestamo.SOLICITADO and self.equipo.admite_reservas()
 
 class HistorialAcciones(db.Model):
     __tablename__ = 'historial_acciones'
+    __table_args__ = (
+        db.Index('ix_historial_usuario_fecha', 'usuario_id', 'fecha'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
@@ -173,6 +218,10 @@ class HistorialAcciones(db.Model):
 
 class TokenAcceso(db.Model):
     __tablename__ = 'tokens_acceso'
+    __table_args__ = (
+        db.Index('ix_tokens_acceso_fecha_creacion', 'fecha_creacion'),
+        db.Index('ix_tokens_acceso_expira_en', 'expira_en'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(32), unique=True, nullable=False, index=True)
@@ -407,15 +456,57 @@ def validar_token_acceso(token):
     
     return token_obj.usuario, None
 
+ERROR_TOKEN_NO_ADMIN = "El token no corresponde a un usuario administrador."
+
+def consumir_token_acceso(token, solo_admin=True):
+    """Consume un token de acceso en una sola sentencia y retorna (usuario, error).
+
+    El UPDATE condicional solo afecta al token si no está usado, no expiró y
+    (con `solo_admin`) pertenece a un administrador activo, de modo que dos
+    peticiones concurrentes no pueden consumir el mismo token. El cambio queda
+    pendiente en la sesión: el llamador confirma junto con su propio registro.
+    """
+    ahora = datetime.utcnow()
+    condiciones = [TokenAcceso.token == token, TokenAcceso.usado == False, TokenAcceso.expira_en > ahora]
+    if solo_admin:
+        condiciones.append(TokenAcceso.usuario_id.in_(
+            db.select(Usuario.id).where(Usuario.tipo_usuario == TipoUsuario.ADMIN, Usuario.activo == True)
+        ))
+    usuario_id = db.session.execute(
+        db.update(TokenAcceso).where(*condiciones)
+        .values(usado=True, fecha_uso=ahora)
+        .returning(TokenAcceso.usuario_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if usuario_id is not None:
+        return db.session.get(Usuario, usuario_id), None
+
+    # Camino de error: una consulta más solo para explicar el rechazo
+    fila = db.session.execute(
+        db.select(TokenAcceso.usado, TokenAcceso.expira_en, Usuario.tipo_usuario, Usuario.activo)
+        .join(Usuario, TokenAcceso.usuario)
+        .where(TokenAcceso.token == token)
+    ).first()
+    if fila is None:
+        return None, "Token no encontrado"
+    if fila.usado:
+        return None, "Token ya utilizado"
+    if fila.expira_en <= ahora:
+        return None, "Token expirado"
+    return None, ERROR_TOKEN_NO_ADMIN
+
 class Notificacion(db.Model):
     __tablename__ = 'notificaciones'
+    __table_args__ = (
+        db.Index('ix_notificaciones_usuario_leida_fecha', 'usuario_id', 'leida', 'fecha_creacion'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     prestamo_id = db.Column(db.Integer, db.ForeignKey('prestamos.id'))
     
     # Contenido de la notificación
-    tipo = db.Column(db.Enum(TipoNotificacion), nullable=False)
+    tipo = db.Column(TIPO_NOTIFICACION, nullable=False)
     titulo = db.Column(db.String(200), nullable=False)
     mensaje = db.Column(db.Text, nullable=False)
     leida = db.Column(db.Boolean, default=False)
@@ -470,8 +561,66 @@ def crear_notificacion(usuario_id, tipo, titulo, mensaje, prestamo_id=None, urge
     db.session.add(notificacion)
     db.session.commit()
     
+    # Avisar a los flujos SSE abiertos del usuario
+    from notificaciones import publicar_notificaciones
+    publicar_notificaciones([notificacion])
+    
     return notificacion
 
+class OutboxNotificacion(db.Model):
+    """Notificación pendiente de repartir a sus destinatarios (bandeja de salida transaccional)"""
+    __tablename__ = 'outbox_notificaciones'
+    __table_args__ = (
+        db.Index('ix_outbox_estado_proximo', 'estado', 'proximo_intento'),
+        db.Index('ix_outbox_estado_envio', 'estado', 'fecha_envio'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Destinatarios: un usuario concreto o todos los usuarios de un tipo
+    destinatario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
+    tipo_destinatarios = db.Column(TIPO_USUARIO)
+    
+    # Contenido de las notificaciones a crear
+    prestamo_id = db.Column(db.Integer, db.ForeignKey('prestamos.id'))
+    tipo = db.Column(TIPO_NOTIFICACION, nullable=False)
+    titulo = db.Column(db.String(200), nullable=False)
+    mensaje = db.Column(db.Text, nullable=False)
+    urgencia = db.Column(db.String(20), default='normal')
+    icono = db.Column(db.String(50), default='bell')
+    
+    # Estado del reparto
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, procesando, enviado, fallido
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    proximo_intento = db.Column(db.DateTime, default=datetime.utcnow)
+    reclamado_por = db.Column(db.String(32))
+    reclamado_en = db.Column(db.DateTime)
+    ultimo_error = db.Column(db.Text)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_envio = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<OutboxNotificacion {self.id} - {self.tipo.value} - {self.estado}>'
+
+def encolar_notificacion(tipo, titulo, mensaje, destinatario_id=None, tipo_destinatarios=None,
+                         prestamo_id=None, urgencia='normal', icono='bell'):
+    """Agrega una notificación a la bandeja de salida dentro de la transacción actual (sin commit)"""
+    
+    entrada = OutboxNotificacion(
+        destinatario_id=destinatario_id,
+        tipo_destinatarios=tipo_destinatarios,
+        prestamo_id=prestamo_id,
+        tipo=tipo,
+        titulo=titulo,
+        mensaje=mensaje,
+        urgencia=urgencia,
+        icono=icono
+    )
+    
+    db.session.add(entrada)
+    
+    return entrada
+
 def obtener_notificaciones_pendientes(usuario_id):
     """Obtiene las notificaciones no leídas de un usuario"""
     return Notificacion.query.filter_by(
@@ -490,29 +639,21 @@ def contar_notificaciones_pendientes(usuario_id):
     ).count()
 
 def notificar_nueva_solicitud_prestamo(prestamo):
-    """Envía notificaciones a todos los administradores sobre una nueva solicitud"""
-    from sqlalchemy import or_
-    
-    # Obtener todos los administradores
-    administradores = Usuario.query.filter(
-        Usuario.tipo_usuario == TipoUsuario.ADMIN
-    ).all()
-    
-    for admin in administradores:
-        crear_notificacion(
-            usuario_id=admin.id,
-            tipo=TipoNotificacion.SOLICITUD_PRESTAMO,
-            titulo="Nueva Solicitud de Préstamo",
-            mensaje=f"{prestamo.usuario.nombre_completo} solicita el equipo '{prestamo.equipo.nombre}' del {prestamo.fecha_inicio.strftime('%d/%m/%Y %H:%M')} al {prestamo.fecha_fin_programada.strftime('%d/%m/%Y %H:%M')}",
-            prestamo_id=prestamo.id,
-            urgencia='alta',
-            icono='handshake'
-        )
+    """Encola una notificación para todos los administradores sobre una nueva solicitud"""
+    encolar_notificacion(
+        tipo_destinatarios=TipoUsuario.ADMIN,
+        tipo=TipoNotificacion.SOLICITUD_PRESTAMO,
+        titulo="Nueva Solicitud de Préstamo",
+        mensaje=f"{prestamo.usuario.nombre_completo} solicita el equipo '{prestamo.equipo.nombre}' del {prestamo.fecha_inicio.strftime('%d/%m/%Y %H:%M')} al {prestamo.fecha_fin_programada.strftime('%d/%m/%Y %H:%M')}",
+        prestamo_id=prestamo.id,
+        urgencia='alta',
+        icono='handshake'
+    )
 
 def notificar_aprobacion_prestamo(prestamo):
-    """Envía notificación de aprobación al usuario"""
-    crear_notificacion(
-        usuario_id=prestamo.usuario_id,
+    """Encola la notificación de aprobación para el usuario"""
+    encolar_notificacion(
+        destinatario_id=prestamo.usuario_id,
         tipo=TipoNotificacion.APROBACION_PRESTAMO,
         titulo="Solicitud de Préstamo Aprobada",
         mensaje=f"Tu solicitud para el equipo '{prestamo.equipo.nombre}' ha sido aprobada. Puedes recoger el equipo a partir del {prestamo.fecha_inicio.strftime('%d/%m/%Y %H:%M')}",
@@ -522,17 +663,58 @@ def notificar_aprobacion_prestamo(prestamo):
     )
 
 def notificar_rechazo_prestamo(prestamo, razon=""):
-    """Envía notificación de rechazo al usuario"""
+    """Encola la notificación de rechazo para el usuario"""
     mensaje = f"Tu solicitud para el equipo '{prestamo.equipo.nombre}' ha sido rechazada."
     if razon:
         mensaje += f" Razón: {razon}"
     
-    crear_notificacion(
-        usuario_id=prestamo.usuario_id,
+    encolar_notificacion(
+        destinatario_id=prestamo.usuario_id,
         tipo=TipoNotificacion.RECHAZO_PRESTAMO,
         titulo="Solicitud de Préstamo Rechazada",
         mensaje=mensaje,
         prestamo_id=prestamo.id,
         urgencia='normal',
         icono='times-circle'
-    )
\ No newline at end of file
+    )
+
+class EstadisticasSistema(db.Model):
+    """Contadores materializados del sistema (una sola fila, id=1)"""
+    __tablename__ = 'estadisticas_sistema'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Usuarios y equipos
+    total_usuarios = db.Column(db.Integer, nullable=False, default=0)
+    total_equipos = db.Column(db.Integer, nullable=False, default=0)
+    equipos_disponibles = db.Column(db.Integer, nullable=False, default=0)
+    equipos_prestados = db.Column(db.Integer, nullable=False, default=0)
+    equipos_mantenimiento = db.Column(db.Integer, nullable=False, default=0)
+    equipos_danados = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Préstamos por estado
+    total_prestamos = db.Column(db.Integer, nullable=False, default=0)
+    prestamos_solicitados = db.Column(db.Integer, nullable=False, default=0)
+    prestamos_aprobados = db.Column(db.Integer, nullable=False, default=0)
+    prestamos_rechazados = db.Column(db.Integer, nullable=False, default=0)
+    prestamos_devueltos = db.Column(db.Integer, nullable=False, default=0)
+    prestamos_vencidos = db.Column(db.Integer, nullable=False, default=0)
+    
+    fecha_reconciliacion = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<EstadisticasSistema {self.total_equipos} equipos - {self.total_prestamos} préstamos>'
+
+class ResumenDiarioPrestamos(db.Model):
+    """Préstamos por día de solicitud, categoría de equipo y estado (mantenido por resumenes.py)"""
+    __tablename__ = 'resumen_diario_prestamos'
+    
+    fecha = db.Column(db.Date, primary_key=True)
+    categoria = db.Column(CATEGORIA_EQUIPO, primary_key=True)
+    estado = db.Column(ESTADO_PRESTAMO, primary_key=True)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    # Suma de duraciones: real para los devueltos, programada para el resto
+    minutos_totales = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ResumenDiarioPrestamos {self.fecha} {self.categoria.value} {self.estado.value}: {self.cantidad}>'
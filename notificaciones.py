@@ -0,0 +1,179 @@
+import queue
+import threading
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import event
+
+from models import db, Notificacion, contar_notificaciones_pendientes
+from invalidacion import generaciones, invalidar_al_confirmar
+
+ESPACIO_PENDIENTES = 'notificaciones_pendientes'
+
+
+class CacheConteoPendientes:
+    """Conteo de notificaciones no leídas por usuario, cacheado en cada worker.
+
+    Cada entrada guarda la generación con la que se calculó; mientras la
+    generación compartida del usuario no cambie, el conteo se sirve sin
+    consultar la base de datos.
+    """
+
+    def __init__(self, max_entradas=10000):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, usuario_id):
+        generacion = generaciones.leer(ESPACIO_PENDIENTES, usuario_id)
+        with self._lock:
+            entrada = self._entradas.get(usuario_id)
+            if entrada is not None and entrada[0] == generacion:
+                self._entradas.move_to_end(usuario_id)
+                return entrada[1]
+
+        # La generación se lee antes de consultar: si cambia mientras tanto, la
+        # entrada queda desactualizada y se recalcula en la siguiente lectura
+        conteo = contar_notificaciones_pendientes(usuario_id)
+        with self._lock:
+            self._entradas[usuario_id] = (generacion, conteo)
+            self._entradas.move_to_end(usuario_id)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return conteo
+
+
+conteo_pendientes = CacheConteoPendientes()
+
+
+def invalidar_conteo_pendientes(usuario_id):
+    """Invalida el conteo del usuario en todos los workers al confirmar la transacción"""
+    invalidar_al_confirmar(ESPACIO_PENDIENTES, usuario_id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _detectar_cambios_notificaciones(session, flush_context):
+    """Invalida el conteo de los usuarios con notificaciones creadas, leídas o eliminadas"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Notificacion):
+            invalidar_al_confirmar(ESPACIO_PENDIENTES, obj.usuario_id, session)
+
+
+class Suscripcion:
+    """Cola de eventos de un flujo SSE abierto por un usuario"""
+
+    def __init__(self, usuario_id, max_eventos):
+        self.usuario_id = usuario_id
+        self.cola = queue.Queue(maxsize=max_eventos)
+        # Si el cliente no consume a tiempo se descartan eventos y debe resincronizarse
+        self.desbordada = False
+        self.cancelada = False
+
+    def esperar(self, timeout):
+        """Retorna el siguiente evento, o None si no llegó ninguno en `timeout` segundos"""
+        try:
+            return self.cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class BusNotificaciones:
+    """Publicación/suscripción en memoria de los eventos de notificaciones de cada usuario.
+
+    Solo alcanza a los flujos abiertos en este proceso; los cambios hechos por
+    otros workers se detectan con la tabla de generaciones compartida. Cada
+    flujo ocupa un hilo del worker mientras dura, así que se admiten a lo sumo
+    `max_flujos` a la vez.
+    """
+
+    def __init__(self, max_eventos=100, max_flujos=4):
+        self.max_eventos = max_eventos
+        self.max_flujos = max_flujos
+        self._suscripciones = defaultdict(set)
+        self._abiertas = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_flujos = app.config.get('NOTIFICACIONES_STREAM_MAX', self.max_flujos)
+
+    def suscribir(self, usuario_id):
+        """Retorna una suscripción nueva, o None si el worker ya tiene `max_flujos` abiertos"""
+        suscripcion = Suscripcion(usuario_id, self.max_eventos)
+        with self._lock:
+            if self._abiertas >= self.max_flujos:
+                return None
+            self._abiertas += 1
+            self._suscripciones[usuario_id].add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            if suscripcion.cancelada:
+                return
+            suscripcion.cancelada = True
+            self._abiertas -= 1
+            suscripciones = self._suscripciones.get(suscripcion.usuario_id)
+            if suscripciones is not None:
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._suscripciones[suscripcion.usuario_id]
+
+    def tiene_suscriptores(self, usuario_id):
+        with self._lock:
+            return usuario_id in self._suscripciones
+
+    def publicar(self, usuario_id, tipo, datos):
+        with self._lock:
+            suscripciones = list(self._suscripciones.get(usuario_id, ()))
+        for suscripcion in suscripciones:
+            try:
+                suscripcion.cola.put_nowait((tipo, datos))
+            except queue.Full:
+                suscripcion.desbordada = True
+
+    def total_suscripciones(self):
+        with self._lock:
+            return sum(len(suscripciones) for suscripciones in self._suscripciones.values())
+
+
+bus_notificaciones = BusNotificaciones()
+
+
+def serializar_notificacion(notificacion):
+    """Datos de una notificación para la API (objeto ORM o fila con las mismas columnas)"""
+    return {
+        'id': notificacion.id,
+        'titulo': notificacion.titulo,
+        'mensaje': notificacion.mensaje,
+        'tiempo': getattr(notificacion, 'tiempo_transcurrido', 'Ahora mismo'),
+        'urgencia': notificacion.urgencia,
+        'icono': notificacion.icono,
+        'prestamo_id': notificacion.prestamo_id
+    }
+
+
+def publicar_notificaciones(notificaciones):
+    """Publica notificaciones ya confirmadas y el nuevo conteo de sus destinatarios.
+
+    Solo se consulta el conteo de los usuarios con un flujo abierto en este
+    proceso, así que publicar para usuarios sin pestañas abiertas no cuesta nada.
+    """
+    por_usuario = defaultdict(list)
+    for notificacion in notificaciones:
+        if bus_notificaciones.tiene_suscriptores(notificacion.usuario_id):
+            por_usuario[notificacion.usuario_id].append(notificacion)
+
+    for usuario_id, pendientes in por_usuario.items():
+        for notificacion in sorted(pendientes, key=lambda n: n.id):
+            bus_notificaciones.publicar(usuario_id, 'notificacion', serializar_notificacion(notificacion))
+        publicar_conteo(usuario_id)
+
+
+def publicar_conteo(usuario_id):
+    """Publica el conteo de no leídas del usuario tras confirmar un cambio"""
+    if bus_notificaciones.tiene_suscriptores(usuario_id):
+        # La generación acompaña al conteo para que el flujo sepa si ya está al día
+        generacion = generaciones.leer(ESPACIO_PENDIENTES, usuario_id)
+        bus_notificaciones.publicar(usuario_id, 'conteo', {
+            'conteo': conteo_pendientes.obtener(usuario_id),
+            'generacion': generacion
+        })
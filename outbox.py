@@ -0,0 +1,242 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, update
+
+from models import db, Usuario, Notificacion, OutboxNotificacion
+from notificaciones import invalidar_conteo_pendientes, publicar_notificaciones
+from tareas import TareaPeriodica
+
+logger = logging.getLogger(__name__)
+
+
+class DespachadorNotificaciones(TareaPeriodica):
+    """Reparte en segundo plano las notificaciones de la bandeja de salida.
+
+    Cada entrada de `outbox_notificaciones` se escribe en la misma transacción
+    que el cambio que la origina; el despachador la reclama, resuelve sus
+    destinatarios e inserta las filas de `notificaciones` en lotes. Las entradas
+    que fallan se reintentan con espera exponencial hasta `max_intentos`.
+    """
+
+    def __init__(self, intervalo=5, tamano_lote=500, entradas_por_ciclo=100,
+                 max_intentos=5, espera_base=10, tiempo_reclamo=300):
+        super().__init__('despachador-notificaciones', intervalo)
+        self.tamano_lote = tamano_lote
+        self.entradas_por_ciclo = entradas_por_ciclo
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.tiempo_reclamo = tiempo_reclamo
+
+    def init_app(self, app, habilitada=True):
+        self.intervalo = app.config.get('OUTBOX_INTERVALO', self.intervalo)
+        self.tamano_lote = app.config.get('OUTBOX_TAMANO_LOTE', self.tamano_lote)
+        self.max_intentos = app.config.get('OUTBOX_MAX_INTENTOS', self.max_intentos)
+        super().init_app(app, habilitada)
+
+    def ejecutar(self):
+        while self.despachar() >= self.entradas_por_ciclo:
+            pass
+
+    def _reclamar(self):
+        """Reserva entradas pendientes para este proceso y retorna sus ids"""
+        ahora = datetime.utcnow()
+        reclamo = uuid.uuid4().hex
+
+        # Las entradas de un proceso que murió a mitad de reparto vuelven a la cola; el reclamo
+        # cuenta como intento, para que una entrada que tumba al despachador termine como fallida
+        abandonadas = (OutboxNotificacion.estado == 'procesando',
+                       OutboxNotificacion.reclamado_en < ahora - timedelta(seconds=self.tiempo_reclamo))
+        descartadas = db.session.execute(
+            update(OutboxNotificacion)
+            .where(*abandonadas, OutboxNotificacion.intentos + 1 >= self.max_intentos)
+            .values(estado='fallido', intentos=OutboxNotificacion.intentos + 1, reclamado_por=None,
+                    ultimo_error='Reclamo vencido: el proceso no terminó el reparto')
+        ).rowcount
+        if descartadas:
+            logger.error("%s notificación(es) descartadas al vencer su reclamo tras %s intentos",
+                         descartadas, self.max_intentos)
+        db.session.execute(
+            update(OutboxNotificacion)
+            .where(*abandonadas)
+            .values(estado='pendiente', intentos=OutboxNotificacion.intentos + 1, reclamado_por=None)
+        )
+
+        # En PostgreSQL, SKIP LOCKED evita que dos workers esperen por las mismas entradas (SQLite lo ignora)
+        candidatas = db.session.query(OutboxNotificacion.id).filter(
+            OutboxNotificacion.estado == 'pendiente',
+            OutboxNotificacion.proximo_intento <= ahora
+        ).order_by(OutboxNotificacion.id).limit(self.entradas_por_ciclo).with_for_update(skip_locked=True)
+
+        db.session.execute(
+            update(OutboxNotificacion)
+            .where(OutboxNotificacion.id.in_(candidatas.scalar_subquery()),
+                   OutboxNotificacion.estado == 'pendiente')
+            .values(estado='procesando', reclamado_por=reclamo, reclamado_en=ahora)
+        )
+        db.session.commit()
+
+        return [fila.id for fila in db.session.query(OutboxNotificacion.id)
+                .filter_by(reclamado_por=reclamo, estado='procesando')
+                .order_by(OutboxNotificacion.id)]
+
+    def _destinatarios(self, entrada, cache_tipos):
+        if entrada.destinatario_id is not None:
+            return [entrada.destinatario_id]
+        if entrada.tipo_destinatarios not in cache_tipos:
+            cache_tipos[entrada.tipo_destinatarios] = [
+                fila.id for fila in db.session.query(Usuario.id).filter(
+                    Usuario.tipo_usuario == entrada.tipo_destinatarios,
+                    Usuario.activo.is_(True)
+                )
+            ]
+        return cache_tipos[entrada.tipo_destinatarios]
+
+    def _repartir(self, entradas):
+        """Inserta las notificaciones de las entradas en lotes y las marca como enviadas"""
+        ahora = datetime.utcnow()
+        cache_tipos = {}
+        filas = []
+        usuarios = set()
+
+        for entrada in entradas:
+            for usuario_id in self._destinatarios(entrada, cache_tipos):
+                filas.append({
+                    'usuario_id': usuario_id,
+                    'prestamo_id': entrada.prestamo_id,
+                    'tipo': entrada.tipo,
+                    'titulo': entrada.titulo,
+                    'mensaje': entrada.mensaje,
+                    'urgencia': entrada.urgencia,
+                    'icono': entrada.icono,
+                    'leida': False,
+                    'fecha_creacion': entrada.fecha_creacion or ahora
+                })
+                usuarios.add(usuario_id)
+            entrada.estado = 'enviado'
+            entrada.fecha_envio = ahora
+            entrada.reclamado_por = None
+
+        # RETURNING trae los ids asignados para publicarlos en los flujos SSE
+        sentencia = insert(Notificacion).returning(
+            Notificacion.id, Notificacion.usuario_id, Notificacion.prestamo_id, Notificacion.titulo,
+            Notificacion.mensaje, Notificacion.urgencia, Notificacion.icono
+        )
+        insertadas = []
+        for inicio in range(0, len(filas), self.tamano_lote):
+            insertadas.extend(db.session.execute(sentencia, filas[inicio:inicio + self.tamano_lote]).all())
+
+        # Las inserciones masivas no pasan por el flush de la sesión
+        for usuario_id in usuarios:
+            invalidar_conteo_pendientes(usuario_id)
+        db.session.commit()
+
+        publicar_notificaciones(insertadas)
+        return len(filas)
+
+    def _registrar_fallo(self, entrada_id, error):
+        entrada = db.session.get(OutboxNotificacion, entrada_id)
+        entrada.intentos += 1
+        entrada.ultimo_error = str(error)[:1000]
+        entrada.reclamado_por = None
+        if entrada.intentos >= self.max_intentos:
+            entrada.estado = 'fallido'
+            logger.error("Notificación %s descartada tras %s intentos: %s", entrada_id, entrada.intentos, error)
+        else:
+            entrada.estado = 'pendiente'
+            entrada.proximo_intento = datetime.utcnow() + timedelta(
+                seconds=self.espera_base * 2 ** (entrada.intentos - 1))
+        db.session.commit()
+
+    def despachar(self):
+        """Procesa un lote de entradas pendientes y retorna cuántas se reclamaron"""
+        ids = self._reclamar()
+        if not ids:
+            return 0
+
+        entradas = OutboxNotificacion.query.filter(OutboxNotificacion.id.in_(ids)) \
+            .order_by(OutboxNotificacion.id).all()
+        try:
+            self._repartir(entradas)
+        except Exception:
+            db.session.rollback()
+            # Reintentar una por una para aislar la entrada que falla
+            for entrada_id in ids:
+                try:
+                    self._repartir([db.session.get(OutboxNotificacion, entrada_id)])
+                except Exception as e:
+                    db.session.rollback()
+                    self._registrar_fallo(entrada_id, e)
+
+        return len(ids)
+
+    def profundidad(self):
+        """Retorna la cantidad de entradas de la bandeja por estado"""
+        conteos = dict(
+            db.session.query(OutboxNotificacion.estado, func.count(OutboxNotificacion.id))
+            .group_by(OutboxNotificacion.estado)
+        )
+        mas_antigua = db.session.query(func.min(OutboxNotificacion.fecha_creacion)) \
+            .filter(OutboxNotificacion.estado == 'pendiente').scalar()
+        return {
+            'pendiente': conteos.get('pendiente', 0),
+            'procesando': conteos.get('procesando', 0),
+            'enviado': conteos.get('enviado', 0),
+            'fallido': conteos.get('fallido', 0),
+            'pendiente_mas_antigua': mas_antigua.strftime("%Y-%m-%d %H:%M:%S") if mas_antigua else None
+        }
+
+
+class PurgadorOutbox(TareaPeriodica):
+    """Elimina las entradas ya enviadas de la bandeja de salida pasada la retención.
+
+    Una vez repartida, la entrada queda en `notificaciones` de cada destinatario;
+    conservarla solo hace crecer la tabla y el conteo de `profundidad()`. Las
+    fallidas se conservan para poder revisarlas. Borra por lotes, igual que el
+    purgador de tokens.
+    """
+
+    def __init__(self, intervalo=3600, retencion_dias=7, tamano_lote=1000):
+        super().__init__('purgador-outbox', intervalo)
+        self.retencion_dias = retencion_dias
+        self.tamano_lote = tamano_lote
+        self.total_purgadas = 0
+
+    def init_app(self, app, habilitada=True):
+        self.intervalo = app.config.get('OUTBOX_PURGA_INTERVALO', self.intervalo)
+        self.retencion_dias = app.config.get('OUTBOX_RETENCION_DIAS', self.retencion_dias)
+        super().init_app(app, habilitada)
+
+    def ejecutar(self):
+        self.purgar()
+
+    def purgar(self, retencion_dias=None):
+        """Elimina las entradas enviadas antes del límite de retención y retorna cuántas borró"""
+        if retencion_dias is None:
+            retencion_dias = self.retencion_dias
+        limite = datetime.utcnow() - timedelta(days=retencion_dias)
+
+        purgadas = 0
+        while True:
+            lote = select(OutboxNotificacion.id).where(
+                OutboxNotificacion.estado == 'enviado',
+                OutboxNotificacion.fecha_envio < limite
+            ).limit(self.tamano_lote)
+            borradas = db.session.execute(
+                delete(OutboxNotificacion).where(OutboxNotificacion.id.in_(lote.scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            purgadas += borradas
+            if borradas < self.tamano_lote:
+                break
+
+        self.total_purgadas += purgadas
+        if purgadas:
+            logger.info("Purgador de la bandeja de salida: %s entrada(s) enviadas eliminadas", purgadas)
+        return purgadas
+
+
+despachador_notificaciones = DespachadorNotificaciones()
+purgador_outbox = PurgadorOutbox()
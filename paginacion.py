@@ -0,0 +1,102 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+
+class PaginaCursor:
+    """Página de resultados obtenida con paginación por cursor (keyset)"""
+
+    def __init__(self, items, per_page, cursor_anterior=None, cursor_siguiente=None,
+                 total=None, total_aproximado=False):
+        self.items = items
+        self.per_page = per_page
+        self.cursor_anterior = cursor_anterior
+        self.cursor_siguiente = cursor_siguiente
+        self.total = total
+        self.total_aproximado = total_aproximado
+
+    @property
+    def has_prev(self):
+        return self.cursor_anterior is not None
+
+    @property
+    def has_next(self):
+        return self.cursor_siguiente is not None
+
+
+def codificar_cursor(valor, identificador, direccion):
+    """Codifica la posición (valor de orden, id) como un cursor opaco para la URL"""
+    if isinstance(valor, datetime):
+        valor = valor.isoformat()
+    datos = json.dumps({'v': valor, 'id': identificador, 'd': direccion}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Retorna (valor, id, dirección) del cursor, o None si no es válido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode('utf-8'))
+        valor = datos['v']
+        if isinstance(valor, str):
+            valor = datetime.fromisoformat(valor)
+        if datos['d'] not in ('siguiente', 'anterior'):
+            return None
+        return valor, int(datos['id']), datos['d']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def paginar_por_cursor(consulta, columna_orden, columna_id, cursor=None, por_pagina=10,
+                       total=None, total_aproximado=False):
+    """Pagina una consulta en orden descendente por (columna_orden, columna_id).
+
+    En lugar de OFFSET, cada página continúa desde la última fila de la anterior
+    con una comparación de tuplas que aprovecha el índice de la columna de orden,
+    de modo que la página 500 cuesta lo mismo que la primera. No ejecuta COUNT(*):
+    el total, si se conoce, lo aporta el llamador.
+    """
+    posicion = decodificar_cursor(cursor) if cursor else None
+    clave = tuple_(columna_orden, columna_id)
+
+    if posicion is not None and posicion[2] == 'anterior':
+        # Página anterior: recorrer en orden ascendente desde el cursor e invertir
+        filas = consulta.filter(clave > tuple_(posicion[0], posicion[1])) \
+            .order_by(columna_orden.asc(), columna_id.asc()) \
+            .limit(por_pagina + 1).all()
+        hay_mas_anteriores = len(filas) > por_pagina
+        items = list(reversed(filas[:por_pagina]))
+        hay_siguientes = True
+    else:
+        if posicion is not None:
+            consulta = consulta.filter(clave < tuple_(posicion[0], posicion[1]))
+        filas = consulta.order_by(columna_orden.desc(), columna_id.desc()) \
+            .limit(por_pagina + 1).all()
+        items = filas[:por_pagina]
+        hay_siguientes = len(filas) > por_pagina
+        hay_mas_anteriores = posicion is not None
+
+    def _cursor(item, direccion):
+        return codificar_cursor(getattr(item, columna_orden.key), getattr(item, columna_id.key), direccion)
+
+    return PaginaCursor(
+        items=items,
+        per_page=por_pagina,
+        cursor_anterior=_cursor(items[0], 'anterior') if items and hay_mas_anteriores else None,
+        cursor_siguiente=_cursor(items[-1], 'siguiente') if items and hay_siguientes else None,
+        total=total,
+        total_aproximado=total_aproximado
+    )
+
+
+def url_cursor(endpoint, cursor=None):
+    """URL del endpoint con los filtros actuales y el cursor indicado (sin cursor: primera página)"""
+    argumentos = request.args.to_dict()
+    argumentos.pop('cursor', None)
+    argumentos.pop('page', None)
+    if cursor:
+        argumentos['cursor'] = cursor
+    return url_for(endpoint, **argumentos)
@@ -0,0 +1,54 @@
+"""
+Precarga de la aplicación en el proceso maestro de gunicorn (`preload_app`).
+
+Lo que se carga aquí antes del fork lo heredan todos los workers y se comparte
+copy-on-write: las plantillas compiladas, los índices en memoria de reservas y
+de búsqueda, y los módulos importados. Al terminar se cierran las conexiones
+del maestro y se congela el recolector de basura, para que sus pasadas en los
+workers no escriban en esos objetos y dupliquen las páginas de memoria.
+"""
+
+import gc
+import logging
+from time import perf_counter
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db
+from busqueda import indice_typeahead
+from intervalos import indice_reservas
+from base_datos import descartar_conexiones_heredadas
+
+logger = logging.getLogger(__name__)
+
+
+def precalentar(app):
+    """Carga plantillas e índices en memoria; retorna lo cargado y la duración"""
+    inicio = perf_counter()
+    resultado = {'plantillas': 0, 'indices': False}
+
+    for nombre in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(nombre)
+        resultado['plantillas'] += 1
+
+    with app.app_context():
+        try:
+            indice_reservas.reconstruir()
+            indice_typeahead.cargar()
+            resultado['indices'] = True
+        except SQLAlchemyError:
+            # Sin `flask iunp init` todavía: cada worker cargará los índices al usarlos
+            logger.warning("No se pudieron precargar los índices en memoria", exc_info=True)
+        finally:
+            db.session.remove()
+        db.engine.dispose()
+
+    gc.collect()
+    gc.freeze()
+    resultado['segundos'] = round(perf_counter() - inicio, 2)
+    return resultado
+
+
+def reiniciar_worker(app):
+    """Lo que un worker recién creado no debe compartir con el maestro"""
+    descartar_conexiones_heredadas(app)
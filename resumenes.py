@@ -0,0 +1,272 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Equipo, Prestamo, EstadoPrestamo, ResumenDiarioPrestamos
+from estadisticas import _valores_anteriores
+from base_datos import sin_limite_de_tiempo
+
+# Atributos del préstamo que determinan su fila en el resumen y lo que aporta a ella
+ATRIBUTOS_RESUMEN = ('estado', 'equipo_id', 'fecha_solicitud', 'fecha_inicio',
+                     'fecha_fin_programada', 'fecha_devolucion')
+
+DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
+
+# Rangos de hasta este largo se agrupan por día en la tendencia; los más largos, por mes
+DIAS_TENDENCIA_DIARIA = 62
+
+
+def _minutos(estado, fecha_inicio, fecha_fin_programada, fecha_devolucion):
+    """Duración del préstamo: la real si ya se devolvió, la programada si no"""
+    fin = fecha_devolucion if estado == EstadoPrestamo.DEVUELTO and fecha_devolucion else fecha_fin_programada
+    if fecha_inicio is None or fin is None:
+        return 0
+    return max(int((fin - fecha_inicio).total_seconds() // 60), 0)
+
+
+def _aporte(estado, fecha_solicitud, fecha_inicio, fecha_fin_programada, fecha_devolucion):
+    """Día y estado de la fila del resumen a la que aporta un préstamo, y sus minutos"""
+    estado = estado if estado is not None else EstadoPrestamo.SOLICITADO
+    dia = (fecha_solicitud or fecha_inicio or datetime.utcnow()).date()
+    return dia, estado, _minutos(estado, fecha_inicio, fecha_fin_programada, fecha_devolucion)
+
+
+def _sentencia_acumular(conexion):
+    """INSERT que suma a la fila existente del resumen, si el backend lo soporta"""
+    dialectos = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+    if conexion.dialect.name not in dialectos:
+        return None
+    tabla = ResumenDiarioPrestamos.__table__
+    sentencia = dialectos[conexion.dialect.name](tabla)
+    return sentencia.on_conflict_do_update(
+        index_elements=[tabla.c.fecha, tabla.c.categoria, tabla.c.estado],
+        set_={
+            'cantidad': tabla.c.cantidad + sentencia.excluded.cantidad,
+            'minutos_totales': tabla.c.minutos_totales + sentencia.excluded.minutos_totales,
+        }
+    )
+
+
+def _acumular(conexion, deltas):
+    """Suma los deltas {(fecha, categoria, estado): [cantidad, minutos]} a la tabla de resumen"""
+    filas = [
+        {'fecha': fecha, 'categoria': categoria, 'estado': estado,
+         'cantidad': cantidad, 'minutos_totales': minutos}
+        for (fecha, categoria, estado), (cantidad, minutos) in deltas.items() if cantidad or minutos
+    ]
+    if not filas:
+        return
+
+    sentencia = _sentencia_acumular(conexion)
+    if sentencia is not None:
+        conexion.execute(sentencia, filas)
+        return
+
+    # Otros backends: actualizar y, si la fila no existía, insertarla
+    tabla = ResumenDiarioPrestamos.__table__
+    for fila in filas:
+        resultado = conexion.execute(
+            update(tabla)
+            .where(tabla.c.fecha == fila['fecha'], tabla.c.categoria == fila['categoria'],
+                   tabla.c.estado == fila['estado'])
+            .values(cantidad=tabla.c.cantidad + fila['cantidad'],
+                    minutos_totales=tabla.c.minutos_totales + fila['minutos_totales'])
+        )
+        if resultado.rowcount == 0:
+            conexion.execute(insert(tabla), fila)
+
+
+def _cargar_valor_anterior(target, value, oldvalue, initiator):
+    return value
+
+
+# Sin historial activo, asignar un atributo expirado (p. ej. después de un commit) no carga su valor
+# anterior y el flush no sabría de qué fila del resumen restar el préstamo
+for _atributo in ATRIBUTOS_RESUMEN:
+    event.listen(getattr(Prestamo, _atributo), 'set', _cargar_valor_anterior, active_history=True, retval=True)
+event.listen(Equipo.categoria, 'set', _cargar_valor_anterior, active_history=True, retval=True)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _actualizar_resumenes(session, flush_context):
+    """Aplica al resumen diario los préstamos creados, modificados o eliminados en el flush"""
+    cambios = []
+
+    # Equipos que cambiaron de categoría: id -> categoría con la que se contaron sus préstamos
+    recategorizados = {}
+    for obj in session.dirty:
+        if isinstance(obj, Equipo):
+            anterior, = _valores_anteriores(obj, 'categoria')
+            if anterior is not None and anterior != obj.categoria:
+                recategorizados[obj.id] = anterior
+
+    for obj in session.new:
+        if isinstance(obj, Prestamo):
+            cambios.append(([getattr(obj, atributo) for atributo in ATRIBUTOS_RESUMEN], 1))
+
+    for obj in session.deleted:
+        if isinstance(obj, Prestamo):
+            cambios.append((_valores_anteriores(obj, *ATRIBUTOS_RESUMEN), -1))
+
+    for obj in session.dirty:
+        if isinstance(obj, Prestamo) and session.is_modified(obj, include_collections=False):
+            anteriores = _valores_anteriores(obj, *ATRIBUTOS_RESUMEN)
+            actuales = [getattr(obj, atributo) for atributo in ATRIBUTOS_RESUMEN]
+            if anteriores != actuales:
+                cambios.append((anteriores, -1))
+                cambios.append((actuales, 1))
+
+    if not cambios and not recategorizados:
+        return
+
+    conexion = session.connection()
+    equipo_ids = {valores[1] for valores, _ in cambios}
+    categorias = dict(conexion.execute(
+        select(Equipo.id, Equipo.categoria).where(Equipo.id.in_(equipo_ids))
+    ).all()) if equipo_ids else {}
+
+    deltas = defaultdict(lambda: [0, 0])
+    for (estado, equipo_id, *fechas), signo in cambios:
+        # Lo que se resta sale de la categoría con la que se contó, aunque el equipo cambie en este flush
+        categoria = recategorizados.get(equipo_id) if signo < 0 else None
+        categoria = categoria or categorias.get(equipo_id)
+        if categoria is None:
+            continue
+        dia, estado, minutos = _aporte(estado, *fechas)
+        delta = deltas[(dia, categoria, estado)]
+        delta[0] += signo
+        delta[1] += signo * minutos
+
+    if recategorizados:
+        # Los préstamos que no cambiaron en este flush pasan completos a la categoría nueva
+        ya_aplicados = {obj.id for obj in list(session.new) + list(session.dirty)
+                       if isinstance(obj, Prestamo)}
+        consulta = select(
+            Prestamo.id, Prestamo.equipo_id, Prestamo.estado, Prestamo.fecha_solicitud, Prestamo.fecha_inicio,
+            Prestamo.fecha_fin_programada, Prestamo.fecha_devolucion, Equipo.categoria
+        ).join(Equipo, Prestamo.equipo_id == Equipo.id).where(Prestamo.equipo_id.in_(list(recategorizados)))
+        for prestamo_id, equipo_id, estado, *fechas, categoria in conexion.execute(consulta):
+            if prestamo_id in ya_aplicados:
+                continue
+            dia, estado, minutos = _aporte(estado, *fechas)
+            for categoria, signo in ((recategorizados[equipo_id], -1), (categoria, 1)):
+                delta = deltas[(dia, categoria, estado)]
+                delta[0] += signo
+                delta[1] += signo * minutos
+
+    _acumular(conexion, deltas)
+
+
+def reconstruir_resumenes(desde=None, hasta=None):
+    """Recalcula el resumen diario desde la tabla de préstamos, completo o para un rango de días.
+
+    Retorna la cantidad de préstamos leídos y de filas de resumen escritas.
+    """
+    dia_prestamo = func.coalesce(Prestamo.fecha_solicitud, Prestamo.fecha_inicio)
+    consulta = select(
+        Prestamo.estado, Prestamo.fecha_solicitud, Prestamo.fecha_inicio,
+        Prestamo.fecha_fin_programada, Prestamo.fecha_devolucion, Equipo.categoria
+    ).join(Equipo, Prestamo.equipo_id == Equipo.id)
+    borrado = delete(ResumenDiarioPrestamos)
+    if desde:
+        consulta = consulta.where(dia_prestamo >= datetime.combine(desde, datetime.min.time()))
+        borrado = borrado.where(ResumenDiarioPrestamos.fecha >= desde)
+    if hasta:
+        consulta = consulta.where(dia_prestamo < datetime.combine(hasta + timedelta(days=1), datetime.min.time()))
+        borrado = borrado.where(ResumenDiarioPrestamos.fecha <= hasta)
+
+    sin_limite_de_tiempo(db.session.connection())
+    acumulado = defaultdict(lambda: [0, 0])
+    leidos = 0
+    for estado, *fechas, categoria in db.session.execute(consulta.execution_options(yield_per=5000)):
+        dia, estado, minutos = _aporte(estado, *fechas)
+        fila = acumulado[(dia, categoria, estado)]
+        fila[0] += 1
+        fila[1] += minutos
+        leidos += 1
+
+    db.session.execute(borrado)
+    if acumulado:
+        db.session.execute(insert(ResumenDiarioPrestamos), [
+            {'fecha': fecha, 'categoria': categoria, 'estado': estado,
+             'cantidad': cantidad, 'minutos_totales': minutos}
+            for (fecha, categoria, estado), (cantidad, minutos) in acumulado.items()
+        ])
+    db.session.commit()
+
+    return {'prestamos': leidos, 'filas': len(acumulado)}
+
+
+def asegurar_resumenes():
+    """Llena el resumen si está vacío pero ya hay préstamos (p. ej. al actualizar una instalación existente)"""
+    hay_resumen = db.session.execute(select(ResumenDiarioPrestamos.fecha).limit(1)).first()
+    if hay_resumen is None and db.session.execute(select(Prestamo.id).limit(1)).first() is not None:
+        reconstruir_resumenes()
+
+
+def datos_resumen(desde, hasta):
+    """Datos de los gráficos de reportes para los préstamos solicitados entre dos fechas (inclusive)"""
+    filas = db.session.execute(
+        select(ResumenDiarioPrestamos.fecha, ResumenDiarioPrestamos.categoria, ResumenDiarioPrestamos.estado,
+               ResumenDiarioPrestamos.cantidad, ResumenDiarioPrestamos.minutos_totales)
+        .where(ResumenDiarioPrestamos.fecha.between(desde, hasta))
+    ).all()
+
+    diaria = (hasta - desde).days < DIAS_TENDENCIA_DIARIA
+    if diaria:
+        periodos = [desde + timedelta(days=n) for n in range((hasta - desde).days + 1)]
+        periodo_de = lambda fecha: fecha
+        etiqueta = lambda periodo: periodo.strftime('%d/%m')
+    else:
+        periodos = []
+        periodo = date(desde.year, desde.month, 1)
+        while periodo <= hasta:
+            periodos.append(periodo)
+            periodo = date(periodo.year + periodo.month // 12, periodo.month % 12 + 1, 1)
+        periodo_de = lambda fecha: date(fecha.year, fecha.month, 1)
+        etiqueta = lambda periodo: periodo.strftime('%m/%Y')
+
+    solicitados = dict.fromkeys(periodos, 0)
+    devueltos = dict.fromkeys(periodos, 0)
+    estados = dict.fromkeys((estado.value for estado in EstadoPrestamo), 0)
+    categorias = {}
+    dias_semana = [0] * 7
+    minutos_devueltos = 0
+
+    for fecha, categoria, estado, cantidad, minutos in filas:
+        periodo = periodo_de(fecha)
+        solicitados[periodo] += cantidad
+        estados[estado.value] += cantidad
+        categorias[categoria.value] = categorias.get(categoria.value, 0) + cantidad
+        dias_semana[fecha.weekday()] += cantidad
+        if estado == EstadoPrestamo.DEVUELTO:
+            devueltos[periodo] += cantidad
+            minutos_devueltos += minutos
+
+    total = sum(estados.values())
+    categorias_ordenadas = sorted(categorias.items(), key=lambda item: -item[1])
+    cerrados = estados[EstadoPrestamo.DEVUELTO.value] + estados[EstadoPrestamo.VENCIDO.value]
+    return {
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'total': total,
+        'tendencia': {
+            'agrupacion': 'dia' if diaria else 'mes',
+            'etiquetas': [etiqueta(periodo) for periodo in periodos],
+            'solicitados': list(solicitados.values()),
+            'devueltos': list(devueltos.values()),
+        },
+        'estados': estados,
+        # Listas paralelas en lugar de diccionarios: jsonify ordena las claves
+        'categorias': {
+            'etiquetas': [categoria for categoria, _ in categorias_ordenadas],
+            'cantidades': [cantidad for _, cantidad in categorias_ordenadas],
+        },
+        'dias_semana': {'etiquetas': DIAS_SEMANA, 'cantidades': dias_semana},
+        'duracion_promedio_dias': round(minutos_devueltos / estados[EstadoPrestamo.DEVUELTO.value] / 1440, 1)
+        if estados[EstadoPrestamo.DEVUELTO.value] else None,
+        'tasa_retorno': round(100 * estados[EstadoPrestamo.DEVUELTO.value] / cerrados, 1) if cerrados else None,
+        'tasa_vencimiento': round(100 * estados[EstadoPrestamo.VENCIDO.value] / total, 1) if total else None,
+    }
@@ -0,0 +1,47 @@
+// Notificaciones en tiempo real: el servidor empuja solo lo nuevo (sin sondeo).
+// base.html deja la URL del flujo en <body data-notificaciones> solo para usuarios con sesión
+(function () {
+    const datos = document.body.dataset;
+    const url = datos.notificaciones;
+    if (!url || !window.EventSource) {
+        return;
+    }
+    const insignia = document.getElementById('notificaciones-conteo');
+    const sondeo = (parseInt(datos.notificacionesSondeo, 10) || 30) * 1000;
+
+    function mostrarConteo(conteo) {
+        insignia.textContent = conteo;
+        insignia.classList.toggle('d-none', conteo === 0);
+    }
+
+    // Si el worker no tiene hilos libres para el flujo (503), se consulta el conteo y se reintenta más tarde
+    function consultarConteo() {
+        fetch(datos.notificacionesConteo, {credentials: 'same-origin'})
+            .then(function (respuesta) { return respuesta.ok ? respuesta.json() : null; })
+            .then(function (cuerpo) {
+                if (cuerpo) {
+                    mostrarConteo(cuerpo.conteo);
+                }
+            })
+            .catch(function () {});
+    }
+
+    function conectar() {
+        const flujo = new EventSource(url);
+        flujo.addEventListener('conteo', function (evento) {
+            mostrarConteo(JSON.parse(evento.data).conteo);
+        });
+        flujo.addEventListener('notificacion', function (evento) {
+            document.dispatchEvent(new CustomEvent('notificacion', {detail: JSON.parse(evento.data)}));
+        });
+        flujo.addEventListener('error', function () {
+            // CONNECTING: reconexión automática tras el fin normal del flujo; CLOSED: el servidor lo rechazó
+            if (flujo.readyState === EventSource.CLOSED) {
+                consultarConteo();
+                setTimeout(conectar, sondeo);
+            }
+        });
+    }
+
+    conectar();
+})();
@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TareaPeriodica:
+    """Ejecuta una función periódicamente en un hilo propio, dentro del contexto de la aplicación"""
+
+    def __init__(self, nombre, intervalo):
+        self.nombre = nombre
+        self.intervalo = intervalo
+        self.app = None
+        self._hilo = None
+        self._pid = None
+        self._detener = threading.Event()
+        self._despertar = threading.Event()
+        self._lock = threading.Lock()
+
+    def ejecutar(self):
+        """Trabajo de cada ciclo; las subclases deben implementarlo"""
+        raise NotImplementedError
+
+    def init_app(self, app, habilitada=True):
+        """Asocia la tarea a la aplicación y la arranca con la primera petición del proceso"""
+        self.app = app
+        if not habilitada:
+            return
+
+        @app.before_request
+        def _asegurar_tarea():
+            self.iniciar()
+
+    def iniciar(self):
+        """Arranca el hilo si no está corriendo en este proceso (seguro tras un fork)"""
+        if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive():
+                return
+            self._detener.clear()
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._bucle, name=self.nombre, daemon=True)
+            self._hilo.start()
+
+    def detener(self, timeout=5):
+        """Detiene el hilo y espera a que termine el ciclo en curso"""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None and self._hilo.is_alive():
+            self._hilo.join(timeout)
+
+    def despertar(self):
+        """Adelanta el siguiente ciclo sin esperar al intervalo"""
+        self._despertar.set()
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                with self.app.app_context():
+                    self.ejecutar()
+            except Exception:
+                logger.exception("Error en la tarea periódica %s", self.nombre)
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
@@ -0,0 +1,59 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from models import db, TokenAcceso
+from tareas import TareaPeriodica
+
+logger = logging.getLogger(__name__)
+
+
+class PurgadorTokens(TareaPeriodica):
+    """Elimina los tokens de acceso único que expiraron hace más de `retencion`.
+
+    El uso de cada token ya queda en el historial de acciones (`acceso_unico`),
+    así que las filas vencidas solo hacen crecer `tokens_acceso` y su índice.
+    Borra por lotes para no mantener bloqueada la base de datos en una sola
+    transacción larga.
+    """
+
+    def __init__(self, intervalo=3600, retencion_horas=24, tamano_lote=1000):
+        super().__init__('purgador-tokens', intervalo)
+        self.retencion_horas = retencion_horas
+        self.tamano_lote = tamano_lote
+        self.total_purgados = 0
+
+    def init_app(self, app, habilitada=True):
+        self.intervalo = app.config.get('TOKENS_PURGA_INTERVALO', self.intervalo)
+        self.retencion_horas = app.config.get('TOKENS_RETENCION_HORAS', self.retencion_horas)
+        super().init_app(app, habilitada)
+
+    def ejecutar(self):
+        self.purgar()
+
+    def purgar(self, retencion_horas=None):
+        """Elimina los tokens expirados antes del límite de retención y retorna cuántos borró"""
+        if retencion_horas is None:
+            retencion_horas = self.retencion_horas
+        limite = datetime.utcnow() - timedelta(hours=retencion_horas)
+
+        purgados = 0
+        while True:
+            lote = select(TokenAcceso.id).where(TokenAcceso.expira_en < limite).limit(self.tamano_lote)
+            borrados = db.session.execute(
+                delete(TokenAcceso).where(TokenAcceso.id.in_(lote.scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            purgados += borrados
+            if borrados < self.tamano_lote:
+                break
+
+        self.total_purgados += purgados
+        if purgados:
+            logger.info("Purgador de tokens: %s token(s) expirados eliminados", purgados)
+        return purgados
+
+
+purgador_tokens = PurgadorTokens()
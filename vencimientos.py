@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+from intervalos import actualizar_estado_equipo, en_curso
+from models import db, Equipo, Prestamo, EstadoPrestamo
+from tareas import TareaPeriodica
+
+logger = logging.getLogger(__name__)
+
+
+class BarredorVencimientos(TareaPeriodica):
+    """Marca como VENCIDO los préstamos aprobados cuya fecha de fin ya pasó.
+
+    También marca como prestados los equipos cuyo préstamo aprobado empezó
+    desde la pasada anterior.
+
+    Cada pasada busca por el índice (estado, fecha_fin_programada) los
+    aprobados cuya fecha de fin ya pasó, así que solo lee los que hay que
+    marcar. La base de datos es la única fuente: no depende de cuándo se
+    confirmó la aprobación ni de qué worker la hizo. Cada worker corre su
+    propio barredor; la transición es condicional y solo uno aplica cada
+    vencimiento.
+    """
+
+    def __init__(self, intervalo=60, historial=50):
+        super().__init__('barredor-vencimientos', intervalo)
+        self._lock_barrido = threading.Lock()
+        self.ejecuciones = deque(maxlen=historial)
+        self.total_vencidos = 0
+
+    def init_app(self, app, habilitada=True):
+        self.intervalo = app.config.get('BARREDOR_VENCIMIENTOS_INTERVALO', self.intervalo)
+        super().init_app(app, habilitada)
+
+    def ejecutar(self):
+        self.barrer()
+
+    def _prestar_iniciados(self, ahora):
+        """Marca como prestados los equipos disponibles que ya tienen un préstamo en curso; retorna cuántos"""
+        ids = db.session.execute(
+            select(Prestamo.equipo_id).join(Equipo, Equipo.id == Prestamo.equipo_id)
+            .where(en_curso(ahora), Equipo.estado == 'disponible').distinct()
+        ).scalars().all()
+        if not ids:
+            return 0
+        # Mismo UPDATE condicional que los vencimientos: solo un worker aplica cada cambio
+        if not db.session.execute(
+            update(Equipo).where(Equipo.id.in_(ids), Equipo.estado == 'disponible')
+            .values(estado=Equipo.estado).execution_options(synchronize_session=False)
+        ).rowcount:
+            return 0
+        equipos = Equipo.query.filter(Equipo.id.in_(ids), Equipo.estado == 'disponible').populate_existing().all()
+        for equipo in equipos:
+            actualizar_estado_equipo(equipo, ahora)
+        return sum(1 for equipo in equipos if equipo.estado == 'prestado')
+
+    def barrer(self, origen='programado'):
+        """Ejecuta una pasada y retorna el registro de métricas de la ejecución"""
+        with self._lock_barrido:
+            inicio = time.perf_counter()
+            ahora = datetime.utcnow()
+
+            # UPDATE condicional sin cambios: toma el bloqueo de escritura (las filas en PostgreSQL)
+            # antes de leer, y su rowcount dice cuántos siguen aprobados. Un préstamo devuelto antes
+            # de vencer, o que otro worker ya marcó, queda fuera
+            vencen = (Prestamo.estado == EstadoPrestamo.APROBADO, Prestamo.fecha_fin_programada < ahora)
+            vencidos = db.session.execute(
+                update(Prestamo).where(*vencen)
+                .values(estado=Prestamo.estado)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if vencidos:
+                # La transición pasa por el ORM para que estadísticas, resumen e índice de reservas la vean
+                prestamos = Prestamo.query.filter(*vencen).populate_existing().all()
+                for prestamo in prestamos:
+                    prestamo.estado = EstadoPrestamo.VENCIDO
+                vencidos = len(prestamos)
+
+            iniciados = self._prestar_iniciados(ahora)
+            db.session.commit()
+
+            ejecucion = {
+                'fecha': ahora.strftime("%Y-%m-%d %H:%M:%S"),
+                'origen': origen,
+                'vencidos': vencidos,
+                'equipos_prestados': iniciados,
+                'duracion_ms': round((time.perf_counter() - inicio) * 1000, 2)
+            }
+            self.ejecuciones.append(ejecucion)
+            self.total_vencidos += vencidos
+
+        if vencidos:
+            logger.info("Barredor de vencimientos: %s préstamo(s) marcados como vencidos", vencidos)
+        if iniciados:
+            logger.info("Barredor de vencimientos: %s equipo(s) marcados como prestados", iniciados)
+        return ejecucion
+
+    def metricas(self):
+        """Retorna las métricas acumuladas del barredor en este proceso"""
+        proximo = db.session.query(func.min(Prestamo.fecha_fin_programada)) \
+            .filter(Prestamo.estado == EstadoPrestamo.APROBADO).scalar()
+        return {
+            'intervalo_segundos': self.intervalo,
+            'proximo_vencimiento': proximo.strftime("%Y-%m-%d %H:%M:%S") if proximo else None,
+            'total_vencidos': self.total_vencidos,
+            'ejecuciones': list(self.ejecuciones)
+        }
+
+
+barredor_vencimientos = BarredorVencimientos()